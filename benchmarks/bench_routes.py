@@ -0,0 +1,316 @@
+## Latencia (p50/p95/p99) y throughput por ruta de main.py. Guarda el resultado en JSON
+## (benchmarks/results/<commit>.json) y, con --baseline, compara contra una corrida anterior.
+## Dependencias extra: pip install -r requirements.txt -r benchmarks/requirements.txt
+##   python benchmarks/bench_routes.py --edges 100000                 # sustituto en memoria
+##   python benchmarks/bench_routes.py --backend neo4j --load         # Neo4j local (NEO4J_* del entorno)
+##   python benchmarks/bench_routes.py --url http://localhost:8000     # servidor ya levantado
+##   python benchmarks/bench_routes.py --routes rec/ --baseline benchmarks/results/abc123.json
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+# ids de nodos creados por el benchmark, lejos de los del CSV
+WRITE_ID_BASE = 10 ** 9
+
+# rutas que recorren o reconstruyen todo el grafo: como mucho estas solicitudes (sin warmup)
+PESADAS = {
+    "POST /vis/layout": 2,
+    "POST /stats/aggregates/rebuild": 3,
+    "POST /rec/similarity/rebuild": 3,
+    "POST /rec/engine/refresh": 3,
+    "POST /rec/snapshot/refresh": 3,
+    "POST /rec/precomputed/rebuild": 2,
+}
+# rutas que abren su propia conexion a Neo4j (no usan main.db)
+SOLO_NEO4J = {"POST /rec/precomputed/rebuild"}
+
+
+def sample_ids(path, k, seed):
+    ids = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if row and row[0] != "Relacion":
+                ids.setdefault(row[0], []).append(int(row[1]))
+            elif row and row[1] == "VIO":
+                ids.setdefault("VIO", []).append((int(row[2]), int(row[3])))
+    rng = random.Random(seed)
+    return {label: rng.choices(values, k=k) for label, values in ids.items()}
+
+
+## (nombre, metodo, funcion i -> (ruta, cuerpo JSON | None)); i es el numero de solicitud
+def build_routes(ids):
+    def pick(label):
+        return lambda i: ids[label][i % len(ids[label])]
+
+    user, movie, vio = pick("Usuario"), pick("Pelicula"), pick("VIO")
+
+    def vio_rel(i, **extra):
+        a, b = vio(i)
+        return {"from_label": "Usuario", "from_id": a, "to_label": "Pelicula", "to_id": b, "relation_type": "VIO", **extra}
+
+    def vio_rels(i, **extra):
+        pairs = [vio(i * 10 + j) for j in range(10)]
+        return {"from_label": "Usuario", "from_ids": [a for a, _ in pairs], "to_label": "Pelicula",
+                "to_ids": [b for _, b in pairs], "relation_type": "VIO", **extra}
+
+    bulk_user = lambda i, j: 10 ** 6 + i * 100 + j  # noqa: E731
+    vis_simple = {"f_label": "Usuario", "f_val": "nombre", "t_label": "Pelicula", "t_val": "titulo", "rel": "VIO", "limit": 50}
+    vis_filter = {"labels": ["Usuario"], "rels": ["VIO", "CALIFICO"], "cond": ["edad,>,30"], "limit": 100}
+    vis_filter_where = {"rels": ["VIO"], "limit": 100, "where": [
+        {"tipo": "label", "labels": ["Usuario"]}, {"tipo": "rango", "prop": "edad", "min": 25, "max": 40},
+        {"tipo": "cmp", "nodo": "m", "prop": "rating", "op": ">=", "valor": 7}]}
+    new_user = lambda i: {"id": WRITE_ID_BASE + i, "nombre": f"Bench {i}", "edad": 30, "pais": "Chile",  # noqa: E731
+                          "suscripcion": "Premium", "ultima_fecha_vista": "2024-01-01", "dispositivo": "PC",
+                          "activo": True, "intereses": ["Drama"]}
+    node_simple = lambda i, **p: {"id": WRITE_ID_BASE + i, "nombre": f"Bench {i}", "nacionalidad": "Chile",  # noqa: E731
+                                         "edad": 40, "premios": 1, "activo": True, **p}
+    return [
+        ("GET /", "GET", lambda i: ("/", None)),
+        ("GET /metrics", "GET", lambda i: ("/metrics", None)),
+        ("GET /schema", "GET", lambda i: ("/schema", None)),
+        ("GET /cache/stats", "GET", lambda i: ("/cache/stats", None)),
+        ("GET /node/get-one", "GET", lambda i: ("/node/get-one", {"label": "Pelicula", "id": movie(i)})),
+        ("POST /rel-count", "POST", lambda i: ("/rel-count", {"rel": "VIO", "id": user(i), "label": "Usuario", "from_or_to": True})),
+        ("GET /nodes", "GET", lambda i: ("/nodes?limit=100", None)),
+        ("GET /nodes?stream", "GET", lambda i: ("/nodes?stream=true&props=id", None)),
+        ("GET /nodes/{label}", "GET", lambda i: (f"/nodes/Pelicula?limit=100&after={movie(i)}", None)),
+        ("GET /search/{id}", "GET", lambda i: (f"/search/{movie(i)}", None)),
+        ("GET /searchidlabel", "GET", lambda i: (f"/searchidlabel/{movie(i)}/Pelicula", None)),
+        ("GET /top-rating", "GET", lambda i: ("/top-rating/Pelicula", None)),
+        ("GET /top-views", "GET", lambda i: ("/top-views/Pelicula", None)),
+        ("GET /users-stats", "GET", lambda i: ("/users-stats/", None)),
+        ("GET /rec/user graph", "GET", lambda i: (f"/rec/user/{user(i)}", None)),
+        ("GET /rec/user item_knn", "GET", lambda i: (f"/rec/user/{user(i)}?engine=item_knn", None)),
+        ("GET /rec/user svd", "GET", lambda i: (f"/rec/user/{user(i)}?engine=svd", None)),
+        ("POST /rec/batch", "POST", lambda i: ("/rec/batch", {"ids": [user(i + j) for j in range(100)], "engine": "item_knn"})),
+        ("GET /rec/subgenre", "GET", lambda i: (f"/rec/subgenre/{user(i)}?subgenres=2", None)),
+        ("GET /rec/actor", "GET", lambda i: (f"/rec/actor/{user(i)}", None)),
+        ("GET /rec/director", "GET", lambda i: (f"/rec/director/{user(i)}", None)),
+        ("GET /rec/hybrid", "GET", lambda i: (f"/rec/hybrid/{user(i)}", None)),
+        ("POST /vis-simple png", "POST", lambda i: ("/vis-simple", {**vis_simple, "limit": 20 + i % 30})),
+        ("POST /vis-simple json", "POST", lambda i: ("/vis-simple", {**vis_simple, "format": "json"})),
+        ("POST /vis-simple binary", "POST", lambda i: ("/vis-simple", {**vis_simple, "format": "binary"})),
+        ("POST /vis-filter png", "POST", lambda i: ("/vis-filter", {**vis_filter, "limit": 50 + i % 50})),
+        ("POST /vis-filter json", "POST", lambda i: ("/vis-filter", {**vis_filter, "format": "json"})),
+        ("POST /vis-filter where json", "POST", lambda i: ("/vis-filter", {**vis_filter_where, "format": "json"})),
+        ("POST /user", "POST", lambda i: ("/user", new_user(i))),
+        ("POST /movie", "POST", lambda i: ("/movie", {"id": WRITE_ID_BASE + i, "titulo": f"Bench {i}", "año": 2024,
+                                                      "duracion": 100.0, "rating": 7.5, "sinopsis": "bench", "activo": True})),
+        ("POST /serie", "POST", lambda i: ("/serie", {"id": WRITE_ID_BASE + i, "titulo": f"Bench {i}", "temporadas": 2,
+                                                      "episodios": 16, "rating": 7.5, "sinopsis": "bench", "activo": True})),
+        ("POST /genre", "POST", lambda i: ("/genre", {"id": WRITE_ID_BASE + i, "nombre": f"Bench {i}", "popularidad": 5,
+                                                      "descripcion": "bench", "subgeneros": ["a"], "activo": True})),
+        ("POST /actor", "POST", lambda i: ("/actor", node_simple(i))),
+        ("POST /director", "POST", lambda i: ("/director", node_simple(i))),
+        ("POST /node/create-single-label", "POST", lambda i: ("/node/create-single-label", {"label": "Genero"})),
+        ("POST /node/create-multiple-labels", "POST", lambda i: ("/node/create-multiple-labels", {"labels": ["Actor", "Director"]})),
+        ("POST /node/create-with-properties", "POST", lambda i: ("/node/create-with-properties", {
+            "label": "Actor", "properties": node_simple(10 ** 5 + i)})),
+        ("PUT /node/add-properties", "PUT", lambda i: ("/node/add-properties", {"label": "Usuario", "id": WRITE_ID_BASE + i, "properties": {"bench": i}})),
+        ("POST /nodes/{label}/add_properties", "POST", lambda i: ("/nodes/Usuario/add_properties", {
+            "node_ids": [bulk_user(i, j) for j in range(100)], "properties": {"bench": i}})),
+        ("PUT /node/update-properties", "PUT", lambda i: ("/node/update-properties", {"label": "Usuario", "id": WRITE_ID_BASE + i, "properties": {"edad": 31}})),
+        ("PUT /nodes/{label}/update_properties", "PUT", lambda i: ("/nodes/Usuario/update_properties", {
+            "node_ids": [bulk_user(i, j) for j in range(100)], "properties": {"edad": 32}})),
+        ("DELETE /node/delete-properties", "DELETE", lambda i: ("/node/delete-properties", {"label": "Usuario", "id": WRITE_ID_BASE + i, "properties": ["bench"]})),
+        ("DELETE /nodes/{label}/delete_properties", "DELETE", lambda i: ("/nodes/Usuario/delete_properties", {
+            "node_ids": [bulk_user(i, j) for j in range(100)], "properties": ["bench"]})),
+        ("POST /relation/create", "POST", lambda i: ("/relation/create", {
+            "from_label": "Usuario", "from_id": WRITE_ID_BASE + i, "to_label": "Pelicula", "to_id": movie(i),
+            "relation_type": "RECOMENDO", "properties": {"fecha": "2024-01-01", "razon": "bench", "confianza": 0.5}})),
+        ("PUT /relation/add-properties", "PUT", lambda i: ("/relation/add-properties", vio_rel(i, properties={"bench": i}))),
+        ("PUT /relations/add-multiple-properties", "PUT", lambda i: ("/relations/add-multiple-properties", vio_rels(i, properties={"bench": i}))),
+        ("PUT /relation/update-properties", "PUT", lambda i: ("/relation/update-properties", vio_rel(i, properties={"rating": 8.0}))),
+        ("PUT /relations/update-multiple", "PUT", lambda i: ("/relations/update-multiple", vio_rels(i, properties={"dispositivo": "PC"}))),
+        ("DELETE /relation/delete-properties", "DELETE", lambda i: ("/relation/delete-properties", vio_rel(i, properties=["bench"]))),
+        ("DELETE /relations/delete-multiple-properties", "DELETE", lambda i: ("/relations/delete-multiple-properties", vio_rels(i, properties=["bench"]))),
+        ("DELETE /relation/delete", "DELETE", lambda i: ("/relation/delete", {
+            "from_label": "Usuario", "from_id": WRITE_ID_BASE + i, "to_label": "Pelicula", "to_id": movie(i), "relation_type": "RECOMENDO"})),
+        ("DELETE /relations/delete-multiple", "DELETE", lambda i: ("/relations/delete-multiple", {
+            "from_label": "Usuario", "from_ids": [bulk_user(i, j) for j in range(10)], "to_label": "Pelicula",
+            "to_ids": [movie(i * 10 + j) for j in range(10)], "relation_type": "RECOMENDO"})),
+        ("DELETE /node/delete", "DELETE", lambda i: ("/node/delete", {"label": "Usuario", "id": WRITE_ID_BASE + i})),
+        ("POST /bulk/user x100", "POST", lambda i: ("/bulk/user", [new_user(bulk_user(i, j)) for j in range(100)])),
+        ("POST /bulk/relations x100", "POST", lambda i: ("/bulk/relations", [
+            {"type": "VIO", "from_id": user(i * 100 + j), "to_id": movie(i * 100 + j), "fecha": "2024-01-01",
+             "dispositivo": "PC", "rating": 5.0} for j in range(100)])),
+        ("DELETE /nodes/delete-multiple", "DELETE", lambda i: ("/nodes/delete-multiple", {
+            "label": "Usuario", "ids": [bulk_user(i, j) for j in range(100)]})),
+        ("POST /vis/layout", "POST", lambda i: ("/vis/layout?iterations=10", None)),
+        ("POST /stats/aggregates/rebuild", "POST", lambda i: ("/stats/aggregates/rebuild", None)),
+        ("POST /rec/similarity/rebuild", "POST", lambda i: ("/rec/similarity/rebuild", None)),
+        ("POST /rec/engine/refresh", "POST", lambda i: ("/rec/engine/refresh", None)),
+        ("GET /rec/snapshot", "GET", lambda i: ("/rec/snapshot", None)),
+        ("POST /rec/snapshot/refresh", "POST", lambda i: ("/rec/snapshot/refresh", None)),
+        ("POST /rec/precomputed/rebuild", "POST", lambda i: ("/rec/precomputed/rebuild?top_n=20", None)),
+        ("GET /rec/precomputed", "GET", lambda i: ("/rec/precomputed", None)),
+        ("POST /rec/precomputed/invalidate", "POST", lambda i: ("/rec/precomputed/invalidate", {"ids": [user(i)]})),
+        ("DELETE /cache", "DELETE", lambda i: ("/cache", None)),
+    ]
+
+
+async def measure(client, method, make, requests, concurrency, warmup):
+    for i in range(warmup):
+        path, body = make(i)
+        await client.request(method, path, json=body)
+    latencies, errors, nbytes = [], 0, 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors, nbytes
+        path, body = make(warmup + i)
+        async with sem:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+        nbytes += len(response.content)
+        if response.status_code >= 400:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput_rps": round(requests / wall, 1),
+        "avg_bytes": round(nbytes / requests),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["routes"]
+    print(f"\n{'ruta':<40} {'p50 antes':>10} {'p50 ahora':>10} {'p95 antes':>10} {'p95 ahora':>10}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before:
+            flag = "  <-- regresion" if now["p95_ms"] > before["p95_ms"] * 1.2 else ""
+            print(f"{name:<40} {before['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} "
+                  f"{before['p95_ms']:>10.2f} {now['p95_ms']:>10.2f}{flag}")
+
+
+async def run(args):
+    path = args.csv
+    if path is None:
+        from synthetic import generate
+        path = os.path.join(tempfile.gettempdir(), f"bench_{args.edges}_{args.seed}.csv")
+        if not os.path.exists(path):
+            generate(path, args.edges, args.seed)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    else:
+        # main.Settings exige credenciales aunque el backend sea en memoria
+        os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+        os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+        os.environ.setdefault("NEO4J_PASSWORD", "neo4j")
+        os.environ["CARGAR_CSV"] = "false"
+        import main
+        if args.backend == "memory":
+            from memory_db import AsyncMemoryGraphDB, MemoryGraphDB
+            start = time.perf_counter()
+            main.db = AsyncMemoryGraphDB(MemoryGraphDB.from_csv(path))
+            print(f"grafo en memoria cargado en {time.perf_counter() - start:.1f}s")
+        else:
+            # /rec/precomputed/* necesitan un archivo; uno temporal si no hay PRECOMPUTED_PATH
+            main.settings.precomputed_path = main.settings.precomputed_path or os.path.join(
+                tempfile.gettempdir(), "bench_recomendaciones.bin")
+            if args.load:
+                from loader import cargar_datos_paralelo
+                stats = cargar_datos_paralelo(main.settings.neo4j_uri, main.settings.neo4j_username,
+                                              main.settings.neo4j_password, path, workers=args.load_workers)
+                print(f"carga: {stats['rows']} filas en {stats['seconds']}s")
+        if args.snapshot:
+            snap = await main.load_snapshot()
+            print(f"snapshot de /rec/* cargado en {snap.seconds:.2f}s")
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=120)
+
+    ids = sample_ids(path, max(args.requests + args.warmup, 200) * 100, args.seed)
+    results = {}
+    async with client:
+        for name, method, make in build_routes(ids):
+            if args.routes and not any(r in name for r in args.routes):
+                continue
+            if name in SOLO_NEO4J and args.backend == "memory" and not args.url:
+                continue
+            if name in PESADAS:
+                results[name] = await measure(client, method, make, min(args.requests, PESADAS[name]), 1, 0)
+            else:
+                results[name] = await measure(client, method, make, args.requests, args.concurrency, args.warmup)
+            r = results[name]
+            print(f"{name:<40} p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms  "
+                  f"{r['throughput_rps']:8.1f} req/s  errores {r['errors']}")
+
+    with open(path, newline="", encoding="utf-8") as f:
+        edges = sum(1 for row in csv.reader(f) if row and row[0] == "Relacion")
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "backend": "url" if args.url else args.backend,
+            "csv": path,
+            "edges": edges,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "snapshot": args.snapshot,
+            "python": platform.python_version(),
+        },
+        "routes": results,
+    }
+    out = args.out or os.path.join(HERE, "results", f"{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nresultados -> {out}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de rutas de la API")
+    parser.add_argument("--backend", choices=["memory", "neo4j"], default="memory")
+    parser.add_argument("--url", help="medir un servidor ya levantado en vez de la app en proceso")
+    parser.add_argument("--csv", help="CSV con formato data.csv (por defecto uno sintetico de --edges)")
+    parser.add_argument("--edges", type=int, default=16000, help="relaciones del CSV sintetico (10k a 10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--load", action="store_true", help="cargar el CSV en Neo4j antes de medir")
+    parser.add_argument("--load-workers", type=int, default=4)
+    parser.add_argument("--snapshot", action="store_true", help="servir /rec/* desde el snapshot en memoria")
+    parser.add_argument("--requests", type=int, default=50, help="solicitudes medidas por ruta")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--routes", nargs="*", help="solo rutas que contengan alguno de estos textos")
+    parser.add_argument("--out")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    asyncio.run(run(parser.parse_args()))
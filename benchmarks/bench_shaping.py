@@ -0,0 +1,76 @@
+## Compara la conversion de registros anterior de _execute_query con shaping.shape_record
+## sobre los 21k registros de data.csv (nodos y relaciones del driver construidos en memoria).
+##   python benchmarks/bench_shaping.py [ruta_csv] [repeticiones]
+import csv
+import os
+import sys
+import time
+
+from neo4j import Record
+from neo4j.graph import Graph, Node
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from loader import parse_node, parse_relation  # noqa: E402
+from model import RELACIONES  # noqa: E402
+from shaping import shape_record  # noqa: E402
+
+
+## implementacion previa: dict(record) y luego dict(value) por valor
+def legacy_format(records):
+    records = [dict(record) for record in records]
+    return [
+        {key: dict(value) if hasattr(value, "__dict__") or isinstance(value, dict) else value for key, value in record.items()}
+        for record in records
+    ]
+
+
+def build_records(path):
+    graph = Graph()
+    nodes = {}
+    records = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if row[0] == "Relacion":
+                params = parse_relation(row)
+                from_label, to_label, _ = RELACIONES[row[1]]
+                a = nodes.get((from_label, params.pop("from_id")))
+                b = nodes.get((to_label, params.pop("to_id")))
+                rel = graph.relationship_type(row[1])(graph, f"5:{len(records)}", len(records), params)
+                rel._start_node, rel._end_node = a, b
+                records.append(Record({"a": a, "r": rel, "b": b}))
+            else:
+                props = parse_node(row)
+                node = Node(graph, f"4:{row[0]}:{props['id']}", len(nodes), [row[0]], props)
+                nodes[(row[0], props["id"])] = node
+                records.append(Record({"n": node, "labels": [row[0]], "id": props["id"]}))
+    return records
+
+
+def timed(fn, records, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(records)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "data.csv")
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    records = build_records(path)
+    # en fetch las claves vienen una vez de result.keys()
+    keys = [r.keys() for r in records]
+    cases = {
+        "legacy": legacy_format,
+        "shape_record": lambda rs: [shape_record(r) for r in rs],
+        "shape_record(keys)": lambda rs: [shape_record(r, None, k) for r, k in zip(rs, keys)],
+        "shape_record(props=id)": lambda rs: [shape_record(r, ["id"], k) for r, k in zip(rs, keys)],
+        "fetch_iter (generador)": lambda rs: sum(1 for _ in (shape_record(r, None, k) for r, k in zip(rs, keys))),
+    }
+    print(f"{len(records)} registros, mejor de {repeat}")
+    for name, fn in cases.items():
+        seconds = timed(fn, records, repeat)
+        print(f"  {name:<24} {seconds * 1000:8.1f} ms  {len(records) / seconds:12.0f} registros/s")
@@ -0,0 +1,498 @@
+## Sustituto en memoria de GraphDB para los benchmarks: mismos metodos y misma forma de
+## filas que las consultas Cypher de model.py, sobre diccionarios cargados desde un CSV con
+## el formato de data.csv. Mide el costo de la aplicacion (ruteo, serializacion, render,
+## motores en Python) sin servidor; para medir Neo4j usar bench_routes.py --backend neo4j.
+import csv
+import os
+import sys
+from collections import Counter, defaultdict
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from loader import parse_node, parse_relation  # noqa: E402
+from model import AGREGADOS, AGREGADOS_LABELS, MODELOS, RELACIONES, SIMILAR_K, GraphDB, label_valida, relacion_valida  # noqa: E402
+from recommender import _top_k_rows  # noqa: E402
+
+CONVERSIONES = {
+    None: lambda v: v,
+    "date": lambda v: v,
+    "toFloat": float,
+    "toInteger": lambda v: int(float(v)),
+    "toBoolean": lambda v: str(v).lower() == "true",
+}
+OPERADORES = {
+    "=": lambda a, b: a == b, "<>": lambda a, b: a != b, ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b, ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b,
+}
+
+
+## predicado de model.Filtro evaluado sobre un nodo (null no cumple, como en Cypher)
+def cumple(pred, node, label):
+    if pred.tipo == "label":
+        return label in pred.labels
+    value = node.get(pred.prop)
+    if value is None:
+        return False
+    if pred.tipo == "cmp":
+        return OPERADORES[pred.op](value, pred.valor)
+    if pred.tipo == "in":
+        return value in pred.valores
+    return (pred.min is None or value >= pred.min) and (pred.max is None or value <= pred.max)
+
+
+def convert(rel, props):
+    convs = dict(RELACIONES[rel][2])
+    return {k: CONVERSIONES[convs.get(k)](v) if v not in (None, "") else None for k, v in props.items()}
+
+
+class MemoryGraphDB(GraphDB):
+    def __init__(self, similar_rels=("VIO",), similar_k=SIMILAR_K):
+        self.similar_rels = "|".join(similar_rels)
+        self.similar_k = similar_k
+        self.cache = None
+        self.nodes = {label: {} for label in MODELOS}
+        self.out = {rel: defaultdict(list) for rel in RELACIONES}
+        self.inn = {rel: defaultdict(list) for rel in RELACIONES}
+        self.similar = {}
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        db = cls(**kwargs)
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if not row:
+                    continue
+                if row[0] == "Relacion":
+                    params = parse_relation(row)
+                    db._add_edge(row[1], params.pop("from_id"), params.pop("to_id"), convert(row[1], params))
+                else:
+                    props = parse_node(row)
+                    db.nodes[row[0]][props["id"]] = props
+        db.rebuild_aggregates()
+        db.rebuild_similarity()
+        return db
+
+    def close(self):
+        pass
+
+    ## ARISTAS
+    def _add_edge(self, rel, a, b, props):
+        from_label, to_label, _ = RELACIONES[rel]
+        if a not in self.nodes[from_label] or b not in self.nodes[to_label]:
+            return False
+        for other, existing in self.out[rel][a]:
+            if other == b and existing == props:
+                return True  # MERGE sobre todas las propiedades
+        self.out[rel][a].append((b, props))
+        self.inn[rel][b].append((a, props))
+        return True
+
+    def _remove_edges(self, rel, a, b):
+        self.out[rel][a] = [(o, p) for o, p in self.out[rel][a] if o != b]
+        self.inn[rel][b] = [(o, p) for o, p in self.inn[rel][b] if o != a]
+
+    def _labels_of(self, node_id):
+        return [label for label, nodes in self.nodes.items() if node_id in nodes]
+
+    def _edge_row(self, rel, a, b, props):
+        return {**props, "_type": rel, "_start": a, "_end": b}
+
+    ## SCHEMA / AGREGADOS / SIMILITUD
+    def ensure_schema(self):
+        return []
+
+    def schema_report(self):
+        return {"backend": "memory", "ok": True}
+
+    def rebuild_aggregates(self, batch_size=500):
+        for label in AGREGADOS_LABELS:
+            for node_id, node in self.nodes[label].items():
+                self._refresh_aggregates(node_id, node)
+        return [{"nodos": sum(len(self.nodes[label]) for label in AGREGADOS_LABELS)}]
+
+    def _refresh_aggregates(self, node_id, node):
+        for rel, props in AGREGADOS.items():
+            edges = self.inn[rel].get(node_id, [])
+            for prop, source in props:
+                if source is None:
+                    node[prop] = len(edges)
+                else:
+                    values = [p[source] for _, p in edges if p.get(source) is not None]
+                    node[prop] = sum(values) / len(values) if values else None
+
+    def rebuild_similarity(self, batch_size=200):
+        rels = self.similar_rels.split("|")
+        users = sorted(self.nodes["Usuario"])
+        movies = sorted(self.nodes["Pelicula"])
+        u_index = {u: i for i, u in enumerate(users)}
+        m_index = {m: i for i, m in enumerate(movies)}
+        pairs = {(u_index[a], m_index[b]) for rel in rels for a, edges in self.out[rel].items() for b, _ in edges}
+        if not pairs:
+            self.similar = {}
+            return [{"peliculas": len(movies)}]
+        rows, cols = zip(*pairs)
+        R = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(users), len(movies)))
+        co = (R.T @ R).tocsr()
+        co.setdiag(0)
+        co.eliminate_zeros()
+        degree = np.asarray(R.sum(axis=0)).ravel()
+        norm = sparse.diags(1 / np.sqrt(np.maximum(degree, 1)))
+        cos = (norm @ co @ norm).tocsr()
+        top = _top_k_rows(cos, self.similar_k)
+        self.similar = {}
+        for i in range(top.shape[0]):
+            start, end = top.indptr[i], top.indptr[i + 1]
+            self.similar[movies[i]] = [(movies[j], float(v)) for j, v in zip(top.indices[start:end], top.data[start:end])]
+        return [{"peliculas": len(movies)}]
+
+    def refresh_similarity(self, movie_ids):
+        return self.rebuild_similarity()
+
+    ## LECTURAS
+    def read_1_node(self, label, id):
+        node = self.nodes.get(label, {}).get(int(id))
+        return [{"n": node}] if node is not None else []
+
+    def count_relations(self, rel, id, label, from_or_to):
+        index = self.out if from_or_to else self.inn
+        return [{"rel_counted": len(index[rel].get(int(id), []))}]
+
+    def get_nodes_page(self, label, after=None, limit=1000, props=None):
+        ids = sorted(i for i in self.nodes[label] if after is None or i > int(after))[:int(limit)]
+        return [{"n": self._project(self.nodes[label][i], props)} for i in ids]
+
+    @staticmethod
+    def _project(node, props):
+        if props is None:
+            return node
+        return {k: node[k] for k in ["id", *props] if k in node}
+
+    def stream_nodes(self, label=None, props=None):
+        for lbl in ([label] if label else MODELOS):
+            for node in self.nodes[lbl].values():
+                yield {"n": self._project(node, props)}
+
+    def find_by_id(self, node_id):
+        node_id = int(node_id)
+        return [{"label": label, "id": node_id, "labels": [label]} for label in self._labels_of(node_id)]
+
+    def get_node_by_id_and_label(self, node_id, label):
+        node_id = int(node_id)
+        rows = [{"label": label, "labels": [label], "id": node_id}] if node_id in self.nodes.get(label, {}) else []
+        return self._format_node_match(rows)
+
+    def get_nodes_by_ids(self, label, ids):
+        return [{"n": self.nodes[label][int(i)]} for i in ids if int(i) in self.nodes[label]]
+
+    def simple_match(self, f_label, t_label, rel, limit):
+        rows = []
+        for a, edges in self.out[rel].items():
+            for b, props in edges:
+                if len(rows) >= int(limit):
+                    return rows
+                rows.append({"a": self.nodes[f_label][a], "r": self._edge_row(rel, a, b, props),
+                             "b": self.nodes[t_label][b]})
+        return rows
+
+    def filter_nodes(self, filtro):
+        anclas, preds = filtro.anclas()
+        n_preds = [p for p in preds if p.nodo == "n"]
+        m_preds = [p for p in preds if p.nodo == "m"]
+        rows = []
+        for rel in (filtro.rels or RELACIONES):
+            from_label, to_label, _ = RELACIONES[rel]
+            if anclas and from_label not in anclas:
+                continue
+            for a, edges in self.out[rel].items():
+                n = self.nodes[from_label][a]
+                if not all(cumple(p, n, from_label) for p in n_preds):
+                    continue
+                for b, props in edges:
+                    m = self.nodes[to_label][b]
+                    if not all(cumple(p, m, to_label) for p in m_preds):
+                        continue
+                    if len(rows) >= filtro.limit:
+                        return rows
+                    rows.append({"n": n, "n_labels": [from_label], "r": self._edge_row(rel, a, b, props),
+                                 "m": m, "m_labels": [to_label]})
+        return rows
+
+    def _explain(self, query, params):
+        return None
+
+    def _top(self, label, prop, limit):
+        nodes = [n for n in self.nodes[label_valida(label)].values() if n.get(prop) is not None]
+        nodes.sort(key=lambda n: n[prop], reverse=True)
+        return [{"collect(a)": nodes[:int(limit)]}]
+
+    def top_rating(self, label, limit):
+        return self._top(label, "rating", limit)
+
+    def top_views(self, label, limit):
+        if label_valida(label) not in AGREGADOS_LABELS:
+            raise ValueError(f"{label} no recibe vistas (solo {', '.join(AGREGADOS_LABELS)})")
+        return self._top(label, "vistas", limit)
+
+    def user_stats(self):
+        cube = defaultdict(lambda: [0, 0, 0, None, None])
+        intereses = Counter()
+        for u in self.nodes["Usuario"].values():
+            edad = u.get("edad")
+            key = (u.get("pais"), u.get("suscripcion"), u.get("dispositivo"), u.get("activo"),
+                   None if edad is None else edad // 10 * 10)
+            c = cube[key]
+            c[0] += 1
+            if edad is not None:
+                c[1] += edad
+                c[2] += edad * edad
+                c[3] = edad if c[3] is None else min(c[3], edad)
+                c[4] = edad if c[4] is None else max(c[4], edad)
+            intereses.update(u.get("intereses") or [])
+        cubo = [
+            {"pais": k[0], "suscripcion": k[1], "dispositivo": k[2], "activo": k[3], "edad_rango": k[4],
+             "usuarios": v[0], "edad_suma": v[1], "edad_suma2": v[2], "edad_min": v[3], "edad_max": v[4]}
+            for k, v in cube.items()
+        ]
+        ordered = sorted(intereses.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [{"cubo": cubo, "intereses": [{"interes": i, "usuarios": n} for i, n in ordered]}]
+
+    ## RECOMENDACION
+    def interactions(self):
+        fields = {"VIO": "rating", "CALIFICO": "calificacion", "RECOMENDO": "confianza"}
+        return [
+            {"usuario": a, "pelicula": b, "tipo": rel, "valor": props.get(field)}
+            for rel, field in fields.items() for a, edges in self.out[rel].items() for b, props in edges
+        ]
+
+    def snapshot_nodes(self, labels, full=()):
+        return [
+            {"label": label, "id": node_id, "node": node if label in full else None}
+            for label in labels for node_id, node in self.nodes[label].items()
+        ]
+
+    def snapshot_edges(self, rels):
+        rows = []
+        for rel, prop in rels.items():
+            if rel == "SIMILAR_A":
+                rows += [{"rel": rel, "a": p, "b": q, "w": score} for p, sims in self.similar.items() for q, score in sims]
+                continue
+            rows += [
+                {"rel": rel, "a": a, "b": b, "w": props.get(prop) if prop else None}
+                for a, edges in self.out[rel].items() for b, props in edges
+            ]
+        return rows
+
+    def _seen(self, user_id):
+        return {b for b, _ in self.out["VIO"].get(user_id, [])}
+
+    @staticmethod
+    def _rank(scores, limit, skip=0, rating=None):
+        ordered = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]) if rating is None else (-kv[1], -rating(kv[0]), kv[0]))
+        return ordered[int(skip):int(skip) + int(limit)]
+
+    def by_user_similartiy(self, id, limit=10):
+        seen = self._seen(int(id))
+        scores = defaultdict(float)
+        for p in seen:
+            for q, score in self.similar.get(p, []):
+                if q not in seen:
+                    scores[q] += score
+        return [{"new": self.nodes["Pelicula"][m], "score": s} for m, s in self._rank(scores, limit)]
+
+    def by_subgenre(self, id, limit=5, subgenres=1):
+        seen = self._seen(int(id))
+        freq = Counter()
+        # un conteo por camino usuario-pelicula-genero, como el MATCH de GraphDB.by_subgenre
+        for p, _ in self.out["VIO"].get(int(id), []):
+            for g, _ in self.out["PERTENECE_A"].get(p, []):
+                freq.update(self.nodes["Genero"][g].get("subgeneros") or [])
+        favs = sorted(freq.items(), key=lambda kv: (-kv[1], kv[0]))[:int(subgenres)]
+        total = sum(f for _, f in favs)
+        afinidad, subs = defaultdict(float), defaultdict(list)
+        for sub, f in favs:
+            for g, genero in self.nodes["Genero"].items():
+                if sub not in (genero.get("subgeneros") or []):
+                    continue
+                for n in {a for a, _ in self.inn["PERTENECE_A"].get(g, [])} - seen:
+                    if sub not in subs[n]:
+                        afinidad[n] += f / total
+                        subs[n].append(sub)
+        movies = self.nodes["Pelicula"]
+        ranked = self._rank(afinidad, limit, rating=lambda m: movies[m].get("rating") or 0)
+        return [{"n": movies[m], "afinidad": a, "subgeneros": subs[m]} for m, a in ranked]
+
+    def _by_followed(self, id, rel, back, weight, limit, skip):
+        user = int(id)
+        seen = self._seen(user)
+        level, via = defaultdict(float), defaultdict(set)
+        for target, props in self.out[rel].get(user, []):
+            for movie, _ in back(target):
+                if movie not in seen:
+                    level[movie] += props.get(weight) or 1
+                    via[movie].add(target)
+        movies = self.nodes["Pelicula"]
+        scores = {m: v * (movies[m].get("rating") or 0) for m, v in level.items()}
+        return [(movies[m], s, level[m], sorted(via[m])) for m, s in self._rank(scores, limit, skip)]
+
+    def by_actor(self, id, limit=10, skip=0):
+        rows = self._by_followed(id, "ADMIRA", lambda a: self.out["PARTICIPO_EN"].get(a, []), "nivel_admiracion", limit, skip)
+        return [{"other": m, "score": s, "admiracion": v, "actores": via} for m, s, v, via in rows]
+
+    def by_director(self, id, limit=10, skip=0):
+        rows = self._by_followed(id, "SIGUE", lambda d: self.inn["DIRIGIDA_POR"].get(d, []), "nivel_interes", limit, skip)
+        return [{"other": m, "score": s, "interes": v, "directores": via} for m, s, v, via in rows]
+
+    ## ESCRITURAS
+    def create_1_node(self, node):
+        props = node.model_dump()
+        self.nodes[node.__class__.__name__].setdefault(props["id"], {}).update(props)
+        return []
+
+    def bulk_merge_nodes(self, label, rows, batch_size=1000):
+        for row in rows:
+            self.nodes[label].setdefault(row["id"], {}).update(row)
+        return [None] * -(-len(rows) // batch_size)
+
+    def bulk_merge_relations(self, rel, rows, batch_size=1000, workers=4):
+        written = []
+        for row in rows:
+            row = dict(row)
+            i, a, b = row.pop("i"), row.pop("from_id"), row.pop("to_id")
+            props = convert(rel, row)
+            existing = [p for o, p in self.out[rel].get(a, []) if o == b]
+            if existing:
+                for p in existing:
+                    p.update({k: v for k, v in props.items() if v is not None})
+                written.append(i)
+            elif self._add_edge(rel, a, b, props):
+                written.append(i)
+        return {"written": written, "errors": {}}
+
+    def create_relation(self, from_label, from_id, to_label, to_id, relation_type, properties):
+        props = convert(relation_type, properties)
+        self._add_edge(relation_type, int(from_id), int(to_id), props)
+        return [{"r": self._edge_row(relation_type, int(from_id), int(to_id), props)}]
+
+    def delete_relation(self, from_label, from_id, to_label, to_id, relation_type):
+        self._remove_edges(relation_type, int(from_id), int(to_id))
+        return []
+
+    def create_node_with_label(self, label):
+        return self.create_node_with_properties(label, {})
+
+    def create_node_with_multiple_labels(self, labels):
+        for label in labels:
+            label_valida(label)
+        return [{"node_id": None}]
+
+    ## los nodos sin id no se indexan (no los alcanza ninguna lectura por id)
+    def create_node_with_properties(self, label, properties):
+        label_valida(label)
+        if properties.get("id") is not None:
+            self.nodes[label][int(properties["id"])] = dict(properties)
+        return [{"node_id": properties.get("id")}]
+
+    ## SET n += $props: un valor None borra la propiedad
+    def _set_node_props(self, label, node_id, properties):
+        ids = node_id if isinstance(node_id, list) else [node_id]
+        rows = []
+        for i in ids:
+            node = self.nodes[label_valida(label)].get(int(i))
+            if node is None:
+                continue
+            node.update(properties)
+            for key in [k for k, v in properties.items() if v is None]:
+                node.pop(key)
+            rows.append({"n": node})
+        return rows
+
+    def _set_edges_props(self, rel, pairs, properties):
+        from_label, to_label, _ = RELACIONES[relacion_valida(rel)]
+        rows = []
+        for a, b in pairs:
+            for other, props in self.out[rel].get(a, []):
+                if other == b:
+                    props.update(properties)
+                    for key in [k for k, v in properties.items() if v is None]:
+                        props.pop(key)
+                    rows.append({"r": self._edge_row(rel, a, b, props)})
+            if rel in AGREGADOS and b in self.nodes[to_label]:
+                self._refresh_aggregates(b, self.nodes[to_label][b])
+        return rows
+
+    def _set_relation_props(self, from_label, from_id, to_label, to_id, relation_type, properties):
+        return self._set_edges_props(relation_type, [(int(from_id), int(to_id))], properties)
+
+    def _set_relations_props(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
+        pairs = [(int(a), int(b)) for a in from_ids for b in to_ids]
+        return self._set_edges_props(relation_type, pairs, properties)
+
+    ## sin ids internos en memoria: from_ids/to_ids son los id de los nodos
+    def add_properties_to_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
+        return self._set_relations_props(from_label, from_ids, to_label, to_ids, relation_type, properties)
+
+    def delete_node(self, label, node_id):
+        node_id = int(node_id)
+        self.nodes[label].pop(node_id, None)
+        for rel, (from_label, to_label, _) in RELACIONES.items():
+            if from_label == label:
+                for b, _ in self.out[rel].pop(node_id, []):
+                    self._remove_edges(rel, node_id, b)
+            if to_label == label:
+                for a, _ in self.inn[rel].pop(node_id, []):
+                    self._remove_edges(rel, a, node_id)
+        return [{"recalculados": 0}]
+
+    def delete_multiple_nodes(self, label, node_ids):
+        for node_id in node_ids:
+            self.delete_node(label, node_id)
+        return [{"recalculados": 0}]
+
+    def delete_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type):
+        for a in from_ids:
+            for b in to_ids:
+                self.delete_relation(from_label, a, to_label, b, relation_type)
+        return []
+
+    ## LAYOUT
+    def layout_graph(self):
+        out = defaultdict(list)
+        for rel, (from_label, to_label, _) in RELACIONES.items():
+            for a, edges in self.out[rel].items():
+                out[(from_label, a)].extend([to_label, b] for b, _ in edges)
+        return [
+            {"label": label, "id": node_id, "out": out.get((label, node_id), [])}
+            for label, nodes in self.nodes.items() for node_id in nodes
+        ]
+
+    def store_layout(self, rows):
+        for row in rows:
+            node = self.nodes[row["label"]].get(row["id"])
+            if node is not None:
+                node["x"], node["y"] = row["x"], row["y"]
+        return []
+
+
+## Version esperable (misma interfaz que AsyncGraphDB): cada metodo publico es una corrutina
+## y stream_nodes un generador asincrono
+class AsyncMemoryGraphDB:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getattr__(self, name):
+        value = getattr(self.graph, name)
+        if not callable(value) or name.startswith("_"):
+            return value
+
+        async def call(*args, **kwargs):
+            return value(*args, **kwargs)
+
+        return call
+
+    async def stream_nodes(self, label=None, props=None):
+        for row in self.graph.stream_nodes(label, props):
+            yield row
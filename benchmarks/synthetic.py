@@ -0,0 +1,129 @@
+## Genera un CSV con la forma de data.csv (mismas columnas, tipos y proporciones) a escala.
+## data.csv tiene 16.000 relaciones; --edges escala nodos y relaciones en la misma proporcion.
+##   python benchmarks/synthetic.py salida.csv --edges 1000000 [--seed 0]
+import argparse
+import csv
+import random
+import time
+from datetime import date, timedelta
+
+HEADER = ["Tipo", "ID"] + [f"Prop{i}" for i in range(1, 14)]
+
+# conteos de data.csv (16.000 relaciones)
+BASE_EDGES = 16000
+NODOS = {"Usuario": 2000, "Pelicula": 1000, "Serie": 1000, "Genero": 100, "Actor": 500, "Director": 400}
+RELACIONES = {
+    "VIO": 3000, "CALIFICO": 2000, "RECOMENDO": 1500, "SIGUE": 1000, "ADMIRA": 1000,
+    "PERTENECE_A": 2000, "TIENE_TEMATICA": 1500, "DIRIGIDA_POR": 1000, "PRODUCIDA_POR": 1000, "PARTICIPO_EN": 2000,
+}
+EXTREMOS = {
+    "VIO": ("Usuario", "Pelicula"), "CALIFICO": ("Usuario", "Pelicula"), "RECOMENDO": ("Usuario", "Pelicula"),
+    "SIGUE": ("Usuario", "Director"), "ADMIRA": ("Usuario", "Actor"), "PERTENECE_A": ("Pelicula", "Genero"),
+    "TIENE_TEMATICA": ("Serie", "Genero"), "DIRIGIDA_POR": ("Pelicula", "Director"),
+    "PRODUCIDA_POR": ("Serie", "Director"), "PARTICIPO_EN": ("Actor", "Pelicula"),
+}
+
+NOMBRES = ["Luis", "Diana", "Ana", "Carlos", "Sofia", "Jorge", "Maria", "Pedro", "Lucia", "Raul"]
+APELLIDOS = ["Rodriguez", "Perez", "Lopez", "Ramirez", "Garcia", "Martinez", "Gomez", "Diaz"]
+PAISES = ["Argentina", "Mexico", "Colombia", "Chile", "Peru", "Guatemala", "España", "Estados Unidos"]
+SUSCRIPCIONES = ["Basico", "Estandar", "Premium"]
+DISPOSITIVOS = ["Smart TV", "PC", "Movil", "Tablet"]
+GENEROS = ["Acción", "Drama", "Comedia", "Terror", "Ciencia Ficción", "Musical", "Aventura", "Romance"]
+
+
+def escala(edges):
+    factor = edges / BASE_EDGES
+    nodos = {label: max(10, round(n * factor)) for label, n in NODOS.items()}
+    # los generos crecen mas lento que el catalogo
+    nodos["Genero"] = max(10, round(NODOS["Genero"] * factor ** 0.5))
+    rels = {rel: max(1, round(n * factor)) for rel, n in RELACIONES.items()}
+    return nodos, rels
+
+
+def fecha(rng):
+    return (date(2010, 1, 1) + timedelta(days=rng.randrange(5000))).isoformat()
+
+
+def nombre(rng):
+    return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}"
+
+
+def fila_nodo(label, i, rng):
+    if label == "Usuario":
+        intereses = ";".join(rng.sample(GENEROS, rng.randint(1, 3)))
+        return [nombre(rng), rng.randint(18, 60), rng.choice(PAISES), rng.choice(SUSCRIPCIONES), fecha(rng),
+                rng.choice(DISPOSITIVOS), rng.random() < 0.5, intereses]
+    if label == "Pelicula":
+        return [f"Pelicula {i}", rng.randint(1970, 2024), round(rng.uniform(70, 180), 1), round(rng.uniform(1, 10), 1),
+                f"Sinopsis de la pelicula {i}", rng.random() < 0.5]
+    if label == "Serie":
+        return [f"Serie {i}", rng.randint(1, 10), rng.randint(6, 24), round(rng.uniform(1, 10), 1),
+                f"Sinopsis de la serie {i}", rng.random() < 0.5]
+    if label == "Genero":
+        return [f"Genero {i}", rng.randint(1, 100), f"Descripcion del genero {i}",
+                ";".join(rng.sample(GENEROS, 2)), rng.random() < 0.5]
+    return [nombre(rng), rng.choice(PAISES), rng.randint(20, 80), rng.randint(0, 10), rng.random() < 0.5]
+
+
+def props_relacion(rel, rng):
+    if rel == "VIO":
+        return [fecha(rng), rng.choice(DISPOSITIVOS), round(rng.uniform(1, 10), 1)]
+    if rel == "CALIFICO":
+        return [fecha(rng), round(rng.uniform(1, 5), 1), f"Comentario {rng.randrange(1000)}"]
+    if rel == "RECOMENDO":
+        return [fecha(rng), f"Razón {rng.randrange(100)}", round(rng.random(), 2)]
+    if rel == "SIGUE":
+        return [fecha(rng), rng.randint(1, 5), rng.random() < 0.5]
+    if rel == "ADMIRA":
+        return [fecha(rng), rng.randint(1, 5), f"Razón {rng.randrange(100)}"]
+    if rel == "PERTENECE_A":
+        return [round(rng.random(), 2), f"Relevancia {rng.randint(1, 10)}", fecha(rng)]
+    if rel == "TIENE_TEMATICA":
+        return [rng.randint(1, 100), rng.random() < 0.5, f"Impacto {rng.randint(1, 10)}"]
+    if rel == "DIRIGIDA_POR":
+        return [rng.choice(["Principal", "Co-director"]), rng.randint(1, 30), rng.randint(0, 5)]
+    if rel == "PRODUCIDA_POR":
+        return ["Serie", f"Productora {rng.randint(1, 20)}", rng.randint(1, 30)]
+    return [rng.choice(["Protagonista", "Secundario", "Reparto"]), rng.randint(1, 10), rng.randint(0, 5)]
+
+
+## destinos con popularidad sesgada (pocas peliculas concentran las vistas, como en produccion)
+def destino(rel, n, rng):
+    if rel in ("VIO", "CALIFICO", "RECOMENDO"):
+        return min(n - 1, int(rng.paretovariate(1.2)) - 1)
+    return rng.randrange(n)
+
+
+def generate(path, edges=BASE_EDGES, seed=0):
+    rng = random.Random(seed)
+    nodos, rels = escala(edges)
+    rng_dest = random.Random(seed + 1)
+    # permutacion fija para que la pelicula mas popular no sea siempre la id 0
+    orden = {label: rng_dest.sample(range(n), n) for label, n in nodos.items()}
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for label, n in nodos.items():
+            for i in range(n):
+                row = [label, i] + fila_nodo(label, i, rng)
+                writer.writerow(row + [""] * (len(HEADER) - len(row)))
+        for rel, n in rels.items():
+            from_label, to_label = EXTREMOS[rel]
+            for _ in range(n):
+                a = rng.randrange(nodos[from_label])
+                b = orden[to_label][destino(rel, nodos[to_label], rng)]
+                row = ["Relacion", rel, a, b] + props_relacion(rel, rng)
+                writer.writerow(row + [""] * (len(HEADER) - len(row)))
+    return {"nodes": nodos, "relations": rels}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSV sintetico con la forma de data.csv")
+    parser.add_argument("path")
+    parser.add_argument("--edges", type=int, default=BASE_EDGES, help="relaciones (10k a 10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    info = generate(args.path, args.edges, args.seed)
+    print(f"{sum(info['nodes'].values())} nodos, {sum(info['relations'].values())} relaciones "
+          f"en {time.perf_counter() - start:.1f}s -> {args.path}")
@@ -0,0 +1,157 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+## Cache de resultados de consultas con etiquetas para invalidar por label / label:id.
+## Las entradas se etiquetan con "Label" (depende de toda la label) o "Label:id" (de un nodo).
+
+
+def node_tags(label, ids=None):
+    if ids is None:
+        return [label, f"{label}:*"]
+    if not isinstance(ids, (list, tuple, set)):
+        ids = [ids]
+    return [label] + [f"{label}:{i}" for i in ids]
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira, valor, tags)
+        self._tags = {}  # tag -> set(keys)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _drop(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return False, None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.counters["hits"] += 1
+            return True, entry[1]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+                self.counters["evictions"] += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                if tag.endswith(":*"):
+                    prefix = tag[:-1]
+                    for t in [t for t in self._tags if t.startswith(prefix)]:
+                        keys |= self._tags[t]
+                else:
+                    keys |= self._tags.get(tag, set())
+            for key in keys:
+                if key in self._data:
+                    self._drop(key)
+            self.counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "size": len(self._data), "maxsize": self.maxsize,
+                    "ttl": self.ttl, **self.counters}
+
+
+## Backend compatible con Redis (opcional: requiere el paquete redis).
+## El LRU lo aplica el servidor (maxmemory-policy allkeys-lru); aqui solo TTL y etiquetas.
+class RedisCache:
+    def __init__(self, url="redis://localhost:6379/0", ttl=300, prefix="recache:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("cache_backend=redis requiere el paquete 'redis' (pip install redis)") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _key(self, key):
+        return self.prefix + hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            self.counters["misses"] += 1
+            return False, None
+        self.counters["hits"] += 1
+        return True, pickle.loads(raw)
+
+    def set(self, key, value, tags=()):
+        rkey = self._key(key)
+        pipe = self.client.pipeline()
+        pipe.setex(rkey, self.ttl, pickle.dumps(value))
+        for tag in tags:
+            pipe.sadd(f"{self.prefix}tag:{tag}", rkey)
+            pipe.expire(f"{self.prefix}tag:{tag}", self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = []
+        for tag in tags:
+            if tag.endswith(":*"):
+                tag_keys.extend(self.client.scan_iter(match=f"{self.prefix}tag:{tag}"))
+            else:
+                tag_keys.append(f"{self.prefix}tag:{tag}")
+        if not tag_keys:
+            return 0
+        keys = self.client.sunion(tag_keys)
+        if keys:
+            self.client.delete(*keys)
+        self.client.delete(*tag_keys)
+        self.counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        info = self.client.info("stats")
+        return {"backend": "redis", "ttl": self.ttl, "evictions": info.get("evicted_keys"),
+                "expirations": info.get("expired_keys"), **self.counters}
+
+
+def make_cache(backend="memory", maxsize=1024, ttl=300, redis_url=None):
+    if backend == "memory":
+        return TTLCache(maxsize, ttl)
+    if backend == "redis":
+        return RedisCache(redis_url or "redis://localhost:6379/0", ttl)
+    if backend == "none":
+        return None
+    raise ValueError(f"cache_backend desconocido: {backend}")
@@ -0,0 +1,50 @@
+## Fusion de senales de recomendacion (/rec/hybrid)
+
+# senal -> (clave del nodo pelicula, clave del puntaje) en las filas de GraphDB
+SIGNALS = {
+    "user": ("new", "score"),
+    "subgenre": ("n", "afinidad"),
+    "actor": ("other", "score"),
+    "director": ("other", "score"),
+}
+METHODS = ("weighted", "rrf")
+
+
+## filas de una senal -> [(id, nodo, puntaje)] sin duplicados, en orden de ranking
+def extract(signal, rows):
+    node_key, score_key = SIGNALS[signal]
+    items, seen = [], set()
+    for row in rows:
+        node = row[node_key]
+        if node["id"] in seen:
+            continue
+        seen.add(node["id"])
+        items.append((node["id"], node, float(row.get(score_key) or 0.0)))
+    return items
+
+
+## escala a [0, 1] dividiendo por el maximo (todas las senales son >= 0)
+def normalize(items):
+    hi = max((s for _, _, s in items), default=0.0)
+    return [(i, n, s / hi if hi > 0 else 1.0) for i, n, s in items]
+
+
+def fuse(signals, weights, method="weighted", limit=10, rrf_k=60):
+    if method not in METHODS:
+        raise ValueError(f"method debe ser uno de {', '.join(METHODS)}")
+    fused = {}
+    for signal, items in signals.items():
+        weight = weights.get(signal, 1.0)
+        if weight <= 0:
+            continue
+        normalized = normalize(items)
+        for rank, ((movie_id, node, raw), (_, _, norm)) in enumerate(zip(items, normalized), start=1):
+            if method == "rrf":
+                contribution = weight / (rrf_k + rank)
+            else:
+                contribution = weight * norm
+            entry = fused.setdefault(movie_id, {"movie": node, "score": 0.0, "signals": {}})
+            entry["score"] += contribution
+            entry["signals"][signal] = {"rank": rank, "score": raw, "contribution": contribution}
+    ranked = sorted(fused.values(), key=lambda e: (-e["score"], e["movie"]["id"]))
+    return ranked[:limit]
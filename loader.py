@@ -0,0 +1,262 @@
+import csv
+import math
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from neo4j.exceptions import TransientError
+from model import AGREGADOS, GraphDB, MODELOS, RELACIONES
+
+LIST_FIELDS = {"intereses", "subgeneros"}
+
+## convierte una fila de nodo del CSV a los parametros del modelo
+def parse_node(row):
+    model = MODELOS[row[0]]
+    fields = list(model.model_fields.keys())
+    values = dict(zip(fields, row[1:1 + len(fields)]))
+    for field in LIST_FIELDS.intersection(values):
+        values[field] = [v for v in values[field].split(";") if v]
+    return model.model_validate(values).model_dump()
+
+## convierte una fila Relacion del CSV (la conversion de tipos la hace Cypher)
+def parse_relation(row):
+    props = RELACIONES[row[1]][2]
+    params = {"from_id": int(row[2]), "to_id": int(row[3])}
+    for (key, _), value in zip(props, row[4:4 + len(props)]):
+        params[key] = value
+    return params
+
+
+class _Buffers:
+    def __init__(self, db, session, batch_size):
+        self.db = db
+        self.session = session
+        self.batch_size = batch_size
+        self.nodes = {}
+        self.rels = {}
+        self.counts = {}
+
+    def _flush(self, key, query, rows):
+        if rows:
+            self.db._execute_batch(query, rows, self.session, name=f"carga_{key}")
+            self.counts[key] = self.counts.get(key, 0) + len(rows)
+
+    def flush_nodes(self):
+        for label, rows in self.nodes.items():
+            self._flush(label, GraphDB.merge_nodes_query(label), rows)
+        self.nodes = {}
+
+    def flush_rels(self):
+        for rel, rows in self.rels.items():
+            self._flush(rel, GraphDB.merge_relations_query(rel), rows)
+        self.rels = {}
+
+    def add_node(self, label, row):
+        rows = self.nodes.setdefault(label, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._flush(label, GraphDB.merge_nodes_query(label), rows)
+            self.nodes[label] = []
+
+    def add_rel(self, rel, row):
+        rows = self.rels.setdefault(rel, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            # las relaciones necesitan que sus nodos ya esten escritos
+            self.flush_nodes()
+            self._flush(rel, GraphDB.merge_relations_query(rel), rows)
+            self.rels[rel] = []
+
+
+## Carga masiva del CSV: agrupa por Tipo / tipo de relacion y escribe en lotes UNWIND
+def cargar_datos(db, path, batch_size=1000):
+    start = time.perf_counter()
+    with db.driver.session() as session:
+        buffers = _Buffers(db, session, batch_size)
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader)  # encabezado
+            for row in reader:
+                if not row:
+                    continue
+                if row[0] == "Relacion":
+                    buffers.add_rel(row[1], parse_relation(row))
+                else:
+                    buffers.add_node(row[0], parse_node(row))
+        buffers.flush_nodes()
+        buffers.flush_rels()
+    elapsed = time.perf_counter() - start
+    total = sum(buffers.counts.values())
+    # el indice de similitud se reconstruye una sola vez tras la carga
+    sim_start = time.perf_counter()
+    db.rebuild_similarity()
+    return {
+        "rows": total,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(total / elapsed, 1) if elapsed > 0 else None,
+        "by_type": buffers.counts,
+        "similarity_seconds": round(time.perf_counter() - sim_start, 3),
+    }
+
+
+## CARGA PARALELA
+## 1) nodos en el proceso principal, que en la misma pasada reparte las filas de relaciones en
+## archivos por (tipo, particion) (particion por id del nodo que se bloquea); 2) tareas sobre
+## esos archivos en un pool de procesos, cada una con su propio driver: lee solo sus filas y
+## escribe en lotes. El CSV se lee una sola vez.
+
+## escribe un lote reintentando bloqueos mutuos / errores transitorios con backoff exponencial.
+## Transaccion explicita (no execute_write): el driver no reintenta por su cuenta, asi este es el
+## unico nivel de reintento y el conteo devuelto es real
+def write_with_retry(query, rows, session, retries=5, base_delay=0.1):
+    for attempt in range(retries + 1):
+        try:
+            with session.begin_transaction() as tx:
+                tx.run(query, rows=rows).consume()
+                tx.commit()
+            return attempt
+        except TransientError:
+            if attempt == retries:
+                raise
+            time.sleep(base_delay * 2 ** attempt * (1 + random.random()))
+
+
+## relaciones que mantienen agregados en el destino se particionan por destino (ver bulk_merge_relations)
+def _partition_of(row, rel, parts):
+    return int(row[3] if rel in AGREGADOS else row[2]) % parts
+
+
+## files: archivos de la tarea (filas Relacion del CSV, sin encabezado)
+def _import_relations(uri, user, password, files, rel, part, batch_size):
+    start = time.perf_counter()
+    db = GraphDB(uri, user, password, max_connection_pool_size=2)
+    query = GraphDB.merge_relations_query(rel)
+    count = retries = 0
+    try:
+        with db.driver.session() as session:
+            rows = []
+            for path in files:
+                with open(path, newline="", encoding="utf-8") as f:
+                    for row in csv.reader(f):
+                        rows.append(parse_relation(row))
+                        if len(rows) >= batch_size:
+                            retries += write_with_retry(query, rows, session)
+                            count += len(rows)
+                            rows = []
+            if rows:
+                retries += write_with_retry(query, rows, session)
+                count += len(rows)
+    finally:
+        db.close()
+    return {"rel": rel, "part": part, "rows": count, "retries": retries,
+            "seconds": round(time.perf_counter() - start, 3)}
+
+
+## escribe los nodos y reparte las relaciones en spool_dir/<tipo>.<particion>.csv;
+## devuelve los conteos y {tipo: [archivo por particion]}
+def _load_nodes(db, path, batch_size, spool_dir, partitions):
+    rel_counts = {}
+    spool = {}
+    try:
+        with db.driver.session() as session:
+            buffers = _Buffers(db, session, batch_size)
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader)
+                for row in reader:
+                    if not row:
+                        continue
+                    if row[0] == "Relacion":
+                        rel = row[1]
+                        rel_counts[rel] = rel_counts.get(rel, 0) + 1
+                        key = (rel, _partition_of(row, rel, partitions))
+                        if key not in spool:
+                            out = open(os.path.join(spool_dir, "%s.%d.csv" % key), "w", newline="", encoding="utf-8")
+                            spool[key] = (out, csv.writer(out))
+                        spool[key][1].writerow(row)
+                    else:
+                        buffers.add_node(row[0], parse_node(row))
+            buffers.flush_nodes()
+    finally:
+        for out, _ in spool.values():
+            out.close()
+    files = {}
+    for rel, part in sorted(spool):
+        files.setdefault(rel, []).append(os.path.join(spool_dir, "%s.%d.csv" % (rel, part)))
+    return buffers.counts, rel_counts, files
+
+
+def cargar_datos_paralelo(uri, user, password, path, batch_size=1000, workers=4, partitions=4, progress=print):
+    start = time.perf_counter()
+    db = GraphDB(uri, user, password)
+    try:
+        with tempfile.TemporaryDirectory(prefix="carga_") as spool_dir:
+            by_type, rel_counts, files = _load_nodes(db, path, batch_size, spool_dir, partitions)
+            nodes_seconds = time.perf_counter() - start
+            progress(f"nodos: {sum(by_type.values())} en {nodes_seconds:.2f}s")
+
+            # un tipo chico es una sola tarea; uno grande se parte hasta en `partitions` tareas.
+            # Una tarea toma particiones enteras, asi un nodo bloqueado sigue en una sola tarea
+            tasks = []
+            for rel, count in rel_counts.items():
+                parts = max(1, min(len(files[rel]), math.ceil(count / batch_size)))
+                tasks += [(rel, part, files[rel][part::parts]) for part in range(parts)]
+            total_rels = sum(rel_counts.values())
+            done = retries = 0
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(_import_relations, uri, user, password, task_files, rel, part, batch_size)
+                    for rel, part, task_files in tasks
+                ]
+                for future in as_completed(futures):
+                    result = future.result()
+                    done += result["rows"]
+                    retries += result["retries"]
+                    by_type[result["rel"]] = by_type.get(result["rel"], 0) + result["rows"]
+                    elapsed = time.perf_counter() - start
+                    progress(f"{result['rel']}[{result['part']}]: {result['rows']} filas en {result['seconds']}s "
+                             f"({done}/{total_rels}, {done / elapsed:.0f} filas/s)")
+        elapsed = time.perf_counter() - start
+        total = sum(by_type.values())
+        sim_start = time.perf_counter()
+        db.rebuild_similarity()
+    finally:
+        db.close()
+    return {
+        "rows": total,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(total / elapsed, 1) if elapsed > 0 else None,
+        "by_type": by_type,
+        "tasks": len(tasks),
+        "retries": retries,
+        "similarity_seconds": round(time.perf_counter() - sim_start, 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Carga masiva de data.csv en Neo4j")
+    parser.add_argument("path", nargs="?", default="./data.csv")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1, help="procesos para las relaciones (1 = carga secuencial)")
+    parser.add_argument("--partitions", type=int, default=4, help="particiones maximas por tipo de relacion")
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI"))
+    parser.add_argument("--username", default=os.environ.get("NEO4J_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("NEO4J_PASSWORD"))
+    args = parser.parse_args()
+
+    db = GraphDB(args.uri, args.username, args.password)
+    try:
+        db.ensure_schema()
+        if args.workers <= 1:
+            stats = cargar_datos(db, args.path, args.batch_size)
+    finally:
+        db.close()
+    if args.workers > 1:
+        stats = cargar_datos_paralelo(args.uri, args.username, args.password, args.path,
+                                      args.batch_size, args.workers, args.partitions)
+    print(f"{stats['rows']} filas en {stats['seconds']}s ({stats['rows_per_sec']} filas/s)")
+    for key, count in stats["by_type"].items():
+        print(f"  {key}: {count}")
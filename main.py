@@ -1,19 +1,49 @@
-import random
-from fastapi import FastAPI, HTTPException, Response
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import pandas as pd
+from pydantic import ValidationError
 from pydantic_settings import BaseSettings
-from model import GraphDB, Usuario, Pelicula, Serie, Genero, Actor, Director
+from model import GraphDB, AsyncGraphDB, Filtro, RELACIONES, Usuario, Pelicula, Serie, Genero, Actor, Director
+from loader import cargar_datos, cargar_datos_paralelo
+from recommender import SparseRecommender, ENGINES
+from snapshot import GraphSnapshot, SNAPSHOT_LABELS, SNAPSHOT_FULL, SNAPSHOT_RELS
+from precompute import PrecomputedStore, log_invalidation, precompute
+from cache import make_cache, TTLCache
+import hybrid
+import metrics
+import render
 from fastapi.middleware.cors import CORSMiddleware
-import networkx as nx
-import matplotlib.pyplot as plt
-import matplotlib
-import io
-matplotlib.use("Agg")
 
 class Settings(BaseSettings):
     neo4j_uri: str
     neo4j_username: str
     neo4j_password: str
+    neo4j_pool_size: int = 100
+    neo4j_acquisition_timeout: float = 60.0  # segundos esperando una conexion libre
+    neo4j_max_connection_lifetime: float = 3600.0
+    crear_indices: bool = True  # constraints/indices de id al iniciar
+    cargar_csv: bool = False  # carga data.csv al iniciar
+    cargar_csv_workers: int = 1  # >1: relaciones en un pool de procesos (loader.cargar_datos_paralelo)
+    batch_size: int = 1000
+    bulk_workers: int = 4  # transacciones concurrentes en /bulk/relations
+    similar_k: int = 20  # vecinos por pelicula en el indice de similitud
+    similar_incluir_calificaciones: bool = False  # usar CALIFICO ademas de VIO
+    snapshot_refresh: float = 0  # segundos entre recargas del snapshot en memoria de /rec/*; 0 = desactivado
+    precomputed_path: str = ""  # archivo de precompute.py servido por /rec/user/{id}; vacio = desactivado
+    precomputed_top_n: int = 50
+    cache_backend: str = "memory"  # memory | redis | none
+    cache_ttl: int = 300  # segundos
+    cache_maxsize: int = 1024  # entradas (solo memory)
+    redis_url: str = "redis://localhost:6379/0"
+    render_cache_size: int = 128  # imagenes de /vis-* en memoria
+    render_cache_ttl: int = 60  # segundos
+    profile_rate: float = 0.0  # fraccion de consultas ejecutadas con PROFILE (0 = desactivado)
+    profile_slow_ms: float = 500.0  # las muestreadas que tarden mas imprimen db hits y plan
 
     class Config:
         env_file = ".env"
@@ -21,11 +51,45 @@ class Settings(BaseSettings):
 
 # Create a global settings instance
 settings = Settings()
-db = GraphDB(settings.neo4j_uri,settings.neo4j_username,settings.neo4j_password)
+metrics.configure(settings.profile_rate, settings.profile_slow_ms)
+pool_config = dict(
+    max_connection_pool_size=settings.neo4j_pool_size,
+    connection_acquisition_timeout=settings.neo4j_acquisition_timeout,
+    max_connection_lifetime=settings.neo4j_max_connection_lifetime,
+    similar_rels=("VIO", "CALIFICO") if settings.similar_incluir_calificaciones else ("VIO",),
+    similar_k=settings.similar_k,
+)
+cache = make_cache(settings.cache_backend, settings.cache_maxsize, settings.cache_ttl, settings.redis_url)
+db = AsyncGraphDB(settings.neo4j_uri,settings.neo4j_username,settings.neo4j_password, cache=cache, **pool_config)
 
-    
-# cargar_datos("./data.csv")
-app = FastAPI()
+def cargar_csv():
+    if settings.cargar_csv_workers > 1:
+        return cargar_datos_paralelo(settings.neo4j_uri, settings.neo4j_username, settings.neo4j_password,
+                                     "./data.csv", settings.batch_size, settings.cargar_csv_workers)
+    # La carga masiva usa el driver sincrono en un hilo aparte
+    sync_db = GraphDB(settings.neo4j_uri,settings.neo4j_username,settings.neo4j_password, **pool_config)
+    try:
+        return cargar_datos(sync_db, "./data.csv", settings.batch_size)
+    finally:
+        sync_db.close()
+
+@asynccontextmanager
+async def lifespan(app):
+    if settings.crear_indices:
+        try:
+            await db.ensure_schema()
+        except Exception as e:
+            print(f"No se pudo crear el esquema: {e}")
+    if settings.cargar_csv:
+        stats = await run_in_threadpool(cargar_csv)
+        print(f"data.csv: {stats['rows']} filas en {stats['seconds']}s ({stats['rows_per_sec']} filas/s)")
+    refresher = asyncio.create_task(snapshot_loop()) if settings.snapshot_refresh > 0 else None
+    yield
+    if refresher is not None:
+        refresher.cancel()
+    await db.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +99,25 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Duracion por ruta (plantilla, no la URL concreta) hasta que la respuesta empieza;
+# en las respuestas en streaming no incluye el envio del cuerpo
+@app.middleware("http")
+async def route_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.observe_request(request.method, route.path if route else "sin_ruta", status,
+                                time.perf_counter() - start)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 def read_root():
     return {"message": "Hello, World!"}
@@ -46,159 +129,334 @@ def main():
 if __name__ == "__main__":
     main()
 
+@app.get("/schema")
+async def schema_report():
+    try:
+        return await db.schema_report()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/cache/stats")
+def cache_stats():
+    if cache is None:
+        return {"backend": "none"}
+    return cache.stats()
+
+@app.delete("/cache")
+def clear_cache():
+    if cache is not None:
+        cache.clear()
+    render_cache.clear()
+    return {"message": "Cache cleared"}
+
 # Relationship Operations
 @app.post("/rel-count")
-def count_realtions(data: dict):
+async def count_realtions(data: dict):
     try:
         rel= data.get("rel")
         from_id =  data.get("id")
         from_label = data.get("label")
         from_or_to = data.get("from_or_to")
-        return db.count_relations_to(rel,from_id, from_label, from_or_to)
+        return await db.count_relations(rel,from_id, from_label, from_or_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 # Node Operations
 @app.get("/node/get-one")
-def get_one_node(data: dict):
+async def get_one_node(data: dict):
     try:
         label= data.get("label")
         id =  data.get("id")
-        return db.read_1_node(label,id)
+        return await db.read_1_node(label,id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Create
 # ------- Usuario ------- #
 @app.post("/user")
-def create_user(user: Usuario):
+async def create_user(user: Usuario):
     try:
-        db.create_1_node(user)
+        await db.create_1_node(user)
         return {"message": "User created succesfully", "id": user.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ------- Pelicula ------- #
 @app.post("/movie")
-def create_user(movie: Pelicula):
+async def create_user(movie: Pelicula):
     try:
-        db.create_1_node(movie)
+        await db.create_1_node(movie)
         return {"message": "Movie created successfully", "id": movie.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ------- Serie ------- #
 @app.post("/serie")
-def create_user(serie: Serie):
+async def create_user(serie: Serie):
     try:
-        db.create_1_node(serie)
+        await db.create_1_node(serie)
         return {"message": "Series created successfully", "id": serie.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ------- Genero ------- #
 @app.post("/genre")
-def create_user(genre: Genero):
+async def create_user(genre: Genero):
     try:
-        db.create_1_node(genre)
+        await db.create_1_node(genre)
         return {"message": "Genre created successfully", "id": genre.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ------- Actor ------- #
 @app.post("/actor")
-def create_user(actor: Actor):
+async def create_user(actor: Actor):
     try:
-        db.create_1_node(actor)
+        await db.create_1_node(actor)
         return {"message": "Actor created successfully", "id": actor.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ------- Director ------- #
 @app.post("/director")
-def create_user(director: Director):
+async def create_user(director: Director):
     try:
-        db.create_1_node(director)
+        await db.create_1_node(director)
         return {"message": "Director created successfully", "id": director.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# ------- Carga por lotes ------- #
+# POST /bulk/{tipo} con una lista JSON o NDJSON (Content-Type: application/x-ndjson)
+BULK_TIPOS = {"user": Usuario, "movie": Pelicula, "serie": Serie, "genre": Genero, "actor": Actor, "director": Director}
+
+def parse_bulk_body(body, content_type):
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return items
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("se esperaba una lista JSON")
+    return items
+
+# POST /bulk/relations: filas {type, from_id, to_id, <propiedades>}; ?type=VIO aplica a filas sin type.
+# MERGE por extremos + SET de propiedades, lotes en paralelo por tipo de relacion
+def parse_relation_item(item, default_type):
+    if not isinstance(item, dict):
+        raise ValueError("se esperaba un objeto")
+    rel = item.get("type", default_type)
+    if rel not in RELACIONES:
+        raise ValueError(f"type debe ser uno de {', '.join(RELACIONES)}")
+    allowed = {key for key, _ in RELACIONES[rel][2]}
+    unknown = set(item) - allowed - {"type", "from_id", "to_id"}
+    if unknown:
+        raise ValueError(f"propiedades desconocidas para {rel}: {', '.join(sorted(unknown))}")
+    row = {key: item[key] for key in allowed if key in item}
+    row["from_id"] = int(item["from_id"])
+    row["to_id"] = int(item["to_id"])
+    return rel, row
+
+@app.post("/bulk/relations")
+async def bulk_relations(request: Request, type: str = None):
+    try:
+        items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        start = time.perf_counter()
+        results = [{"index": index, "ok": False} for index in range(len(items))]
+        by_type = {}
+        for index, item in enumerate(items):
+            try:
+                if isinstance(item, Exception):
+                    raise ValueError(f"JSON invalido: {item}")
+                rel, row = parse_relation_item(item, type)
+            except (KeyError, TypeError, ValueError) as e:
+                results[index]["error"] = f"falta {e}" if isinstance(e, KeyError) else str(e)
+                continue
+            results[index]["type"] = rel
+            row["i"] = index
+            by_type.setdefault(rel, []).append(row)
+
+        similar_movies = set()
+        for rel, rows in by_type.items():
+            outcome = await db.bulk_merge_relations(rel, rows, settings.batch_size, settings.bulk_workers)
+            for index in outcome["written"]:
+                results[index]["ok"] = True
+            for index, error in outcome["errors"].items():
+                results[index]["error"] = error
+            for row in rows:
+                if not results[row["i"]]["ok"] and "error" not in results[row["i"]]:
+                    results[row["i"]]["error"] = "nodo origen o destino no encontrado"
+                elif rel in db.similar_rels.split("|") and results[row["i"]]["ok"]:
+                    similar_movies.add(row["to_id"])
+            if RELACIONES[rel][0] == "Usuario":
+                invalidate_precomputed([row["from_id"] for row in rows if results[row["i"]]["ok"]], rel)
+        # el indice de similitud de las peliculas tocadas se recalcula una vez al final
+        if similar_movies:
+            await db.refresh_similarity(sorted(similar_movies))
+
+        seconds = time.perf_counter() - start
+        written = sum(1 for r in results if r["ok"])
+        return {
+            "received": len(items),
+            "written": written,
+            "failed": len(items) - written,
+            "by_type": {rel: len(rows) for rel, rows in by_type.items()},
+            "seconds": round(seconds, 3),
+            "items_per_sec": round(written / seconds) if seconds > 0 else None,
+            "results": results,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/bulk/{tipo}")
+async def bulk_create(tipo: str, request: Request):
+    model = BULK_TIPOS.get(tipo)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"tipo debe ser uno de {', '.join(BULK_TIPOS)}")
+    try:
+        items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        start = time.perf_counter()
+        results, rows, positions = [], [], []
+        for index, item in enumerate(items):
+            if isinstance(item, Exception):
+                results.append({"index": index, "ok": False, "error": f"JSON invalido: {item}"})
+                continue
+            try:
+                node = model.model_validate(item)
+            except ValidationError as e:
+                results.append({"index": index, "id": item.get("id") if isinstance(item, dict) else None,
+                                "ok": False, "error": e.errors(include_url=False, include_input=False)})
+                continue
+            results.append({"index": index, "id": node.id, "ok": True})
+            positions.append(len(results) - 1)
+            rows.append(node.model_dump())
+
+        batch_size = settings.batch_size
+        errors = await db.bulk_merge_nodes(model.__name__, rows, batch_size) if rows else []
+        for chunk, error in enumerate(errors):
+            if error is None:
+                continue
+            for pos in positions[chunk * batch_size:(chunk + 1) * batch_size]:
+                results[pos]["ok"] = False
+                results[pos]["error"] = error
+        seconds = time.perf_counter() - start
+        written = sum(1 for r in results if r["ok"])
+        return {
+            "label": model.__name__,
+            "received": len(items),
+            "written": written,
+            "failed": len(items) - written,
+            "seconds": round(seconds, 3),
+            "items_per_sec": round(written / seconds) if seconds > 0 else None,
+            "results": results,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/node/create-single-label")
-def create_single_label_node(data: dict):
+async def create_single_label_node(data: dict):
     try:
         label = data.get("label")
-        result = db.create_node_with_label(label)
+        result = await db.create_node_with_label(label)
         return {"message": "Node created successfully", "node_id": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/node/create-multiple-labels")
-def create_multiple_labels_node(data: dict):
+async def create_multiple_labels_node(data: dict):
     try:
         labels = data.get("labels")
-        result = db.create_node_with_multiple_labels(labels)
+        result = await db.create_node_with_multiple_labels(labels)
         return {"message": "Node created successfully", "node_id": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/node/create-with-properties")
-def create_node_with_properties(data: dict):
+async def create_node_with_properties(data: dict):
     try:
         label = data.get("label")
         properties = data.get("properties")
         if len(properties) < 5:
             raise HTTPException(status_code=400, detail="At least 5 properties are required")
-        result = db.create_node_with_properties(label, properties)
+        result = await db.create_node_with_properties(label, properties)
         return {"message": "Node created successfully", "node_id": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/node/add-properties")
-def add_properties_to_node(data: dict):
+async def add_properties_to_node(data: dict):
     try:
         label = data.get("label")
         node_id = data.get("id")
         properties = data.get("properties")
-        result = db.add_properties_to_node(label, node_id, properties)
+        result = await db.add_properties_to_node(label, node_id, properties)
         return {"message": "Properties added successfully", "node": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/nodes/{label}/add_properties")
-def add_properties_to_multiple_nodes(label: str, node_ids: list[int], properties: dict):
-    result = db.add_properties_to_multiple_nodes(label, node_ids, properties)
+async def add_properties_to_multiple_nodes(label: str, node_ids: list[int], properties: dict):
+    result = await db.add_properties_to_multiple_nodes(label, node_ids, properties)
     return {"message": "Properties added successfully", "updated_nodes": result}
 
 @app.put("/node/update-properties")
-def update_node_properties(data: dict):
+async def update_node_properties(data: dict):
     try:
         label = data.get("label")
         node_id = data.get("id")
         properties = data.get("properties")
-        result = db.update_node_properties(label, node_id, properties)
+        result = await db.update_node_properties(label, node_id, properties)
         return {"message": "Properties updated successfully", "node": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/nodes/{label}/update_properties")
-def update_properties_multiple_nodes(label: str, node_ids: list[int], properties: dict):
-    result = db.update_properties_multiple_nodes(label, node_ids, properties)
+async def update_properties_multiple_nodes(label: str, node_ids: list[int], properties: dict):
+    result = await db.update_properties_multiple_nodes(label, node_ids, properties)
     return {"message": "Properties updated successfully", "updated_nodes": result}
 
 @app.delete("/node/delete-properties")
-def delete_node_properties(data: dict):
+async def delete_node_properties(data: dict):
     try:
         label = data.get("label")
         node_id = data.get("id")
         properties = data.get("properties")
-        result = db.delete_node_properties(label, node_id, properties)
+        result = await db.delete_node_properties(label, node_id, properties)
         return {"message": "Properties deleted successfully", "node": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/nodes/{label}/delete_properties")
-def delete_properties_multiple_nodes(label: str, node_ids: list[int], properties: list[str]):
-    result = db.delete_properties_multiple_nodes(label, node_ids, properties)
+async def delete_properties_multiple_nodes(label: str, node_ids: list[int], properties: list[str]):
+    result = await db.delete_properties_multiple_nodes(label, node_ids, properties)
     return {"message": "Properties deleted successfully", "updated_nodes": result}
 #-----------------------------------Manejo de Relaciones --------------------------------------------
 # Crear relación
 @app.post("/relation/create")
-def create_relation(data: dict):
+async def create_relation(data: dict):
     try:
         from_label = data.get("from_label")
         from_id = data.get("from_id")
@@ -210,14 +468,18 @@ def create_relation(data: dict):
         if len(properties) < 3:
             raise HTTPException(status_code=400, detail="Se requieren al menos 3 propiedades")
 
-        result = db.create_relation(from_label, from_id, to_label, to_id, relation_type, properties)
+        result = await db.create_relation(from_label, from_id, to_label, to_id, relation_type, properties)
+        if from_label == "Usuario":
+            invalidate_precomputed([from_id], relation_type)
         return {"message": "Relation created successfully", "relation": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Agregar Propiedades a una Relación
 @app.put("/relation/add-properties")
-def add_properties_to_relation(data: dict):
+async def add_properties_to_relation(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -226,13 +488,15 @@ def add_properties_to_relation(data: dict):
         to_id = data.get("to_id")
         properties = data.get("properties")
 
-        result = db.add_properties_to_relation(from_label, from_id, to_label, to_id, relation_type, properties)
+        result = await db.add_properties_to_relation(from_label, from_id, to_label, to_id, relation_type, properties)
         return {"message": "Properties added successfully", "relation": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # Agregar Propiedades a multiples relaciones
 @app.put("/relations/add-multiple-properties")
-def add_properties_to_multiple_relations(data: dict):
+async def add_properties_to_multiple_relations(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -244,14 +508,16 @@ def add_properties_to_multiple_relations(data: dict):
         if not properties:
             raise HTTPException(status_code=400, detail="Se deben proporcionar al menos una propiedad")
 
-        result = db.add_properties_to_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
+        result = await db.add_properties_to_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
         return {"message": "Properties added to multiple relations successfully", "updated_relations": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 # Actualizar Propiedades de una Relación
 @app.put("/relation/update-properties")
-def update_relation_properties(data: dict):
+async def update_relation_properties(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -260,14 +526,16 @@ def update_relation_properties(data: dict):
         to_id = data.get("to_id")
         properties = data.get("properties")
 
-        result = db.update_relation_properties(from_label, from_id, to_label, to_id, relation_type, properties)
+        result = await db.update_relation_properties(from_label, from_id, to_label, to_id, relation_type, properties)
         return {"message": "Properties updated successfully", "relation": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ## Actualizar propiedades de multiples relaciones
 @app.put("/relations/update-multiple")
-def update_properties_multiple_relations(data: dict):
+async def update_properties_multiple_relations(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -276,14 +544,16 @@ def update_properties_multiple_relations(data: dict):
         to_ids = data.get("to_ids")
         properties = data.get("properties")
 
-        result = db.update_properties_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
+        result = await db.update_properties_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
         return {"message": "Properties updated successfully", "updated_relations": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Eliminar Propiedades de una Relación
 @app.delete("/relation/delete-properties")
-def delete_relation_properties(data: dict):
+async def delete_relation_properties(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -292,14 +562,16 @@ def delete_relation_properties(data: dict):
         to_id = data.get("to_id")
         properties = data.get("properties")
 
-        result = db.delete_relation_properties(from_label, from_id, to_label, to_id, relation_type, properties)
+        result = await db.delete_relation_properties(from_label, from_id, to_label, to_id, relation_type, properties)
         return {"message": "Properties deleted successfully", "relation": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Eliminar Propiedades de multiples relaciones
 @app.delete("/relations/delete-multiple-properties")
-def delete_properties_multiple_relations(data: dict):
+async def delete_properties_multiple_relations(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -311,39 +583,49 @@ def delete_properties_multiple_relations(data: dict):
         if not properties:
             raise HTTPException(status_code=400, detail="Se deben proporcionar al menos una propiedad para eliminar")
 
-        result = db.delete_properties_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
+        result = await db.delete_properties_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type, properties)
         return {"message": "Properties deleted from multiple relations successfully", "updated_relations": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # ------------------------ Eliminar Nodos y Relaciones --------------------------------------------
 ## Eliminar un nodo
 @app.delete("/node/delete")
-def delete_node(data: dict):
+async def delete_node(data: dict):
     try:
         label = data.get("label")
         node_id = data.get("id")
 
-        result = db.delete_node(label, node_id)
+        result = await db.delete_node(label, node_id)
+        if label == "Usuario":
+            invalidate_precomputed([node_id])
         return {"message": "Node deleted successfully", "deleted_node": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ## Eliminar varios nodos
 @app.delete("/nodes/delete-multiple")
-def delete_multiple_nodes(data: dict):
+async def delete_multiple_nodes(data: dict):
     try:
         label = data.get("label")
         node_ids = data.get("ids")
 
-        result = db.delete_multiple_nodes(label, node_ids)
+        result = await db.delete_multiple_nodes(label, node_ids)
+        if label == "Usuario":
+            invalidate_precomputed(node_ids)
         return {"message": "Nodes deleted successfully", "deleted_nodes": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ## Eliminar una relación
 @app.delete("/relation/delete")
-def delete_relation(data: dict):
+async def delete_relation(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -351,14 +633,18 @@ def delete_relation(data: dict):
         to_label = data.get("to_label")
         to_id = data.get("to_id")
 
-        result = db.delete_relation(from_label, from_id, to_label, to_id, relation_type)
+        result = await db.delete_relation(from_label, from_id, to_label, to_id, relation_type)
+        if from_label == "Usuario":
+            invalidate_precomputed([from_id], relation_type)
         return {"message": "Relation deleted successfully", "deleted_relation": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ## Eliminar varias relaciones
 @app.delete("/relations/delete-multiple")
-def delete_multiple_relations(data: dict):
+async def delete_multiple_relations(data: dict):
     try:
         relation_type = data.get("relation_type")
         from_label = data.get("from_label")
@@ -366,183 +652,435 @@ def delete_multiple_relations(data: dict):
         to_label = data.get("to_label")
         to_ids = data.get("to_ids")
 
-        result = db.delete_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type)
+        result = await db.delete_multiple_relations(from_label, from_ids, to_label, to_ids, relation_type)
+        if from_label == "Usuario":
+            invalidate_precomputed(from_ids, relation_type)
         return {"message": "Relations deleted successfully", "deleted_relations": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ## Get nodes -----------------------------------------------
+# NDJSON: un registro por linea, escrito a medida que llega del driver
+async def ndjson(records):
+    async for record in records:
+        yield json.dumps(record, default=str) + "\n"
+
 @app.get("/nodes")
-def get_all_nodes():
+async def get_all_nodes(cursor: str = None, limit: int = 1000, stream: bool = False, props: str = None):
+    props = props.split(",") if props else None
     try:
-        result = db.get_all_nodes()
-        return {"nodes": result}
+        if stream:
+            return StreamingResponse(ndjson(db.stream_nodes(props=props)), media_type="application/x-ndjson")
+        return await db.get_all_nodes_page(cursor, limit, props)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/nodes/{label}")
-def get_nodes_by_label(label: str):
+async def get_nodes_by_label(label: str, after: int = None, limit: int = 1000, stream: bool = False, props: str = None):
+    props = props.split(",") if props else None
     try:
-        result = db.get_nodes_by_label(label)
-        return {"nodes": result}
+        # stream_nodes valida la label al llamarlo, antes de empezar la respuesta
+        if stream:
+            return StreamingResponse(ndjson(db.stream_nodes(label, props)), media_type="application/x-ndjson")
+        result = await db.get_nodes_page(label, after, limit, props)
+        next_after = result[-1]["n"]["id"] if len(result) == limit else None
+        return {"nodes": result, "next": next_after}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/search/{node_id}")
-def search_by_id(node_id: str):
-    return db.get_node_by_id(node_id)
+async def search_by_id(node_id: str):
+    return await db.get_node_by_id(node_id)
 
 @app.get("/searchidlabel/{node_id}/{label}")
-def search_by_id_and_label(node_id: str, label: str):
-    return db.get_node_by_id_and_label(node_id, label)
+async def search_by_id_and_label(node_id: str, label: str):
+    return await db.get_node_by_id_and_label(node_id, label)
+
+# PNGs ya dibujados por cuerpo de solicitud normalizado (LRU con TTL)
+render_cache = TTLCache(settings.render_cache_size, settings.render_cache_ttl)
+
+def render_key(route, data):
+    return route + "|" + json.dumps(data, sort_keys=True, default=str)
+
+VIS_FORMATS = ("png", "json", "binary")
+
+def vis_format(data):
+    fmt = data.get("format", "png")
+    if fmt not in VIS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format debe ser uno de {', '.join(VIS_FORMATS)}")
+    return fmt
+
+# json / binary devuelven el subgrafo tal cual (sin networkx ni matplotlib) para dibujar en el cliente
+async def vis_response(key, fmt, pairs):
+    if fmt == "json":
+        return render.graph_columns(pairs)
+    if fmt == "binary":
+        return Response(render.graph_binary(render.graph_columns(pairs)), media_type="application/octet-stream")
+    # layout y dibujo son CPU: fuera del event loop
+    png = await run_in_threadpool(lambda: render.render_png(render.build_graph(pairs)))
+    render_cache.set(key, png)
+    return Response(png, media_type="image/png")
 
 @app.post("/vis-simple")
-def vis_simple(data: dict):
+async def vis_simple(data: dict):
+    fmt = vis_format(data)
     try:
+        key = render_key("vis-simple", data)
+        if fmt == "png":
+            hit, png = render_cache.get(key)
+            if hit:
+                return Response(png, media_type="image/png")
         f_label = data.get("f_label")
         f_val = data.get("f_val")
         t_label = data.get("t_label")
         t_val = data.get("t_val")
         rel = data.get("rel")
         limit = data.get("limit")
-        edges = db.simple_match(f_label,t_label,rel,limit)
-        G = nx.DiGraph()
-        node_colors = {}
-        for edge in edges:
-            G.add_node(edge['a']['id'], label=edge['a'][f_val])
-            G.add_node(edge['b']['id'], label=edge['b'][t_val])
-        
-            node_colors[edge["a"]["id"]] = "lightblue"  # Color for "n" type
-            node_colors[edge["b"]["id"]] = "lightgreen"
-            
-            G.add_edge(edge['a']['id'], edge['b']['id']) 
-        
-        labels = nx.get_node_attributes(G, "label") 
-        plt.figure(figsize=(8, 6))
-        pos = nx.spring_layout(G,k=2.0)
-        nx.draw(G, pos, labels=labels, with_labels=True, 
-                node_color=[node_colors[n] for n in G.nodes()], edge_color="gray", node_size=1500, font_size=5)
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close()
-        buf.seek(0)
-        return Response(buf.read(), media_type="image/png")
+        edges = await db.simple_match(f_label,t_label,rel,limit)
+        return await vis_response(key, fmt, render.simple_pairs(edges, f_label, t_label, f_val, t_val))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/vis-filter")
-def vis_filter(data: dict):
+async def vis_filter(data: dict):
+    fmt = vis_format(data)
     try:
-        labels = data.get("labels")
-        limit = data.get("limit")
-        rels = data.get("rels")
-        cond = data.get("cond")
-        edges = db.filter_match(labels, rels,cond, limit)
+        ## labels, rels, cond ("prop,op,valor") y/o where: predicados tipados (ver model.Filtro)
+        filtro = Filtro.model_validate({k: v for k, v in data.items() if v is not None})
+        if data.get("explain"):
+            return await db.explain_filter(filtro)
+        key = render_key("vis-filter", data)
+        if fmt == "png":
+            hit, png = render_cache.get(key)
+            if hit:
+                return Response(png, media_type="image/png")
+        edges = await db.filter_nodes(filtro)
         show_props = data.get("show_props")
-        G = nx.DiGraph()
-        props = []
-        for edge in edges:
-            if edge["n_labels"][0] not in props:
-                props.append(edge["n_labels"][0])
-            if edge["m_labels"][0] not in props:
-                props.append(edge["m_labels"][0])
-        color_map = {}
-        available_colors = ["lightblue", "lightgreen", "lightpurple", "orange", "pink", "brown"]
-        for prop in props:
-            if prop not in color_map:
-                color_map[prop] = random.choice(available_colors)
-        
-        node_colors = {}
-        for edge in edges:
-            a_label = ""
-            b_label = ""
-            if not show_props:
-                a_label = edge["n"].get("nombre") or edge["n"].get("titulo")
-                b_label = edge["m"].get("nombre") or edge["m"].get("titulo")
-            else:
-                a_keys = edge["n"].keys()
-                for k in a_keys:
-                    if(type(edge["n"][k])!=dict):
-                        a_label+= k+": "+str(edge["n"][k])+"\n"
-                b_keys = edge["m"].keys()
-                for k in b_keys:
-                    if(type(edge["m"][k])!=dict):
-                        b_label+= k+": "+str(edge["m"][k])+"\n"
-            G.add_node(edge['n']['id'], label=a_label)
-            G.add_node(edge['m']['id'], label=b_label)
-        
-            node_colors[edge["n"]["id"]] = color_map[edge["n_labels"][0]] # Color for "n" type
-            node_colors[edge["m"]["id"]] = color_map[edge["m_labels"][0]]
-    
-            G.add_edge(edge['n']['id'], edge['m']['id']) 
-        
-        labels = nx.get_node_attributes(G, "label") 
-        plt.figure(figsize=(8, 6))
-        pos = nx.spring_layout(G,k=2.0)
-        nx.draw(G, pos, labels=labels, with_labels=True, 
-                node_color=[node_colors[n] for n in G.nodes()], edge_color="gray", node_size=1500, font_size=5)
+        return await vis_response(key, fmt, render.filter_pairs(edges, show_props))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close()
-        buf.seek(0)
-        return Response(buf.read(), media_type="image/png")
+# Precalcula el layout de todo el grafo y lo guarda como propiedades x/y de los nodos
+@app.post("/vis/layout")
+async def precompute_layout(iterations: int = 50):
+    try:
+        rows = await db.layout_graph()
+        positions = await run_in_threadpool(render.layout_rows, rows, iterations)
+        await db.store_layout(positions)
+        render_cache.clear()
+        return {"nodes": len(positions)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
 # Mejor calificadas
 @app.get("/top-rating/{label}")
-def dataminint(label: str):
-    top_media = db.top_rating(label, 10)[0]["collect(a)"]
-    return top_media
+async def dataminint(label: str):
+    try:
+        top_media = (await db.top_rating(label, 10))[0]["collect(a)"]
+        return top_media
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 # Mas vistas
 @app.get("/top-views/{label}")
-def dataminint(label: str):
-    top_media = db.top_views(label, 10)[0]["collect(a)"]
-    return top_media
+async def dataminint(label: str):
+    try:
+        top_media = (await db.top_views(label, 10))[0]["collect(a)"]
+        return top_media
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Recalcula vistas / promedios materializados (datos cargados antes de mantenerlos)
+@app.post("/stats/aggregates/rebuild")
+async def rebuild_aggregates():
+    try:
+        return await db.rebuild_aggregates()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Estadisticas de Usuarios a partir del cubo agregado por Neo4j (ver GraphDB.user_stats)
+def summarize_users(cubo, intereses):
+    df = pd.DataFrame.from_records(cubo, columns=[
+        "pais", "suscripcion", "dispositivo", "activo", "edad_rango",
+        "usuarios", "edad_suma", "edad_suma2", "edad_min", "edad_max",
+    ])
+    total = int(df["usuarios"].sum())
+    if total == 0:
+        return {"usuarios": 0}
+    con_edad = df[df["edad_rango"].notna()]
+    n_edad = int(con_edad["usuarios"].sum())
+    edad = {}
+    if n_edad:
+        media = con_edad["edad_suma"].sum() / n_edad
+        varianza = max(con_edad["edad_suma2"].sum() / n_edad - media ** 2, 0.0)
+        edad = {
+            "promedio": round(float(media), 2),
+            "desviacion": round(float(varianza ** 0.5), 2),
+            "min": int(con_edad["edad_min"].min()),
+            "max": int(con_edad["edad_max"].max()),
+            "distribucion": {
+                f"{int(rango)}-{int(rango) + 9}": int(n)
+                for rango, n in con_edad.groupby("edad_rango")["usuarios"].sum().items()
+            },
+        }
+
+    def conteo(col):
+        counts = df.groupby(col, dropna=False)["usuarios"].sum().sort_values(ascending=False)
+        return {("desconocido" if pd.isna(k) else str(k)): int(v) for k, v in counts.items()}
+
+    activos = int(df.loc[df["activo"] == True, "usuarios"].sum())  # noqa: E712
+    return {
+        "usuarios": total,
+        "activos": activos,
+        "tasa_actividad": round(activos / total, 4),
+        "edad": edad,
+        "por_pais": conteo("pais"),
+        "por_suscripcion": conteo("suscripcion"),
+        "por_dispositivo": conteo("dispositivo"),
+        "intereses": {r["interes"]: r["usuarios"] for r in intereses},
+    }
 
-# Estadisticas de Usuarios
 @app.get("/users-stats/")
-def user_stats():
-    # Get users edges
-    users = db.get_nodes_by_label("Usuario")
-    df = pd.DataFrame()
-    for u in users:
-        df =pd.concat([df, pd.DataFrame([u["n"]])],ignore_index=True)
-    df["edad"] = df["edad"].astype(int)
-    print(df.describe())
-    return {"users": "lol"}
-
-    # Convert to dataframe
-    # Filter only numeric
-    # Return describe
+async def user_stats():
+    try:
+        rows = await db.user_stats()
+        row = rows[0]
+        return summarize_users(row["cubo"], row["intereses"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Motor en memoria sobre la matriz Usuario x Pelicula; se construye en la primera consulta
+sparse_rec = None
+sparse_lock = asyncio.Lock()
+
+async def get_sparse_rec(refresh=False):
+    global sparse_rec
+    async with sparse_lock:
+        if sparse_rec is None or refresh:
+            rows = await db.interactions()
+            sparse_rec = await run_in_threadpool(SparseRecommender.from_rows, rows)
+    return sparse_rec
+
+# Snapshot en memoria del subgrafo de /rec/* (snapshot.GraphSnapshot). Cada recarga construye
+# uno nuevo y reemplaza la referencia; una solicitud lee la referencia una sola vez.
+graph_snapshot = None
+snapshot_lock = asyncio.Lock()
+
+async def load_snapshot():
+    global graph_snapshot
+    async with snapshot_lock:
+        nodes = await db.snapshot_nodes(SNAPSHOT_LABELS, SNAPSHOT_FULL)
+        edges = await db.snapshot_edges(SNAPSHOT_RELS)
+        graph_snapshot = await run_in_threadpool(GraphSnapshot.from_rows, nodes, edges)
+    return graph_snapshot
+
+async def snapshot_loop():
+    while True:
+        try:
+            await load_snapshot()
+        except Exception as e:
+            print(f"No se pudo cargar el snapshot: {e}")
+        await asyncio.sleep(settings.snapshot_refresh)
+
+# recorrido de recomendacion: en el snapshot si esta cargado y conoce al usuario, si no en Neo4j
+async def traverse(name, id, *args):
+    snap = graph_snapshot
+    if snap is not None and snap.has_user(id):
+        return getattr(snap, name)(id, *args)
+    return await getattr(db, name)(id, *args)
+
+@app.get("/rec/snapshot")
+async def snapshot_stats():
+    snap = graph_snapshot
+    if snap is None:
+        return {"loaded": False, "refresh": settings.snapshot_refresh}
+    return {"loaded": True, "refresh": settings.snapshot_refresh, **snap.stats()}
+
+@app.post("/rec/snapshot/refresh")
+async def refresh_snapshot():
+    try:
+        snap = await load_snapshot()
+        return snap.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Recomendaciones precalculadas (precompute.py): se abre solo la cabecera del archivo y se
+# vuelve a abrir cuando el proceso nocturno lo reemplaza (revisado como mucho una vez por segundo)
+precomputed = None
+precomputed_checked = 0.0
+
+def get_precomputed():
+    global precomputed, precomputed_checked
+    if not settings.precomputed_path:
+        return None
+    now = time.monotonic()
+    if now - precomputed_checked >= 1.0:
+        precomputed_checked = now
+        if precomputed is None or precomputed.replaced():
+            try:
+                precomputed = PrecomputedStore(settings.precomputed_path)
+            except (OSError, ValueError) as e:
+                if precomputed is None:
+                    print(f"Sin recomendaciones precalculadas: {e}")
+    return precomputed
+
+# los usuarios con interacciones nuevas o borradas se responden en vivo hasta el proximo precalculo;
+# rel=None invalida sin importar el motor (p.ej. usuario eliminado). Sin archivo todavia (primer
+# precalculo en curso) se anotan igual en el log, que el archivo nuevo aplica al abrirse
+def invalidate_precomputed(user_ids, rel=None):
+    store = get_precomputed()
+    if store is not None and (rel is None or rel in store.rels):
+        store.invalidate(user_ids)
+    elif store is None and settings.precomputed_path:
+        log_invalidation(settings.precomputed_path, user_ids)
+
+# [(id de pelicula, puntaje)] -> filas {new, score}; nodos del snapshot si los tiene todos
+async def movie_rows(scored):
+    ids = [m for m, _ in scored]
+    snap = graph_snapshot
+    nodes = snap.movie_nodes(ids) if snap is not None else None
+    if nodes is None:
+        rows = await db.get_nodes_by_ids("Pelicula", ids)
+        nodes = {r["n"]["id"]: r["n"] for r in rows}
+    return [{"new": nodes[m], "score": score} for m, score in scored if m in nodes]
 
 @app.get("/rec/user/{id}")
-def recommend(id:str):
-    rslt = db.by_user_similartiy(id)
-    return {"movies": rslt}
+async def recommend(id:str, limit: int = 10, engine: str = "graph"):
+    if not id.lstrip("-").isdigit():
+        raise HTTPException(status_code=400, detail=f"id debe ser un entero: {id!r}")
+    store = get_precomputed()
+    if store is not None and store.engine == engine:
+        scored = store.lookup(int(id), limit)
+        if scored is not None:
+            return {"movies": await movie_rows(scored)}
+    if engine == "graph":
+        rslt = await traverse("by_user_similartiy", id, limit)
+        return {"movies": rslt}
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine debe ser graph o uno de {', '.join(ENGINES)}")
+    rec = await get_sparse_rec()
+    scored = await run_in_threadpool(rec.recommend, int(id), limit, engine)
+    return {"movies": await movie_rows([(m["id"], m["score"]) for m in scored])}
+
+@app.get("/rec/precomputed")
+async def precomputed_info():
+    store = get_precomputed()
+    if store is None:
+        return {"loaded": False, "path": settings.precomputed_path}
+    return {"loaded": True, **store.info()}
+
+# Precalculo bajo demanda (normalmente corre de noche: python precompute.py ruta --engine graph)
+@app.post("/rec/precomputed/rebuild")
+async def rebuild_precomputed(engine: str = "graph", top_n: int = None):
+    if not settings.precomputed_path:
+        raise HTTPException(status_code=400, detail="precomputed_path no esta configurado")
+
+    def run():
+        sync_db = GraphDB(settings.neo4j_uri, settings.neo4j_username, settings.neo4j_password, **pool_config)
+        try:
+            return precompute(sync_db, settings.precomputed_path, top_n or settings.precomputed_top_n, engine)
+        finally:
+            sync_db.close()
+    try:
+        return await run_in_threadpool(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/rec/precomputed/invalidate")
+async def invalidate_precomputed_users(data: dict):
+    store = get_precomputed()
+    if store is None:
+        return {"invalidated": 0}
+    ids = [int(i) for i in data.get("ids", [])]
+    store.invalidate(ids)
+    return {"invalidated": len(ids)}
+
+# Puntaje por lotes (p.ej. precomputo nocturno): {"ids": [...], "limit": 10, "engine": "item_knn"}
+@app.post("/rec/batch")
+async def recommend_batch(data: dict):
+    try:
+        engine = data.get("engine", "item_knn")
+        limit = data.get("limit", 10)
+        rec = await get_sparse_rec()
+        ids = data.get("ids")
+        if ids is None:
+            ids = rec.user_ids.tolist()
+        result = await run_in_threadpool(rec.recommend_batch, ids, limit, engine)
+        return {"engine": engine, "users": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/rec/engine/refresh")
+async def refresh_engine():
+    rec = await get_sparse_rec(refresh=True)
+    return {"users": rec.R.shape[0], "movies": rec.R.shape[1], "interactions": rec.R.nnz}
+
+@app.post("/rec/similarity/rebuild")
+async def rebuild_similarity():
+    try:
+        return await db.rebuild_similarity()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/rec/subgenre/{id}")
-def get_sub(id:str):
-    print(id)
-    rslt = db.get_subgeneres(id)
-    fav = rslt[0]["subgenero"]
-    movies = db.by_subgenre(id, fav)
+async def get_sub(id:str, limit: int = 5, subgenres: int = 1):
+    # usuarios sin historial devuelven una lista vacia
+    movies = await traverse("by_subgenre", id, limit, subgenres)
     return {"movies": movies}
 
 @app.get("/rec/actor/{id}")
-def get_sub(id:str):
-    rslt = db.by_actor(id)
+async def get_sub(id:str, limit: int = 10, skip: int = 0):
+    rslt = await traverse("by_actor", id, limit, skip)
     return {"movies": rslt}
 
 @app.get("/rec/director/{id}")
-def get_sub(id:str):
-    rslt = db.by_director(id)
+async def get_sub(id:str, limit: int = 10, skip: int = 0):
+    rslt = await traverse("by_director", id, limit, skip)
     return {"movies": rslt}
 
+# Recomendacion hibrida: las senales se consultan en paralelo y se fusionan
+@app.get("/rec/hybrid/{id}")
+async def recommend_hybrid(id: str, limit: int = 10, method: str = "weighted", candidates: int = 50,
+                           w_user: float = 1.0, w_subgenre: float = 1.0,
+                           w_actor: float = 1.0, w_director: float = 1.0):
+    if method not in hybrid.METHODS:
+        raise HTTPException(status_code=400, detail=f"method debe ser uno de {', '.join(hybrid.METHODS)}")
+    weights = {"user": w_user, "subgenre": w_subgenre, "actor": w_actor, "director": w_director}
+    queries = {
+        "user": traverse("by_user_similartiy", id, candidates),
+        "subgenre": traverse("by_subgenre", id, candidates, 3),
+        "actor": traverse("by_actor", id, candidates),
+        "director": traverse("by_director", id, candidates),
+    }
+    results = await asyncio.gather(*queries.values(), return_exceptions=True)
+    signals, errors = {}, {}
+    for name, rows in zip(queries, results):
+        if isinstance(rows, Exception):
+            errors[name] = str(rows)
+        else:
+            signals[name] = hybrid.extract(name, rows)
+    if errors and not signals:
+        raise HTTPException(status_code=500, detail=errors)
+    movies = hybrid.fuse(signals, weights, method, limit)
+    return {"movies": movies, "method": method, "weights": weights, "errors": errors}
+
 ## Por ACTOR
 ## pOR DIRECTOR
 # Recomendacion de peliculas por usuario
\ No newline at end of file
@@ -0,0 +1,183 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+## Metricas en memoria del proceso, expuestas en formato de texto de Prometheus (GET /metrics).
+## Consultas: tiempo de pared, tiempos del servidor (result_available_after / result_consumed_after),
+## registros devueltos y errores por nombre logico (el metodo de GraphDB que la lanzo).
+## Rutas: duracion por metodo, plantilla de ruta y codigo de estado.
+## PROFILE muestreado (opcional): una fraccion de las consultas se ejecuta con PROFILE y,
+## si resultan lentas, se imprimen sus db hits y el plan de operadores.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECORD_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+DB_HIT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [conteo por bucket (+Inf al final), suma]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float("inf")), counts):
+                    cumulative += count
+                    le = _labels(self.labels, labels, [("le", _number(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+QUERY_SECONDS = Histogram("graphdb_query_seconds", "Tiempo de pared de la consulta en el cliente", ("query",))
+QUERY_SERVER_SECONDS = Histogram(
+    "graphdb_query_server_seconds",
+    "Tiempos reportados por el servidor (available: primer registro listo, consumed: resultado consumido)",
+    ("query", "phase"),
+)
+QUERY_RECORDS = Histogram("graphdb_query_records", "Registros devueltos por consulta", ("query",), RECORD_BUCKETS)
+QUERY_ERRORS = Counter("graphdb_query_errors_total", "Consultas que terminaron con error", ("query", "error"))
+QUERY_DB_HITS = Histogram("graphdb_query_db_hits", "db hits de las consultas muestreadas con PROFILE", ("query",),
+                          DB_HIT_BUCKETS)
+HTTP_SECONDS = Histogram("http_request_seconds", "Duracion de las solicitudes HTTP hasta la respuesta",
+                         ("method", "route", "status"))
+
+REGISTRY = [QUERY_SECONDS, QUERY_SERVER_SECONDS, QUERY_RECORDS, QUERY_ERRORS, QUERY_DB_HITS, HTTP_SECONDS]
+
+# fraccion de consultas ejecutadas con PROFILE y umbral para imprimir su plan
+PROFILE = {"rate": 0.0, "slow_ms": 500.0}
+# sentencias que no admiten PROFILE
+_NO_PROFILE = ("PROFILE", "EXPLAIN", "CYPHER", "SHOW", "CREATE CONSTRAINT", "CREATE INDEX",
+               "CREATE RANGE", "CREATE TEXT", "DROP")
+
+# metodos de GraphDB que solo ejecutan consultas de otros; el nombre es el del primero fuera de ellos
+_MAQUINARIA = frozenset(("fetch", "fetch_iter", "_execute_query", "_execute_write", "_execute_batch", "_execute_chunks",
+                         "_execute_lanes", "_execute_many", "_explain", "_similar_write", "_cached_query", "_then",
+                         "_invalidating"))
+
+
+def configure(profile_rate=0.0, profile_slow_ms=500.0):
+    PROFILE["rate"] = profile_rate
+    PROFILE["slow_ms"] = profile_slow_ms
+
+
+## nombre logico de la consulta en curso a partir de la pila de llamadas
+def query_name():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_name in _MAQUINARIA:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "desconocida"
+
+
+def _plan_lines(plan, depth=0):
+    args = plan.get("args") or {}
+    detail = args.get("Details") or args.get("details") or ""
+    yield f"{'  ' * depth}{plan.get('operatorType')} rows={plan.get('rows')} dbHits={plan.get('dbHits')} {detail}".rstrip()
+    for child in plan.get("children") or []:
+        yield from _plan_lines(child, depth + 1)
+
+
+def db_hits(plan):
+    return (plan.get("dbHits") or 0) + sum(db_hits(c) for c in plan.get("children") or [])
+
+
+## Mide una consulta. `query` es la consulta a enviar (con PROFILE si fue muestreada);
+## done() recibe el numero de registros y el ResultSummary del driver
+class QueryTimer:
+    __slots__ = ("name", "query", "profiled", "start")
+
+    def __init__(self, name, query):
+        self.name = name
+        self.profiled = (
+            PROFILE["rate"] > 0 and random.random() < PROFILE["rate"]
+            and not query.lstrip().upper().startswith(_NO_PROFILE)
+        )
+        self.query = "PROFILE " + query if self.profiled else query
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, tb):
+        # un stream cerrado por el cliente no es un error de la consulta
+        if kind is not None and not issubclass(kind, (GeneratorExit, asyncio.CancelledError)):
+            QUERY_SECONDS.observe(time.perf_counter() - self.start, self.name)
+            QUERY_ERRORS.inc(self.name, kind.__name__)
+        return False
+
+    def done(self, records, summary):
+        wall = time.perf_counter() - self.start
+        QUERY_SECONDS.observe(wall, self.name)
+        QUERY_RECORDS.observe(records, self.name)
+        if summary.result_available_after is not None:
+            QUERY_SERVER_SECONDS.observe(summary.result_available_after / 1000, self.name, "available")
+        if summary.result_consumed_after is not None:
+            QUERY_SERVER_SECONDS.observe(summary.result_consumed_after / 1000, self.name, "consumed")
+        plan = summary.profile if self.profiled else None
+        if plan:
+            hits = db_hits(plan)
+            QUERY_DB_HITS.observe(hits, self.name)
+            if wall * 1000 >= PROFILE["slow_ms"]:
+                print(f"Consulta lenta {self.name}: {wall * 1000:.1f} ms, {hits} db hits, {records} registros\n"
+                      + "\n".join(_plan_lines(plan)))
+
+
+def observe_request(method, route, status, seconds):
+    HTTP_SECONDS.observe(seconds, method, route, str(status))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,14 @@
-from neo4j import GraphDatabase
-from pydantic import BaseModel
+import asyncio
+import itertools
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from typing import Annotated, Any, Literal, Union
+from pydantic import AfterValidator, BaseModel, Field, field_validator, model_validator
+from cache import node_tags
+from metrics import QueryTimer, query_name
+from shaping import shape_record
 # Usuario
 class Usuario(BaseModel):
     id: int
@@ -59,365 +68,983 @@ class Director(BaseModel):
     premios: int
     activo: bool
 
+MODELOS = {m.__name__: m for m in (Usuario, Pelicula, Serie, Genero, Actor, Director)}
+
+# Tipos de relacion: (label origen, label destino, [(propiedad, conversion Cypher)])
+RELACIONES = {
+    "VIO": ("Usuario", "Pelicula", [("fecha", "date"), ("dispositivo", None), ("rating", "toFloat")]),
+    "CALIFICO": ("Usuario", "Pelicula", [("fecha", "date"), ("calificacion", "toFloat"), ("comentario", None)]),
+    "RECOMENDO": ("Usuario", "Pelicula", [("fecha", "date"), ("razon", None), ("confianza", "toFloat")]),
+    "SIGUE": ("Usuario", "Director", [("fecha_inicio", "date"), ("nivel_interes", "toInteger"), ("notificaciones", "toBoolean")]),
+    "ADMIRA": ("Usuario", "Actor", [("fecha_inicio", "date"), ("nivel_admiracion", "toInteger"), ("razon", None)]),
+    "PERTENECE_A": ("Pelicula", "Genero", [("peso", "toFloat"), ("relevancia", None), ("fecha_asignacion", "date")]),
+    "TIENE_TEMATICA": ("Serie", "Genero", [("popularidad", "toInteger"), ("tendencia", "toBoolean"), ("impacto_cultural", None)]),
+    "DIRIGIDA_POR": ("Pelicula", "Director", [("tipo", None), ("experiencia", "toInteger"), ("premios_ganados", "toInteger")]),
+    "PRODUCIDA_POR": ("Serie", "Director", [("tipo", None), ("productora", None), ("años_experiencia", "toInteger")]),
+    "PARTICIPO_EN": ("Actor", "Pelicula", [("rol", None), ("apariciones", "toInteger"), ("premios_obtenidos", "toInteger")]),
+}
+
+# Agregados materializados en el nodo destino de cada relacion:
+# relacion -> [(propiedad, propiedad de la relacion a promediar | None para contar)]
+# Los promedios guardan ademas <propiedad>_suma y <propiedad>_n para actualizarse en O(1).
+AGREGADOS = {
+    "VIO": [("vistas", None), ("rating_vistas", "rating")],
+    "CALIFICO": [("calificaciones", None), ("calificacion_promedio", "calificacion")],
+    "RECOMENDO": [("recomendaciones", None)],
+}
+
+# labels destino de las relaciones de AGREGADOS: las unicas con vistas / promedios materializados
+AGREGADOS_LABELS = tuple(sorted({RELACIONES[rel][1] for rel in AGREGADOS}))
+
+# conversiones de RELACIONES que aplica create_relation a las propiedades enviadas por la API
+# (date queda fuera: un texto que no es fecha haria fallar la escritura)
+CONVERSIONES_VALOR = ("toFloat", "toInteger", "toBoolean")
+
+# Indices de rango sobre propiedades consultadas con frecuencia (ademas de id)
+INDICES = [("Pelicula", "rating"), ("Serie", "rating"), ("Pelicula", "vistas")]
+
+# Cota inferior para la paginacion por id (entero de 64 bits de Neo4j)
+MIN_ID = -(2 ** 63)
+
+# Vecinos por pelicula en el indice de similitud item-item (:Pelicula)-[:SIMILAR_A]->(:Pelicula)
+SIMILAR_K = 20
+
+# Tipos de relacion de los datos: los patrones sin tipo se restringen a estos para no
+# devolver las aristas derivadas (SIMILAR_A)
+TIPOS_DOMINIO = "|".join(RELACIONES)
+
+## PLANTILLAS DE CONSULTA
+## Solo las labels de MODELOS y los tipos de RELACIONES se insertan en el texto Cypher;
+## ids, limites, valores y mapas de propiedades van como parametros. Los textos se arman
+## una vez (lru_cache) y son identicos en cada llamada, asi Neo4j reutiliza el plan.
+OPERADORES = {"=": "=", "<>": "<>", "!=": "<>", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_CLAVE = re.compile(r"[^\W\d]\w*")
+
+def label_valida(label):
+    if label not in MODELOS:
+        raise ValueError(f"Label desconocida: {label!r}. Opciones: {', '.join(MODELOS)}")
+    return label
+
+def relacion_valida(rel):
+    if rel not in RELACIONES:
+        raise ValueError(f"Tipo de relacion desconocido: {rel!r}. Opciones: {', '.join(RELACIONES)}")
+    return rel
+
+def clave_valida(key):
+    if not isinstance(key, str) or not _CLAVE.fullmatch(key):
+        raise ValueError(f"Nombre de propiedad invalido: {key!r}")
+    return key
+
+## valor de una condicion "prop,op,valor": 'texto' / "texto", true / false, entero, decimal o texto
+def _literal(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    for conv in (int, float):
+        try:
+            return conv(text)
+        except ValueError:
+            pass
+    return text
+
+## "prop,op,valor" -> (prop, operador Cypher, valor como parametro)
+def parse_condicion(cond):
+    parts = [p.strip() for p in cond.split(",", 2)]
+    if len(parts) != 3:
+        raise ValueError(f"Condicion invalida: {cond!r} (formato prop,op,valor)")
+    prop, op, value = parts
+    if op not in OPERADORES:
+        raise ValueError(f"Operador invalido: {op!r}. Opciones: {', '.join(OPERADORES)}")
+    return clave_valida(prop), OPERADORES[op], _literal(value)
+
+def _match_nodo(label, varios):
+    if varios:
+        return f"MATCH (n:{label_valida(label)}) WHERE n.id IN $node_ids"
+    return f"MATCH (n:{label_valida(label)} {{id: $node_id}})"
+
+def _match_relacion(from_label, rel, to_label, varios, id_interno=False):
+    pattern = f"(a:{label_valida(from_label)})-[r:{relacion_valida(rel)}]->(b:{label_valida(to_label)})"
+    if not varios:
+        return f"MATCH (a:{from_label} {{id: $from_id}})-[r:{rel}]->(b:{to_label} {{id: $to_id}})"
+    if id_interno:
+        return f"MATCH {pattern} WHERE id(a) IN $from_ids AND id(b) IN $to_ids"
+    return f"MATCH {pattern} WHERE a.id IN $from_ids AND b.id IN $to_ids"
+
+## FILTROS (/vis-filter)
+## Un Filtro es una conjuncion de predicados tipados sobre el nodo origen (n) o destino (m)
+## de cada relacion. Se compila a Cypher parametrizado que parte de las labels de n y sus
+## propiedades indexadas, en vez de recorrer todas las relaciones del grafo.
+Clave = Annotated[str, AfterValidator(clave_valida)]
+
+class Comparacion(BaseModel):
+    tipo: Literal["cmp"] = "cmp"
+    nodo: Literal["n", "m"] = "n"
+    prop: Clave
+    op: str = "="
+    valor: Any
+
+    @field_validator("op")
+    @classmethod
+    def _op(cls, op):
+        if op not in OPERADORES:
+            raise ValueError(f"Operador invalido: {op!r}. Opciones: {', '.join(OPERADORES)}")
+        return OPERADORES[op]
+
+class En(BaseModel):
+    tipo: Literal["in"] = "in"
+    nodo: Literal["n", "m"] = "n"
+    prop: Clave
+    valores: list
+
+## min <= prop <= max; una cota en None no se aplica
+class Rango(BaseModel):
+    tipo: Literal["rango"] = "rango"
+    nodo: Literal["n", "m"] = "n"
+    prop: Clave
+    min: Any = None
+    max: Any = None
+
+    @model_validator(mode="after")
+    def _cotas(self):
+        if self.min is None and self.max is None:
+            raise ValueError(f"Rango sobre {self.prop} sin min ni max")
+        return self
+
+## el nodo tiene alguna de las labels
+class ConLabel(BaseModel):
+    tipo: Literal["label"] = "label"
+    nodo: Literal["n", "m"] = "n"
+    labels: list[Annotated[str, AfterValidator(label_valida)]] = Field(min_length=1)
+
+Predicado = Annotated[Union[Comparacion, En, Rango, ConLabel], Field(discriminator="tipo")]
+
+class Filtro(BaseModel):
+    labels: list[str] = []  # labels de n (alguna)
+    rels: list[str] = []  # tipos de relacion admitidos (todos si esta vacio)
+    where: list[Predicado] = []
+    cond: list[str] = []  # formato anterior "prop,op,valor" sobre n
+    limit: int = Field(100, ge=0)
+
+    @field_validator("labels")
+    @classmethod
+    def _labels(cls, labels):
+        return list(dict.fromkeys(label_valida(label) for label in labels))
+
+    @field_validator("rels")
+    @classmethod
+    def _rels(cls, rels):
+        return list(dict.fromkeys(relacion_valida(rel) for rel in rels))
+
+    @field_validator("cond")
+    @classmethod
+    def _cond(cls, cond):
+        for c in cond:
+            parse_condicion(c)
+        return cond
+
+    ## (labels de anclaje de n, predicados restantes); sin labels, un ConLabel sobre n sirve de ancla
+    def anclas(self):
+        preds = list(self.where) + [Comparacion(prop=p, op=op, valor=v) for p, op, v in map(parse_condicion, self.cond)]
+        labels = self.labels
+        if not labels:
+            candidatos = [p for p in preds if p.tipo == "label" and p.nodo == "n"]
+            if candidatos:
+                ancla = min(candidatos, key=lambda p: len(p.labels))
+                preds.remove(ancla)
+                labels = list(dict.fromkeys(ancla.labels))
+        return tuple(labels), preds
+
+# propiedades con indice o constraint por label
+INDEXADAS = {(label, "id") for label in MODELOS} | set(INDICES)
+
+# costo relativo de cada clase de predicado (menor primero): los que usan indice, las labels
+# (no leen propiedades) y los mas selectivos van antes; los de m se evaluan despues de expandir
+COSTOS = {"indice_cmp": 1, "indice_in": 2, "indice_rango": 3, "label": 5, "cmp": 10, "in": 11, "rango": 12, "distinto": 20}
+COSTO_DESTINO = 100
+
+def costo_predicado(pred, anclas=()):
+    clase = pred.tipo
+    if clase == "cmp" and pred.op == "<>":
+        clase = "distinto"
+    elif clase != "label" and pred.nodo == "n" and anclas and all((label, pred.prop) in INDEXADAS for label in anclas):
+        clase = "indice_" + clase
+    return COSTOS[clase] + (COSTO_DESTINO if pred.nodo == "m" else 0)
+
+## forma del predicado (lo que determina el texto Cypher) y sus valores, en el orden de sus parametros
+def forma_predicado(pred):
+    if pred.tipo == "cmp":
+        return ("cmp", pred.nodo, pred.prop, pred.op), [pred.valor]
+    if pred.tipo == "in":
+        return ("in", pred.nodo, pred.prop), [pred.valores]
+    if pred.tipo == "rango":
+        cotas = [v for v in (pred.min, pred.max) if v is not None]
+        return ("rango", pred.nodo, pred.prop, pred.min is not None, pred.max is not None), cotas
+    return ("label", pred.nodo, tuple(pred.labels)), []
+
+def _cypher_predicado(forma, nombres):
+    tipo, nodo = forma[:2]
+    if tipo == "label":
+        return "(" + " OR ".join(f"{nodo}:{label_valida(label)}" for label in forma[2]) + ")"
+    prop = f"{nodo}.{clave_valida(forma[2])}"
+    if tipo == "cmp":
+        return f"{prop} {OPERADORES[forma[3]]} ${next(nombres)}"
+    if tipo == "in":
+        return f"{prop} IN ${next(nombres)}"
+    cotas = []
+    if forma[3]:
+        cotas.append(f"{prop} >= ${next(nombres)}")
+    if forma[4]:
+        cotas.append(f"{prop} <= ${next(nombres)}")
+    return " AND ".join(cotas)
+
+def _where(condiciones):
+    return " WHERE " + " AND ".join(condiciones) if condiciones else ""
+
 class GraphDB:
     ## BASIC
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri, user, password, max_connection_pool_size=100,
+                 connection_acquisition_timeout=60.0, max_connection_lifetime=3600.0,
+                 similar_rels=("VIO",), similar_k=SIMILAR_K, cache=None):
+        self.driver = self._driver(
+            uri, auth=(user, password),
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+            max_connection_lifetime=max_connection_lifetime,
+        )
+        if not similar_rels or not set(similar_rels) <= {"VIO", "CALIFICO"}:
+            raise ValueError("similar_rels debe ser un subconjunto de VIO, CALIFICO")
+        self.similar_rels = "|".join(similar_rels)
+        self.similar_k = similar_k
+        self.cache = cache
+
+    _driver = staticmethod(GraphDatabase.driver)
         
     def close(self):
         self.driver.close()
-    
+
+    ## consulta materializada; params son los parametros Cypher y props una proyeccion
+    ## opcional de propiedades (ver shaping.shape_record). name es el nombre de la consulta
+    ## en /metrics; por defecto el metodo que la lanzo (ver metrics.query_name)
+    def fetch(self, query, params=None, props=None, name=None):
+        return self._fetch(query, params, props, name or query_name())
+
+    ## igual que fetch pero itera los registros a medida que llegan del driver
+    def fetch_iter(self, query, params=None, props=None, name=None):
+        return self._fetch_iter(query, params, props, name or query_name())
+
+    def _fetch(self, query, params, props, name):
+        with QueryTimer(name, query) as timer:
+            with self.driver.session() as session:
+                rslt = session.run(timer.query, params)
+                keys = rslt.keys()
+                rows = [shape_record(record, props, keys) for record in rslt]
+                timer.done(len(rows), rslt.consume())
+        return rows
+
+    def _fetch_iter(self, query, params, props, name):
+        with QueryTimer(name, query) as timer:
+            with self.driver.session() as session:
+                rslt = session.run(timer.query, params)
+                keys = rslt.keys()
+                count = 0
+                for record in rslt:
+                    count += 1
+                    yield shape_record(record, props, keys)
+                timer.done(count, rslt.consume())
+
     def _execute_query(self, query, **kwargs):
+        return self.fetch(query, kwargs)
+
+    ## escritura en una transaccion administrada (execute_write): el driver la reintenta
+    ## completa ante errores transitorios (p.ej. bloqueos mutuos entre escrituras concurrentes)
+    def _execute_write(self, query, **params):
+        return self._write(query, params, query_name())
+
+    def _write(self, query, params, name):
+        with QueryTimer(name, query) as timer:
+            def work(tx):
+                rslt = tx.run(timer.query, params)
+                keys = rslt.keys()
+                return [shape_record(record, None, keys) for record in rslt], rslt.consume()
+
+            with self.driver.session() as session:
+                rows, summary = session.execute_write(work)
+            timer.done(len(rows), summary)
+        return rows
+
+    ## Los helpers siguientes toman el nombre de la consulta al llamarse (como fetch): en
+    ## AsyncGraphDB la implementacion corre al esperar la corrutina, ya fuera del metodo que la lanzo
+
+    ## plan de EXPLAIN (la consulta no se ejecuta)
+    def _explain(self, query, params, name=None):
+        return self._plan(query, params, name or query_name())
+
+    def _plan(self, query, params, name):
+        with QueryTimer(name, "EXPLAIN " + query) as timer:
+            with self.driver.session() as session:
+                summary = session.run(timer.query, params).consume()
+            timer.done(0, summary)
+        return summary.plan
+
+    ## ejecuta varias consultas en orden (p.ej. sentencias de esquema)
+    def _execute_many(self, queries, name=None):
+        return self._many(queries, name or query_name())
+
+    def _many(self, queries, name):
+        with self.driver.session() as session:
+            for query in queries:
+                with QueryTimer(name, query) as timer:
+                    timer.done(0, session.run(timer.query).consume())
+
+    ## aplica fn al resultado; en AsyncGraphDB se aplica despues del await
+    def _then(self, result, fn):
+        return fn(result)
+
+    ## resultado ya calculado (sin consulta), esperable en AsyncGraphDB
+    def _result(self, value):
+        return value
+    ## CACHE
+    ## lecturas cacheadas con etiquetas (ver cache.node_tags); sin cache se ejecuta directo
+    def _cached_query(self, tags, query, **kwargs):
+        if self.cache is None:
+            return self._execute_query(query, **kwargs)
+        key = query + "|" + repr(sorted(kwargs.items()))
+        hit, value = self.cache.get(key)
+        if hit:
+            return self._result(value)
+        return self._then(self._execute_query(query, **kwargs), lambda rows: self._store(key, rows, tags))
+
+    def _store(self, key, rows, tags):
+        self.cache.set(key, rows, tags)
+        return rows
+
+    ## targets: (label, id | lista de ids | () solo la label | None todos los ids)
+    def _invalidate(self, *targets):
+        if self.cache is not None:
+            tags = []
+            for label, ids in targets:
+                tags += node_tags(label, ids)
+            self.cache.invalidate(tags)
+
+    ## invalida despues de que la escritura termina
+    def _invalidating(self, result, *targets):
+        if self.cache is None:
+            return result
+        def done(rows):
+            self._invalidate(*targets)
+            return rows
+        return self._then(result, done)
+
+    ## escribe una lista de filas en una sola transaccion (UNWIND $rows)
+    def _execute_batch(self, query, rows, session=None, name=None):
+        return self._batch(query, rows, session, name or query_name())
+
+    def _batch(self, query, rows, session, name):
+        if session is None:
+            with self.driver.session() as session:
+                return self._batch(query, rows, session, name)
+        with QueryTimer(name, query) as timer:
+            summary = session.execute_write(lambda tx: tx.run(timer.query, rows=rows).consume())
+            timer.done(0, summary)
+        return summary
+
+    ## escribe lotes independientes en una sesion; un lote que falla no detiene a los demas.
+    ## devuelve por lote None (escrito) o el mensaje de error
+    def _execute_chunks(self, query, chunks, name=None):
+        return self._chunks(query, chunks, name or query_name())
+
+    def _chunks(self, query, chunks, name):
+        errors = []
         with self.driver.session() as session:
-            rslt = session.run(query, **kwargs)
-            records = [dict(record) for record in rslt]
-            formatted_results = [
-                {key: dict(value) if hasattr(value, "__dict__") or isinstance(value, dict) else value for key, value in record.items()}
-                for record in records
-            ]
-            return formatted_results
+            for rows in chunks:
+                try:
+                    self._batch(query, rows, session, name)
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(str(e))
+        return errors
+
+    ## carriles en paralelo: cada carril es una lista de lotes que se escriben en orden en su
+    ## propia sesion. Devuelve por carril y lote la primera columna del resultado o la excepcion
+    def _execute_lanes(self, query, lanes, name=None):
+        return self._lanes(query, lanes, name or query_name())
+
+    def _lanes(self, query, lanes, name):
+        def work(tx, query, rows):
+            rslt = tx.run(query, rows=rows)
+            return [r[0] for r in rslt], rslt.consume()
+
+        def run(batches):
+            out = []
+            with self.driver.session() as session:
+                for rows in batches:
+                    try:
+                        with QueryTimer(name, query) as timer:
+                            values, summary = session.execute_write(work, timer.query, rows)
+                            timer.done(len(values), summary)
+                        out.append(values)
+                    except Exception as e:
+                        out.append(e)
+            return out
+
+        with ThreadPoolExecutor(max_workers=max(1, len(lanes))) as pool:
+            return list(pool.map(run, lanes))
+
+    ## BULK
+    ## MERGE por id de filas ya validadas, en transacciones de batch_size filas
+    def bulk_merge_nodes(self, label, rows, batch_size=1000):
+        chunks = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        return self._invalidating(self._execute_chunks(self.merge_nodes_query(label), chunks), (label, None))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def merge_nodes_query(label):
+        return f"UNWIND $rows AS row MERGE (n:{label_valida(label)} {{id: row.id}}) SET n += row"
+
+    ## upsert de relaciones por identidad de extremos: MERGE (a)-[r]->(b) y SET de las
+    ## propiedades presentes en la fila (las ausentes conservan su valor). Devuelve row.i.
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def upsert_relations_query(rel):
+        from_label, to_label, props = RELACIONES[relacion_valida(rel)]
+        sets = ", ".join(
+            f"r.{key} = coalesce({conv}(row.{key}), r.{key})" if conv else f"r.{key} = coalesce(row.{key}, r.{key})"
+            for key, conv in props
+        )
+        query = f"""
+            UNWIND $rows AS row
+            MATCH (a:{from_label} {{id: row.from_id}}), (b:{to_label} {{id: row.to_id}})
+            MERGE (a)-[r:{rel}]->(b)\n"""
+        if rel not in AGREGADOS:
+            return query + f"            SET {sets}\n            RETURN row.i"
+        counts = [prop for prop, source in AGREGADOS[rel] if source is None]
+        averages = [(prop, source) for prop, source in AGREGADOS[rel] if source is not None]
+        if counts:
+            query += "            ON CREATE SET " + ", ".join(f"b.{p} = coalesce(b.{p}, 0) + 1" for p in counts) + "\n"
+        if averages:
+            # el valor previo sale de la suma antes de agregar el nuevo
+            query += "            WITH *, " + ", ".join(f"toFloat(r.{src}) AS previo_{src}" for _, src in averages) + "\n"
+        query += f"            SET {sets}\n"
+        if averages:
+            query += "            SET " + ", ".join(
+                f"b.{p}_suma = coalesce(b.{p}_suma, 0.0) - coalesce(previo_{src}, 0.0) + coalesce(toFloat(r.{src}), 0.0), "
+                f"b.{p}_n = coalesce(b.{p}_n, 0) - CASE WHEN previo_{src} IS NULL THEN 0 ELSE 1 END "
+                f"+ CASE WHEN toFloat(r.{src}) IS NULL THEN 0 ELSE 1 END"
+                for p, src in averages
+            ) + "\n" + GraphDB._aggregate_averages(rel)
+        return query + "            RETURN row.i"
+
+    ## reparte las filas en carriles por nodo (un nodo siempre en el mismo carril, asi dos
+    ## transacciones concurrentes no compiten por sus locks) y en lotes ordenados por id
+    @staticmethod
+    def _partition(rows, key, workers, batch_size):
+        lanes = [[] for _ in range(workers)]
+        for row in rows:
+            lanes[hash(row[key]) % workers].append(row)
+        batches = []
+        for lane in lanes:
+            lane.sort(key=lambda r: (r["from_id"], r["to_id"]))
+            batches.append([lane[i:i + batch_size] for i in range(0, len(lane), batch_size)])
+        return [b for b in batches if b]
+
+    ## filas {i, from_id, to_id, props...}; devuelve {"written": [i...], "errors": {i: mensaje}}.
+    ## Se particiona por nodo origen; si la relacion mantiene agregados en el destino, por destino
+    def bulk_merge_relations(self, rel, rows, batch_size=1000, workers=4):
+        from_label, to_label, _ = RELACIONES[rel]
+        key = "to_id" if rel in AGREGADOS else "from_id"
+        lanes = self._partition(rows, key, workers, batch_size)
+
+        def collect(results):
+            written, errors = set(), {}
+            for lane, outcomes in zip(lanes, results):
+                for batch, outcome in zip(lane, outcomes):
+                    if isinstance(outcome, Exception):
+                        errors.update((row["i"], str(outcome)) for row in batch)
+                    else:
+                        written.update(outcome)
+            return {"written": sorted(written), "errors": errors}
+
+        result = self._then(self._execute_lanes(self.upsert_relations_query(rel), lanes), collect)
+        return self._invalidating(result, (from_label, None), (to_label, None))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def merge_relations_query(rel):
+        from_label, to_label, props = RELACIONES[relacion_valida(rel)]
+        props_str = ", ".join(
+            f"{key}: {conv}(row.{key})" if conv else f"{key}: row.{key}" for key, conv in props
+        )
+        query = f"""
+            UNWIND $rows AS row
+            MATCH (a:{from_label} {{id: row.from_id}}), (b:{to_label} {{id: row.to_id}})
+            MERGE (a)-[r:{rel} {{ {props_str} }}]->(b)
+        """
+        if rel in AGREGADOS:
+            query += GraphDB._aggregate_on_create(rel) + GraphDB._aggregate_averages(rel)
+        return query
+
+    ## AGREGADOS
+    ## suma incremental al crear la arista r hacia b (ON CREATE SET del MERGE); cada
+    ## asignacion solo lee su propia propiedad, no depende del orden de evaluacion del SET.
+    ## Los valores promediados pasan por toFloat como en los c_rel_* (un "8.5" suma 8.5)
+    @staticmethod
+    def _aggregate_on_create(rel, r="r", b="b"):
+        sets = []
+        for prop, source in AGREGADOS[rel]:
+            if source is None:
+                sets.append(f"{b}.{prop} = coalesce({b}.{prop}, 0) + 1")
+            else:
+                sets.append(f"{b}.{prop}_suma = coalesce({b}.{prop}_suma, 0.0) + coalesce(toFloat({r}.{source}), 0.0)")
+                sets.append(f"{b}.{prop}_n = coalesce({b}.{prop}_n, 0) + CASE WHEN toFloat({r}.{source}) IS NULL THEN 0 ELSE 1 END")
+        return "\n            ON CREATE SET " + ", ".join(sets) + "\n"
+
+    ## promedios a partir de suma / n, despues del MERGE
+    @staticmethod
+    def _aggregate_averages(rel, b="b"):
+        sets = [
+            f"{b}.{prop} = CASE WHEN {b}.{prop}_n > 0 THEN {b}.{prop}_suma / {b}.{prop}_n END"
+            for prop, source in AGREGADOS[rel] if source is not None
+        ]
+        return "            SET " + ", ".join(sets) + "\n" if sets else ""
+
+    ## recalculo exacto desde las aristas entrantes de b (borrados y ediciones de propiedades);
+    ## costo acotado por el grado de b. Subconsulta sin RETURN: no cambia las filas
+    @staticmethod
+    def _aggregate_refresh_call(var="b", rels=tuple(AGREGADOS)):
+        parts = []
+        for rel in rels:
+            returns, sets = [], []
+            for prop, source in AGREGADOS[rel]:
+                if source is None:
+                    returns.append(f"count(x) AS {prop}")
+                    sets.append(f"{var}.{prop} = {prop}")
+                else:
+                    returns.append(f"sum(toFloat(x.{source})) AS {prop}_suma, count(toFloat(x.{source})) AS {prop}_n")
+                    sets.append(f"{var}.{prop}_suma = {prop}_suma, {var}.{prop}_n = {prop}_n, "
+                                f"{var}.{prop} = CASE WHEN {prop}_n > 0 THEN {prop}_suma / {prop}_n END")
+            parts.append(f"""
+                CALL {{ WITH {var} MATCH ({var})<-[x:{rel}]-() RETURN {", ".join(returns)} }}
+                SET {", ".join(sets)}""")
+        return f"""
+            CALL {{
+                WITH {var}{"".join(parts)}
+            }}
+            """
+
+    ## recalcula los agregados de todas las peliculas y series (datos cargados antes de mantenerlos)
+    def rebuild_aggregates(self, batch_size=500):
+        query = f"""
+            MATCH (b) WHERE {" OR ".join(f"b:{label}" for label in AGREGADOS_LABELS)}
+            CALL {{
+                WITH b
+                {self._aggregate_refresh_call("b")}
+            }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+            RETURN count(b) AS nodos
+        """
+        return self._invalidating(self._execute_query(query), *((label, ()) for label in AGREGADOS_LABELS))
+
+    ## SCHEMA
+    ## crea (si no existen) constraints de unicidad sobre id e indices de rango
+    def ensure_schema(self):
+        statements = []
+        for label in MODELOS:
+            statements.append(
+                f"CREATE CONSTRAINT {label.lower()}_id IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.id IS UNIQUE"
+            )
+        for label, prop in INDICES:
+            statements.append(
+                f"CREATE INDEX {label.lower()}_{prop} IF NOT EXISTS "
+                f"FOR (n:{label}) ON (n.{prop})"
+            )
+        return self._then(self._execute_many(statements), lambda _: statements)
+
+    ## reporte de indices esperados vs existentes y su estado
+    def schema_report(self):
+        query = """
+            SHOW INDEXES
+            YIELD name, type, labelsOrTypes, properties, state, populationPercent, owningConstraint
+            RETURN name, type, labelsOrTypes, properties, state, populationPercent, owningConstraint
+        """
+        return self._then(self._execute_query(query), self._schema_report)
+
+    @staticmethod
+    def _schema_report(indexes):
+        expected = [(label, "id") for label in MODELOS] + INDICES
+        report = []
+        for label, prop in expected:
+            found = next(
+                (i for i in indexes if i["labelsOrTypes"] == [label] and i["properties"] == [prop]),
+                None,
+            )
+            report.append({
+                "label": label,
+                "property": prop,
+                "index": found["name"] if found else None,
+                "unique": bool(found and found["owningConstraint"]),
+                "state": found["state"] if found else "MISSING",
+                "online": bool(found and found["state"] == "ONLINE"),
+            })
+        return {"expected": report, "indexes": indexes}
+
     ## READ
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def read_1_node_query(label):
+        return f"MATCH (n:{label_valida(label)} {{id: $id}}) RETURN n LIMIT 1"
+
     def read_1_node(self, label, id):
-        query = "MATCH (n:"+label+" {id: $id}) RETURN n LIMIT 1"
-        return self._execute_query(query, id=id)
-    
+        return self._cached_query(node_tags(label, id), self.read_1_node_query(label), id=id)
+
+    ## from_or_to: True = relaciones que salen del nodo, False = las que llegan
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def count_relations_query(rel, label, from_or_to):
+        arrow = f"-[r:{relacion_valida(rel)}]->" if from_or_to else f"<-[r:{relacion_valida(rel)}]-"
+        return f"MATCH (u:{label_valida(label)} {{id: $id}}){arrow}() RETURN count(r) as rel_counted"
+
     def count_relations(self, rel, id, label, from_or_to):
-        id_str = "{id: $id}"
-        query = ""
-        if from_or_to: # True = Van de nuestro nodo a cualquier otro
-            query = f"MATCH (u:{label} {id_str})-[r:{rel}]->() RETURN count(r) as rel_counted"
-        else: # False = Llegan a nuestro nodo desde cualquier otro
-            query = f"MATCH (u:{label} {id_str})<-[r:{rel}]-() RETURN count(r) as rel_counted"
-        return self._execute_query(query, id=id)
+        return self._execute_query(self.count_relations_query(rel, label, bool(from_or_to)), id=id)
     
     ## CREATE
+    ## MERGE por id (unico, ver ensure_schema) y SET del resto, como merge_nodes_query:
+    ## repetir un id actualiza el nodo en lugar de violar el constraint
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def create_1_node_query(label):
+        return f"MERGE (n:{label_valida(label)} {{id: $id}}) SET n += $props"
+
     def create_1_node(self, node):
-        with self.driver.session() as session:
-            label = node.__class__.__name__
-            fields = list(node.model_fields.keys())
-            query = "MERGE(:"+label+" {"
-            for index, field in enumerate(fields):
-                query+= field+": $"+field
-                if (index !=len(fields)-1):
-                    query+=", " 
-            query+= "})"
-            params = node.model_dump()
-            session.run(query, params)
+        label = node.__class__.__name__
+        query = self.create_1_node_query(label)
+        return self._invalidating(self._execute_query(query, id=node.id, props=node.model_dump()), (label, node.id))
 
         
+    def _rel_targets(self, rel, from_n, to_n):
+        from_label, to_label, _ = RELACIONES[rel]
+        return (from_label, int(from_n)), (to_label, int(to_n))
+
     ## REL / VIO
     def c_rel_vio(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Usuario)-[:VIO]->(:Pelicula) 
-            session.run("""
-                MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
-                MERGE (a)-[:VIO {
-                    fecha: date($fecha), 
-                    dispositivo: $dispositivo, 
-                    rating: toFloat($rating)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                fecha=props[2], dispositivo=props[3], rating=props[4]
-            )
+        # (:Usuario)-[:VIO]->(:Pelicula) 
+        return self._invalidating(self._similar_write("VIO", """
+            MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
+            MERGE (a)-[r:VIO {
+                fecha: date($fecha), 
+                dispositivo: $dispositivo, 
+                rating: toFloat($rating)
+            }]->(b)""" + self._aggregate_on_create("VIO") + self._aggregate_averages("VIO"), "RETURN a.id AS id",
+            from_n=int(from_n), to_n =int(to_n), 
+            fecha=props[2], dispositivo=props[3], rating=props[4],
+            k=self.similar_k
+        ), *self._rel_targets("VIO", from_n, to_n))
             
     ## REL / CALIFICO
     def c_rel_cal(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Usuario)-[:CALIFICO]->(:Pelicula)
-            session.run("""
-                MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
-                MERGE (a)-[:CALIFICO {
-                    fecha: date($fecha), 
-                    calificacion: toFloat($calificacion), 
-                    comentario: $comentario
-                }]->(b)""",
-                from_n=int(from_n), to_n =int(to_n), 
-                fecha=props[2], calificacion=props[3], comentario=props[4]
-            )
+        # (:Usuario)-[:CALIFICO]->(:Pelicula)
+        return self._invalidating(self._similar_write("CALIFICO", """
+            MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
+            MERGE (a)-[r:CALIFICO {
+                fecha: date($fecha), 
+                calificacion: toFloat($calificacion), 
+                comentario: $comentario
+            }]->(b)""" + self._aggregate_on_create("CALIFICO") + self._aggregate_averages("CALIFICO"), "RETURN a.id AS id",
+            from_n=int(from_n), to_n =int(to_n), 
+            fecha=props[2], calificacion=props[3], comentario=props[4],
+            k=self.similar_k
+        ), *self._rel_targets("CALIFICO", from_n, to_n))
             
     ## REL / RECOMENDO
     def c_rel_rec(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Usuario)-[:RECOMENDO]->(:Pelicula) 
-            session.run("""
-                MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
-                MERGE (a)-[:RECOMENDO {
-                    fecha: date($fecha), 
-                    razon: $razon, 
-                    confianza: toFloat($confianza)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                fecha=props[2], razon=props[3], confianza=props[4]
-            )
+        # (:Usuario)-[:RECOMENDO]->(:Pelicula) 
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Usuario {id: $from_n}),(b:Pelicula {id: $to_n})
+            MERGE (a)-[r:RECOMENDO {
+                fecha: date($fecha), 
+                razon: $razon, 
+                confianza: toFloat($confianza)
+            }]->(b)""" + self._aggregate_on_create("RECOMENDO"), 
+            from_n=int(from_n), to_n =int(to_n), 
+            fecha=props[2], razon=props[3], confianza=props[4]
+        ), *self._rel_targets("RECOMENDO", from_n, to_n))
     ## REL / SIGUE
     def c_rel_sig(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Usuario)-[:SIGUE]->(:Director)  
-            session.run("""
-                MATCH (a:Usuario {id: $from_n}),(b:Director {id: $to_n})
-                MERGE (a)-[:SIGUE {
-                    fecha_inicio: date($fecha_inicio), 
-                    nivel_interes: toInteger($nivel_interes), 
-                    notificaciones: toBoolean($notificaciones)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                fecha_inicio=props[2],  nivel_interes=props[3], notificaciones=props[4]
-                )
+        # (:Usuario)-[:SIGUE]->(:Director)  
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Usuario {id: $from_n}),(b:Director {id: $to_n})
+            MERGE (a)-[:SIGUE {
+                fecha_inicio: date($fecha_inicio), 
+                nivel_interes: toInteger($nivel_interes), 
+                notificaciones: toBoolean($notificaciones)
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            fecha_inicio=props[2],  nivel_interes=props[3], notificaciones=props[4]
+        ), *self._rel_targets("SIGUE", from_n, to_n))
     ## REL / ADMIRA
     def c_rel_adm(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Usuario)-[:ADMIRA]->(:Actor)
-            session.run("""
-                MATCH (a:Usuario {id: $from_n}),(b:Actor {id: $to_n})
-                MERGE (a)-[:ADMIRA {
-                    fecha_inicio: date($fecha_inicio), 
-                    nivel_admiracion: toInteger($nivel_admiracion), 
-                    razon: $razon
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                fecha_inicio=props[2],  nivel_admiracion=props[3], razon=props[4]
-            )
+        # (:Usuario)-[:ADMIRA]->(:Actor)
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Usuario {id: $from_n}),(b:Actor {id: $to_n})
+            MERGE (a)-[:ADMIRA {
+                fecha_inicio: date($fecha_inicio), 
+                nivel_admiracion: toInteger($nivel_admiracion), 
+                razon: $razon
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            fecha_inicio=props[2],  nivel_admiracion=props[3], razon=props[4]
+        ), *self._rel_targets("ADMIRA", from_n, to_n))
             
     ## REL / PERTENECE_A
     def c_rel_per(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Pelicula)-[:PERTENECE_A]->(:Genero)
-            session.run("""
-                MATCH (a:Pelicula {id: $from_n}),(b:Genero {id: $to_n})
-                MERGE (a)-[:PERTENECE_A {
-                    peso: toFloat($peso), 
-                    relevancia: $relevancia, 
-                    fecha_asignacion: date($fecha_asignacion)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                peso=props[2],  relevancia=props[3], fecha_asignacion=props[4]
-            ) 
+        # (:Pelicula)-[:PERTENECE_A]->(:Genero)
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Pelicula {id: $from_n}),(b:Genero {id: $to_n})
+            MERGE (a)-[:PERTENECE_A {
+                peso: toFloat($peso), 
+                relevancia: $relevancia, 
+                fecha_asignacion: date($fecha_asignacion)
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            peso=props[2],  relevancia=props[3], fecha_asignacion=props[4]
+        ), *self._rel_targets("PERTENECE_A", from_n, to_n))
     
     ## REL / TIENE_TEMATICA
     def c_rel_tem(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Serie)-[:TIENE_TEMATICA]->(:Genero) 
-            session.run("""
-                MATCH (a:Serie {id: $from_n}),(b:Genero {id: $to_n})
-                MERGE (a)-[:TIENE_TEMATICA {
-                    popularidad: toInteger($popularidad), 
-                    tendencia: toBoolean($tendencia), 
-                    impacto_cultural: $impacto_cultural
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                popularidad=props[2],  tendencia=props[3], impacto_cultural=props[4]
-            )
+        # (:Serie)-[:TIENE_TEMATICA]->(:Genero) 
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Serie {id: $from_n}),(b:Genero {id: $to_n})
+            MERGE (a)-[:TIENE_TEMATICA {
+                popularidad: toInteger($popularidad), 
+                tendencia: toBoolean($tendencia), 
+                impacto_cultural: $impacto_cultural
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            popularidad=props[2],  tendencia=props[3], impacto_cultural=props[4]
+        ), *self._rel_targets("TIENE_TEMATICA", from_n, to_n))
             
     ## REL / DIRIGIDA_POR
     def c_rel_dir(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Pelicula)-[:DIRIGIDA_POR]->(:Director)
-            session.run("""
-                MATCH (a:Pelicula {id: $from_n}),(b:Director {id: $to_n})
-                MERGE (a)-[:DIRIGIDA_POR {
-                    tipo: $tipo, 
-                    experiencia: toInteger($experiencia), 
-                    premios_ganados: toInteger($premios_ganados)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                tipo=props[2],  experiencia=props[3], premios_ganados=props[4]
-            )
+        # (:Pelicula)-[:DIRIGIDA_POR]->(:Director)
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Pelicula {id: $from_n}),(b:Director {id: $to_n})
+            MERGE (a)-[:DIRIGIDA_POR {
+                tipo: $tipo, 
+                experiencia: toInteger($experiencia), 
+                premios_ganados: toInteger($premios_ganados)
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            tipo=props[2],  experiencia=props[3], premios_ganados=props[4]
+        ), *self._rel_targets("DIRIGIDA_POR", from_n, to_n))
     ## REL / PRODUCIDA_POR
     def c_rel_pro(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Serie)-[:PRODUCIDA_POR]->(:Director) 
-            session.run("""
-                MATCH (a:Serie {id: $from_n}),(b:Director {id: $to_n})
-                MERGE (a)-[:PRODUCIDA_POR {
-                    tipo: $tipo, 
-                    productora: $productora, 
-                    años_experiencia: toInteger($años_experiencia)
-                }]->(b)""",
+        # (:Serie)-[:PRODUCIDA_POR]->(:Director) 
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Serie {id: $from_n}),(b:Director {id: $to_n})
+            MERGE (a)-[:PRODUCIDA_POR {
+                tipo: $tipo, 
+                productora: $productora, 
+                años_experiencia: toInteger($años_experiencia)
+            }]->(b)""",
             from_n=int(from_n), to_n =int(to_n), 
             tipo=props[2],  productora=props[3], años_experiencia=props[4]
-            )
+        ), *self._rel_targets("PRODUCIDA_POR", from_n, to_n))
             
     ## REL / PARTICIPO_EN
-    def c_rel_pro(self, from_n, to_n, props):
-        with self.driver.session() as session:
-            # (:Actor)-[:PARTICIPO_EN]->(:Pelicula) 
-            session.run("""
-                MATCH (a:Actor {id: $from_n}),(b:Pelicula {id: $to_n})
-                MERGE (a)-[:PARTICIPO_EN {
-                    rol: $rol, 
-                    apariciones: toInteger($apariciones), 
-                    premios_obtenidos: toInteger($premios_obtenidos)
-                }]->(b)""", 
-                from_n=int(from_n), to_n =int(to_n), 
-                rol=props[2],  apariciones=props[3], premios_obtenidos=props[4]
-            )
+    def c_rel_par(self, from_n, to_n, props):
+        # (:Actor)-[:PARTICIPO_EN]->(:Pelicula) 
+        return self._invalidating(self._execute_query("""
+            MATCH (a:Actor {id: $from_n}),(b:Pelicula {id: $to_n})
+            MERGE (a)-[:PARTICIPO_EN {
+                rol: $rol, 
+                apariciones: toInteger($apariciones), 
+                premios_obtenidos: toInteger($premios_obtenidos)
+            }]->(b)""", 
+            from_n=int(from_n), to_n =int(to_n), 
+            rol=props[2],  apariciones=props[3], premios_obtenidos=props[4]
+        ), *self._rel_targets("PARTICIPO_EN", from_n, to_n))
+
+    ## crea nodo con 1 o mas labels
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def create_node_query(labels):
+        return f"CREATE (n:{':'.join(label_valida(l) for l in labels)}) SET n += $props RETURN n.id AS node_id"
 
     ## crea nodo con 1 label
     def create_node_with_label(self, label: str):
-        query = f"CREATE (n:{label}) RETURN n.id AS node_id"
-        return self._execute_query(query)
+        return self._invalidating(self._execute_query(self.create_node_query((label,)), props={}), (label, ()))
 
     ## crea nodo con 2+ labels
     def create_node_with_multiple_labels(self, labels: list):
-        labels_str = ":".join(labels)
-        query = f"CREATE (n:{labels_str}) RETURN n.id AS node_id"
-        return self._execute_query(query)
+        query = self.create_node_query(tuple(labels))
+        return self._invalidating(self._execute_query(query, props={}), *[(l, ()) for l in labels])
 
     ## crea nodo con propiedades
     def create_node_with_properties(self, label: str, properties: dict):
-        props_str = ", ".join([f"n.{key} = ${key}" for key in properties.keys()])
-        query = f"CREATE (n:{label}) SET {props_str} RETURN n.id AS node_id"
-        return self._execute_query(query, **properties)
+        query = self.create_node_query((label,))
+        return self._invalidating(self._execute_query(query, props=properties), (label, properties.get("id", ())))
+
+    ## SET n += $props sobre uno (node_id) o varios nodos (node_ids); un valor null borra la propiedad
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def set_node_props_query(label, varios):
+        return _match_nodo(label, varios) + " SET n += $props RETURN n"
+
+    def _set_node_props(self, label, node_id, properties):
+        if isinstance(node_id, list):
+            query = self.set_node_props_query(label, True)
+            result = self._execute_query(query, node_ids=node_id, props=properties)
+        else:
+            query = self.set_node_props_query(label, False)
+            result = self._execute_query(query, node_id=node_id, props=properties)
+        return self._invalidating(result, (label, node_id))
 
     ## agrega propiedades a un nodo
     def add_properties_to_node(self, label: str, node_id: int, properties: dict):
-        props_str = ", ".join([f"n.{key} = ${key}" for key in properties.keys()])
-        query = f"MATCH (n:{label}) WHERE n.id = $node_id SET {props_str} RETURN n"
-        return self._execute_query(query, node_id=node_id, **properties)
+        return self._set_node_props(label, node_id, properties)
 
     ## agrega propiedades a varios nodos
     def add_properties_to_multiple_nodes(self, label: str, node_ids: list, properties: dict):
-        props_str = ", ".join([f"n.{key} = ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (n:{label}) 
-            WHERE n.id IN $node_ids 
-            SET {props_str} 
-            RETURN n
-        """
-        return self._execute_query(query, node_ids=node_ids, **properties)
+        return self._set_node_props(label, list(node_ids), properties)
 
     ## actualiza propiedades en un nodo
     def update_node_properties(self, label: str, node_id: int, properties: dict):
-        props_str = ", ".join([f"n.{key} = ${key}" for key in properties.keys()])
-        query = f"MATCH (n:{label}) WHERE n.id = $node_id SET {props_str} RETURN n"
-        return self._execute_query(query, node_id=node_id, **properties)
+        return self._set_node_props(label, node_id, properties)
 
     ## actualizar propiedades en varios nodos
     def update_properties_multiple_nodes(self, label: str, node_ids: list, properties: dict):
-        props_str = ", ".join([f"n.{key} = ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (n:{label}) 
-            WHERE n.id IN $node_ids 
-            SET {props_str} 
-            RETURN n
-        """
-        return self._execute_query(query, node_ids=node_ids, **properties)
+        return self._set_node_props(label, list(node_ids), properties)
 
     ## elimina propiedades de un nodo
     def delete_node_properties(self, label: str, node_id: int, properties: list):
-        props_str = ", ".join([f"n.{prop} = NULL" for prop in properties])
-        query = f"MATCH (n:{label}) WHERE n.id = $node_id SET {props_str} RETURN n"
-        return self._execute_query(query, node_id=node_id)
+        return self._set_node_props(label, node_id, dict.fromkeys(properties))
 
     ## eliminar propiedades de varios nodos
     def delete_properties_multiple_nodes(self, label: str, node_ids: list, properties: list):
-        props_str = ", ".join([f"n.{prop} = NULL" for prop in properties])
+        return self._set_node_props(label, list(node_ids), dict.fromkeys(properties))
+    # -------------- Manejo de relaciones --------------------------------------------
+    ## MERGE con las propiedades como parte de la identidad de la arista; las claves se
+    ## validan y los valores van en $props. Las propiedades numericas y booleanas de RELACIONES
+    ## se convierten como en los c_rel_* (toFloat, toInteger, toBoolean)
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def create_relation_query(from_label, to_label, relation_type, keys):
+        convs = {k: c for k, c in RELACIONES[relacion_valida(relation_type)][2] if c in CONVERSIONES_VALOR}
+        props_str = ", ".join(
+            f"{clave_valida(key)}: {convs[key]}($props.{key})" if key in convs else f"{clave_valida(key)}: $props.{key}"
+            for key in keys
+        )
         query = f"""
-            MATCH (n:{label}) 
-            WHERE n.id IN $node_ids 
-            SET {props_str} 
-            RETURN n
+            MATCH (a:{label_valida(from_label)} {{id: $from_id}}), (b:{label_valida(to_label)} {{id: $to_id}})
+            MERGE (a)-[r:{relacion_valida(relation_type)} {{ {props_str} }}]->(b)
         """
-        return self._execute_query(query, node_ids=node_ids)
-    # -------------- Manejo de relaciones --------------------------------------------
+        if relation_type in AGREGADOS:
+            query += GraphDB._aggregate_on_create(relation_type) + GraphDB._aggregate_averages(relation_type)
+        return query
+
     ## Crear relación con propiedades
     def create_relation(self, from_label, from_id, to_label, to_id, relation_type, properties):
-        props_str = ", ".join([f"{key}: ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (a:{from_label} {{id: $from_id}}), (b:{to_label} {{id: $to_id}})
-            MERGE (a)-[r:{relation_type} {{ {props_str} }}]->(b)
-            RETURN r
-        """
-        return self._execute_query(query, from_id=from_id, to_id=to_id, **properties)
-    
+        query = self.create_relation_query(from_label, to_label, relation_type, tuple(sorted(properties)))
+        if to_label == "Pelicula":
+            result = self._similar_write(relation_type, query, "RETURN r", from_id=from_id, to_id=to_id, k=self.similar_k, props=properties)
+        else:
+            result = self._execute_query(query + "RETURN r", from_id=from_id, to_id=to_id, props=properties)
+        return self._invalidating(result, (from_label, from_id), (to_label, to_id))
+
+    ## SET r += $props sobre una (from_id/to_id) o varias relaciones (from_ids/to_ids),
+    ## recalculando los agregados del destino; un valor null borra la propiedad
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def set_relation_props_query(from_label, relation_type, to_label, varios, id_interno=False):
+        query = _match_relacion(from_label, relation_type, to_label, varios, id_interno) + "\n            SET r += $props\n"
+        return query + GraphDB._aggregates_after(relation_type, "WITH r, b") + "RETURN r"
+
+    def _set_relation_props(self, from_label, from_id, to_label, to_id, relation_type, properties):
+        query = self.set_relation_props_query(from_label, relation_type, to_label, False)
+        result = self._execute_query(query, from_id=from_id, to_id=to_id, props=properties)
+        return self._invalidating(result, (from_label, from_id), (to_label, to_id))
+
+    def _set_relations_props(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
+        query = self.set_relation_props_query(from_label, relation_type, to_label, True)
+        result = self._execute_query(query, from_ids=from_ids, to_ids=to_ids, props=properties)
+        return self._invalidating(result, (from_label, from_ids), (to_label, to_ids))
+
     ## Agregar propiedades a una relación
     def add_properties_to_relation(self, from_label, from_id, to_label, to_id, relation_type, properties):
-        props_str = ", ".join([f"r.{key} = ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (a:{from_label} {{id: $from_id}})-[r:{relation_type}]->(b:{to_label} {{id: $to_id}})
-            SET {props_str}
-            RETURN r
-        """
-        return self._execute_query(query, from_id=from_id, to_id=to_id, **properties)
+        return self._set_relation_props(from_label, from_id, to_label, to_id, relation_type, properties)
 
-    ## Agregar multiples propiedades a una relación
+    ## Agregar multiples propiedades a una relación (from_ids/to_ids son ids internos de Neo4j)
     def add_properties_to_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
-        props_str = ", ".join([f"r.{key} = ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (a:{from_label})-[r:{relation_type}]->(b:{to_label})
-            WHERE id(a) IN $from_ids AND id(b) IN $to_ids
-            SET {props_str}
-            RETURN r
-        """
-        return self._execute_query(query, from_ids=from_ids, to_ids=to_ids, **properties)
+        query = self.set_relation_props_query(from_label, relation_type, to_label, True, True)
+        result = self._execute_query(query, from_ids=from_ids, to_ids=to_ids, props=properties)
+        return self._invalidating(result, (from_label, None), (to_label, None))
 
     ## Actualizar propiedades de una relación
     def update_relation_properties(self, from_label, from_id, to_label, to_id, relation_type, properties):
-        return self.add_properties_to_relation(from_label, from_id, to_label, to_id, relation_type, properties)
+        return self._set_relation_props(from_label, from_id, to_label, to_id, relation_type, properties)
 
     ## Actualizar propiedades de multiples relaciones
     def update_properties_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
-        props_str = ", ".join([f"r.{key} = ${key}" for key in properties.keys()])
-        query = f"""
-            MATCH (a:{from_label})-[r:{relation_type}]->(b:{to_label})
-            WHERE a.id IN $from_ids AND b.id IN $to_ids
-            SET {props_str}
-            RETURN r
-        """
-        return self._execute_query(query, from_ids=from_ids, to_ids=to_ids, **properties)
+        return self._set_relations_props(from_label, from_ids, to_label, to_ids, relation_type, properties)
 
     ## Eliminar propiedades de una relación
     def delete_relation_properties(self, from_label, from_id, to_label, to_id, relation_type, properties):
-        props_str = ", ".join([f"r.{prop} = NULL" for prop in properties])
-        query = f"""
-            MATCH (a:{from_label} {{id: $from_id}})-[r:{relation_type}]->(b:{to_label} {{id: $to_id}})
-            SET {props_str}
-            RETURN r
-        """
-        return self._execute_query(query, from_id=from_id, to_id=to_id)
+        return self._set_relation_props(from_label, from_id, to_label, to_id, relation_type, dict.fromkeys(properties))
 
     ## Eliminar múltiples propiedades de una relación
     def delete_properties_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type, properties):
-        props_str = ", ".join([f"r.{prop} = NULL" for prop in properties])
-        query = f"""
-            MATCH (a:{from_label})-[r:{relation_type}]->(b:{to_label})
-            WHERE a.id IN $from_ids AND b.id IN $to_ids
-            SET {props_str}
-            RETURN r
-        """
-        return self._execute_query(query, from_ids=from_ids, to_ids=to_ids)
+        return self._set_relations_props(from_label, from_ids, to_label, to_ids, relation_type, dict.fromkeys(properties))
 
     ##----------------------- Eliminar Nodos y Relaciones ---------------------------------------
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def delete_node_query(label, varios):
+        return _match_nodo(label, varios) + GraphDB._detach_delete_aggregated("n")
+
     ## Eliminar un nodo
     def delete_node(self, label, node_id):
-        query = f"MATCH (n:{label} {{id: $node_id}}) DETACH DELETE n"
-        return self._execute_query(query, node_id=node_id)
+        query = self.delete_node_query(label, False)
+        return self._invalidating(self._execute_query(query, node_id=node_id), (label, node_id))
     
     ## Eliminar varios nodos
     def delete_multiple_nodes(self, label, node_ids):
-        query = f"""
-            MATCH (n:{label})
-            WHERE n.id IN $node_ids
-            DETACH DELETE n
-        """
-        return self._execute_query(query, node_ids=node_ids)
+        query = self.delete_node_query(label, True)
+        return self._invalidating(self._execute_query(query, node_ids=node_ids), (label, node_ids))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def delete_relation_query(from_label, relation_type, to_label, varios):
+        query = _match_relacion(from_label, relation_type, to_label, varios) + "\n            DELETE r\n"
+        return query + GraphDB._aggregates_after(relation_type, "WITH DISTINCT b")
 
     ## Eliminar una relación
     def delete_relation(self, from_label, from_id, to_label, to_id, relation_type):
-        query = f"""
-            MATCH (a:{from_label} {{id: $from_id}})-[r:{relation_type}]->(b:{to_label} {{id: $to_id}})
-            DELETE r
-        """
-        return self._execute_query(query, from_id=from_id, to_id=to_id)
+        query = self.delete_relation_query(from_label, relation_type, to_label, False)
+        return self._invalidating(self._execute_query(query, from_id=from_id, to_id=to_id), (from_label, from_id), (to_label, to_id))
 
     ## Eliminar varias relaciones
     def delete_multiple_relations(self, from_label, from_ids, to_label, to_ids, relation_type):
-        query = f"""
-            MATCH (a:{from_label})-[r:{relation_type}]->(b:{to_label})
-            WHERE a.id IN $from_ids AND b.id IN $to_ids
-            DELETE r
-        """
-        return self._execute_query(query, from_ids=from_ids, to_ids=to_ids)
+        query = self.delete_relation_query(from_label, relation_type, to_label, True)
+        return self._invalidating(self._execute_query(query, from_ids=from_ids, to_ids=to_ids), (from_label, from_ids), (to_label, to_ids))
+
+    ## recalculo de agregados de b tras editar o borrar aristas de un tipo agregado
+    @staticmethod
+    def _aggregates_after(relation_type, with_clause):
+        if relation_type not in AGREGADOS:
+            return ""
+        return f"\n            {with_clause}" + GraphDB._aggregate_refresh_call("b", (relation_type,))
+
+    ## DETACH DELETE de var recalculando los nodos que pierden aristas agregadas
+    @staticmethod
+    def _detach_delete_aggregated(var):
+        return f"""
+            OPTIONAL MATCH ({var})-[:{"|".join(AGREGADOS)}]->(b)
+            WITH collect(DISTINCT {var}) AS borrados, collect(DISTINCT b) AS afectados
+            FOREACH (x IN borrados | DETACH DELETE x)
+            WITH afectados
+            UNWIND afectados AS b
+            """ + GraphDB._aggregate_refresh_call("b") + "RETURN count(b) AS recalculados"
 
     ##--------------get all nodes--------------------##
     def get_all_nodes(self):
@@ -425,83 +1052,387 @@ class GraphDB:
         return self._execute_query(query)
 
     def get_nodes_by_label(self, label: str):
-        query = f"MATCH (n:{label}) RETURN n"
+        query = f"MATCH (n:{label_valida(label)}) RETURN n"
         return self._execute_query(query)
 
-    def get_node_by_id(self, node_id: str):
-        query = """
-            MATCH (n) WHERE n.id = toInteger($node_id)
-            RETURN labels(n) AS labels, n.id AS id
-        """
-        result = self._execute_query(query, node_id=node_id)
+    ## paginacion por keyset sobre id (usa el indice de id de cada label)
+    def get_nodes_page(self, label: str, after=None, limit=1000, props=None):
+        query = f"MATCH (n:{label_valida(label)}) WHERE n.id > $after RETURN n ORDER BY n.id LIMIT $limit"
+        after = MIN_ID if after is None else int(after)
+        if props is not None and "id" not in props:
+            props = ["id", *props]  # el id es el cursor
+        return self.fetch(query, {"after": after, "limit": int(limit)}, props)
+
+    ## /nodes recorre las labels de MODELOS en orden; cursor = "Label:ultimo_id"
+    def get_all_nodes_page(self, cursor=None, limit=1000, props=None):
+        labels = list(MODELOS)
+        label, _, after = (cursor or labels[0] + ":").partition(":")
+        if label not in MODELOS:
+            raise ValueError(f"Cursor invalido: {cursor}")
+        after = int(after) if after else None
+
+        def page(rows):
+            if len(rows) == int(limit):
+                next_cursor = f"{label}:{rows[-1]['n']['id']}"
+            else:
+                index = labels.index(label)
+                next_cursor = labels[index + 1] + ":" if index + 1 < len(labels) else None
+            return {"nodes": rows, "next": next_cursor}
+
+        return self._then(self.get_nodes_page(label, after, limit, props), page)
 
+    def stream_nodes(self, label: str = None, props=None):
+        query = f"MATCH (n:{label_valida(label)}) RETURN n" if label else "MATCH (n) RETURN n"
+        return self.fetch_iter(query, props=props)
+
+    ## busqueda por id en todas las labels: una busqueda por indice por label (UNION ALL)
+    FIND_BY_ID_QUERY = "CALL {\n" + "\n    UNION ALL\n".join(
+        f"    MATCH (n:{label} {{id: $id}}) RETURN '{label}' AS label, n" for label in MODELOS
+    ) + "\n}\nRETURN label, n.id AS id, labels(n) AS labels"
+
+    def find_by_id(self, node_id):
+        return self._execute_query(self.FIND_BY_ID_QUERY, id=int(node_id))
+
+    @staticmethod
+    def _format_node_match(result):
         if result:
             record = result[0]  # Extract the first result
             return {
                 "id": record["id"],
-                "labels": record["labels"]
+                "labels": record["labels"],
+                "matches": [{"label": r["label"], "id": r["id"]} for r in result]
             }
 
         return {"error": "Node not found"}
+
+    def get_node_by_id(self, node_id: str):
+        try:
+            result = self.find_by_id(node_id)
+        except ValueError:
+            return self._result({"error": "Node not found"})
+        return self._then(result, self._format_node_match)
     
     def get_node_by_id_and_label(self, node_id: str, label: str):
         query = f"""
-            MATCH (n:{label}) WHERE n.id = toInteger($node_id)
-            RETURN labels(n) AS labels, n.id AS id
+            MATCH (n:{label_valida(label)}) WHERE n.id = toInteger($node_id)
+            RETURN $label AS label, labels(n) AS labels, n.id AS id
         """
-        result = self._execute_query(query, node_id=node_id)  # Pass as dictionary
+        result = self._execute_query(query, node_id=node_id, label=label)
+        return self._then(result, self._format_node_match)
 
-        if result:
-            record = result[0]  # Extract the first result
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def simple_match_query(f_label, t_label, rel):
+        return (f"MATCH (a:{label_valida(f_label)})-[r:{relacion_valida(rel)}]->(b:{label_valida(t_label)}) "
+                "RETURN a, r, b LIMIT $limit")
+
+    def simple_match(self, f_label, t_label, rel, limit):
+        return self._execute_query(self.simple_match_query(f_label, t_label, rel), limit=int(limit))
+
+    ## Texto de un Filtro compilado. Con labels de anclaje, n se busca primero por label (y por
+    ## indice si hay predicados sobre propiedades indexadas) y despues se expanden sus relaciones;
+    ## varias labels son una UNION de busquedas. Los parametros son $p0, $p1, ... en el orden
+    ## de n_formas y m_formas, y $limit.
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def filter_query(anclas, rels, n_formas, m_formas):
+        nombres = (f"p{i}" for i in itertools.count())
+        n_where = [_cypher_predicado(forma, nombres) for forma in n_formas]
+        m_where = [_cypher_predicado(forma, nombres) for forma in m_formas]
+        tipos = ":" + ("|".join(relacion_valida(rel) for rel in rels) if rels else TIPOS_DOMINIO)
+        expand = f"MATCH (n)-[r{tipos}]->(m)"
+        if not anclas:
+            query = expand + _where(n_where + m_where)
+        elif len(anclas) == 1:
+            query = f"MATCH (n:{label_valida(anclas[0])}){_where(n_where)} {expand}{_where(m_where)}"
+        else:
+            ramas = " UNION ".join(f"MATCH (n:{label_valida(label)}){_where(n_where)} RETURN n" for label in anclas)
+            query = f"CALL {{ {ramas} }} {expand}{_where(m_where)}"
+        return query + " RETURN n, labels(n) AS n_labels, r, m, labels(m) AS m_labels LIMIT $limit"
+
+    ## (consulta, parametros, predicados en orden de evaluacion con su costo)
+    def compile_filter(self, filtro):
+        anclas, preds = filtro.anclas()
+        orden = sorted(((costo_predicado(p, anclas), p) for p in preds), key=lambda cp: cp[0])
+        formas = {"n": [], "m": []}
+        valores = {"n": [], "m": []}
+        for _, pred in orden:
+            forma, vals = forma_predicado(pred)
+            formas[pred.nodo].append(forma)
+            valores[pred.nodo] += vals
+        query = self.filter_query(anclas, tuple(filtro.rels), tuple(formas["n"]), tuple(formas["m"]))
+        params = {f"p{i}": v for i, v in enumerate(valores["n"] + valores["m"])}
+        params["limit"] = filtro.limit
+        return query, params, orden
+
+    def filter_nodes(self, filtro):
+        query, params, _ = self.compile_filter(filtro)
+        return self._execute_query(query, **params)
+
+    ## formato anterior: labels, rels y condiciones "prop,op,valor"
+    def filter_match(self, labels, rels, cond,limit):
+        return self.filter_nodes(Filtro(labels=labels or [], rels=rels or [], cond=cond or [], limit=int(limit)))
+
+    ## dry-run: la consulta compilada, el orden de los predicados y el plan de EXPLAIN (sin ejecutarla)
+    def explain_filter(self, filtro):
+        query, params, orden = self.compile_filter(filtro)
+        def report(plan):
+            args = (plan or {}).get("args") or {}
             return {
-                "id": record["id"],
-                "labels": record["labels"]
+                "query": query,
+                "params": params,
+                "predicados": [{**pred.model_dump(), "costo": costo} for costo, pred in orden],
+                "estimated_rows": args.get("EstimatedRows"),
+                "plan": plan,
             }
+        return self._then(self._explain(query, params), report)
 
-        return {"error": "Node not found"}
+    ## LAYOUT
+    ## grafo completo como lista de adyacencia (solo label/id) para precalcular el layout
+    def layout_graph(self):
+        query = f"""
+            MATCH (n) WHERE n.id IS NOT NULL AND labels(n)[0] IN $labels
+            RETURN labels(n)[0] AS label, n.id AS id,
+                   [(n)-[:{TIPOS_DOMINIO}]->(m) WHERE m.id IS NOT NULL | [labels(m)[0], m.id]] AS out
+        """
+        return self._execute_query(query, labels=list(MODELOS))
 
+    ## guarda x/y en los nodos (filas {label, id, x, y}) en una transaccion; el WITH que importa
+    ## row a la subconsulta no admite WHERE, el filtro por label va en un segundo WITH
+    STORE_LAYOUT_QUERY = "UNWIND $rows AS row\nCALL {\n" + "\n    UNION ALL\n".join(
+        f"    WITH row WITH row WHERE row.label = '{label}' MATCH (n:{label} {{id: row.id}}) SET n.x = row.x, n.y = row.y RETURN n"
+        for label in MODELOS
+    ) + "\n}\nRETURN count(n) AS nodos"
 
-    def simple_match(self, f_label, t_label, rel, limit):
-        query = f"MATCH (a:{f_label})-[r:{rel}]->(b:{t_label}) RETURN a, r, b LIMIT {limit}"
-        return self._execute_query(query)
-    
-    def filter_match(self, labels, rels, cond,limit):
-        query = "MATCH (n)-[r]->(m) "
-        if len(labels)>0:
-            query+= "WHERE ("
-            for index, f in enumerate(labels):
-                query+=f"n:{f}"
-                if(index<len(labels)-1):
-                    query+=" OR "
-                else:
-                    query+=") "
-        if len(rels)>0:
-            query+= f"AND TYPE(r) IN {rels} "
-        if len(cond)>0:
-            for c in cond:
-                c_list = c.split(',')
-                query+=f"AND (n.{c_list[0]} IS NOT NULL AND n.{c_list[0]}{c_list[1]}{c_list[2]}) "
-        query+=f"RETURN n, labels(n) AS n_labels, r, m, labels(m) AS m_labels LIMIT {limit}"
-        
-        return self._execute_query(query)
-    
+    def store_layout(self, rows):
+        return self._invalidating(
+            self._execute_batch(self.STORE_LAYOUT_QUERY, rows),
+            *((label, None) for label in MODELOS),
+        )
+
+    ## recorridos ordenados por los indices de rango (rating / vistas materializadas)
     def top_rating(self, label, limit):
-        query = f"MATCH (a:{label}) with a ORDER BY a.rating DESC LIMIT {limit} RETURN collect(a)"
-        return self._execute_query(query)
+        query = f"MATCH (a:{label_valida(label)}) WHERE a.rating IS NOT NULL WITH a ORDER BY a.rating DESC LIMIT $limit RETURN collect(a)"
+        return self._cached_query([label], query, limit=int(limit))
     
     def top_views(self, label, limit):
-        query = f"MATCH (a:{label}) with a ORDER BY a.rating DESC LIMIT {limit} RETURN collect(a)"
-        return self._execute_query(query)
-    
-    def by_user_similartiy(self, id):
+        if label_valida(label) not in AGREGADOS_LABELS:
+            raise ValueError(f"{label} no recibe vistas (solo {', '.join(AGREGADOS_LABELS)})")
+        query = f"MATCH (a:{label_valida(label)}) WHERE a.vistas IS NOT NULL WITH a ORDER BY a.vistas DESC LIMIT $limit RETURN collect(a)"
+        return self._cached_query([label], query, limit=int(limit))
+
+    ## ESTADISTICAS
+    ## cubo de usuarios agregado en el servidor: una fila por combinacion de
+    ## pais/suscripcion/dispositivo/activo/rango de edad (decada), mas el histograma de intereses
+    USER_STATS_QUERY = """
+        CALL {
+            MATCH (u:Usuario)
+            WITH u, toInteger(u.edad) AS edad
+            WITH u.pais AS pais, u.suscripcion AS suscripcion, u.dispositivo AS dispositivo,
+                 u.activo AS activo, edad / 10 * 10 AS edad_rango,
+                 count(*) AS usuarios, sum(edad) AS edad_suma, sum(edad * edad) AS edad_suma2,
+                 min(edad) AS edad_min, max(edad) AS edad_max
+            RETURN collect({pais: pais, suscripcion: suscripcion, dispositivo: dispositivo, activo: activo,
+                            edad_rango: edad_rango, usuarios: usuarios, edad_suma: edad_suma,
+                            edad_suma2: edad_suma2, edad_min: edad_min, edad_max: edad_max}) AS cubo
+        }
+        CALL {
+            MATCH (u:Usuario)
+            UNWIND u.intereses AS interes
+            WITH interes, count(*) AS usuarios
+            ORDER BY usuarios DESC, interes
+            RETURN collect({interes: interes, usuarios: usuarios}) AS intereses
+        }
+        RETURN cubo, intereses
+    """
+
+    def user_stats(self):
+        return self._cached_query(["Usuario"], self.USER_STATS_QUERY)
+
+    ## SIMILITUD ITEM-ITEM
+    ## Recalcula los k vecinos (coseno sobre usuarios en comun) de cada pelicula p en el alcance.
+    ## Costo acotado por el vecindario de p, no por el tamaño del catalogo.
+    def _similar_refresh(self):
+        return f"""
+            CALL {{
+                WITH p
+                OPTIONAL MATCH (p)-[old:SIMILAR_A]->()
+                DELETE old
+            }}
+            {self._similar_vecinos()}
+            UNWIND vecinos AS v
+            WITH p, v, v.q AS q
+            CREATE (p)-[:SIMILAR_A {{score: v.score, co: v.co}}]->(q)
+        """
+
+    ## los k vecinos de p calculados en vivo, como lista `vecinos` de {q, co, score}
+    def _similar_vecinos(self):
+        rels = self.similar_rels
+        return f"""
+            CALL {{
+                WITH p
+                MATCH (p)<-[:{rels}]-(u:Usuario)
+                RETURN count(DISTINCT u) AS dp
+            }}
+            CALL {{
+                WITH p, dp
+                MATCH (p)<-[:{rels}]-(u:Usuario)-[:{rels}]->(q:Pelicula)
+                WHERE q <> p
+                WITH q, dp, count(DISTINCT u) AS co
+                CALL {{
+                    WITH q
+                    MATCH (q)<-[:{rels}]-(v:Usuario)
+                    RETURN count(DISTINCT v) AS dq
+                }}
+                WITH q, co, co / sqrt(toFloat(dp * dq)) AS score
+                ORDER BY score DESC, q.id
+                LIMIT $k
+                RETURN collect({{q: q, co: co, score: score}}) AS vecinos
+            }}
+        """
+
+    ## Tras una interaccion nueva con la pelicula `var` solo cambian los pares (var, q): se
+    ## recalcula la lista de var y, en la de cada q visto junto a ella, solo la entrada q -> var
+    ## (entra si supera a la mas debil, que sale). Costo acotado por los vecinos directos de var;
+    ## lo que quede aproximado en las listas de q se corrige con rebuild_similarity
+    def _similar_refresh_call(self, var):
+        rels = self.similar_rels
+        return f"""
+            CALL {{
+                WITH {var}
+                WITH {var} AS p
+                CALL {{
+                    WITH p
+                    OPTIONAL MATCH (p)-[old:SIMILAR_A]->()
+                    DELETE old
+                }}
+                CALL {{
+                    WITH p
+                    MATCH (p)<-[:{rels}]-(u:Usuario)
+                    RETURN count(DISTINCT u) AS dp
+                }}
+                CALL {{
+                    WITH p, dp
+                    MATCH (p)<-[:{rels}]-(u:Usuario)-[:{rels}]->(q:Pelicula)
+                    WHERE q <> p
+                    WITH q, dp, count(DISTINCT u) AS co
+                    CALL {{
+                        WITH q
+                        MATCH (q)<-[:{rels}]-(v:Usuario)
+                        RETURN count(DISTINCT v) AS dq
+                    }}
+                    RETURN q, co, co / sqrt(toFloat(dp * dq)) AS score
+                }}
+                WITH p, q, co, score ORDER BY score DESC, q.id
+                WITH p, collect({{q: q, co: co, score: score}}) AS pares
+                CALL {{
+                    WITH p, pares
+                    UNWIND pares[..$k] AS v
+                    WITH p, v, v.q AS q
+                    CREATE (p)-[:SIMILAR_A {{score: v.score, co: v.co}}]->(q)
+                }}
+                UNWIND pares AS v
+                WITH p, v, v.q AS q
+                CALL {{
+                    WITH p, q
+                    OPTIONAL MATCH (q)-[old:SIMILAR_A]->(p)
+                    DELETE old
+                }}
+                CALL {{
+                    WITH q
+                    OPTIONAL MATCH (q)-[s:SIMILAR_A]->(x)
+                    WITH s, x ORDER BY s.score, x.id DESC
+                    RETURN count(s) AS n, head(collect(s)) AS peor, head(collect(x.id)) AS peor_id
+                }}
+                WITH p, q, v, n, peor, peor_id
+                WHERE n < $k OR v.score > peor.score OR (v.score = peor.score AND p.id < peor_id)
+                CREATE (q)-[:SIMILAR_A {{score: v.score, co: v.co}}]->(p)
+                WITH peor, n
+                WHERE n >= $k
+                DELETE peor
+            }}
+        """
+
+    ## escritura de una interaccion `rel` con la pelicula b (MATCH ... MERGE ... en `query`):
+    ## si rel entra en la similitud, se refresca b en la misma transaccion administrada
+    def _similar_write(self, rel, query, returns, **params):
+        if rel not in self.similar_rels.split("|"):
+            return self._execute_query(query + returns, **params)
+        query += "\n            WITH a, b, r\n" + self._similar_refresh_call("b") + returns
+        return self._execute_write(query, **params)
+
+    def refresh_similarity(self, movie_ids):
+        query = "UNWIND $ids AS pid MATCH (p:Pelicula {id: pid})" + self._similar_refresh_call("p") + "RETURN count(p) AS peliculas"
+        return self._invalidating(self._execute_write(query, ids=[int(i) for i in movie_ids], k=self.similar_k), ("Pelicula", ()))
+
+    def rebuild_similarity(self, batch_size=200):
+        query = f"""
+            MATCH (p:Pelicula)
+            CALL {{
+                WITH p
+                {self._similar_refresh()}
+            }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+            RETURN count(p) AS peliculas
+        """
+        return self._invalidating(self._execute_query(query, k=self.similar_k), ("Pelicula", ()))
+
+    ## interacciones Usuario -> Pelicula para el motor de matrices dispersas
+    def interactions(self):
         query = """
-            MATCH (a:Usuario {id: $id})-[:VIO]->(p:Pelicula)
-            MATCH (other:Usuario)-[:VIO]->(p)
-            MATCH (other:Usuario)-[:VIO]->(new:Pelicula)
-            WHERE other.id <> $id
-            RETURN new
+            MATCH (u:Usuario)-[r:VIO|CALIFICO|RECOMENDO]->(p:Pelicula)
+            RETURN u.id AS usuario, p.id AS pelicula, type(r) AS tipo,
+                   coalesce(r.rating, r.calificacion, r.confianza) AS valor
         """
-        return self._execute_query(query, id=int(id))
+        return self._execute_query(query)
+
+    ## lecturas completas para el snapshot en memoria (snapshot.GraphSnapshot):
+    ## id de cada nodo de `labels` (con el nodo entero solo para los de `full`)
+    def snapshot_nodes(self, labels, full=()):
+        parts = [
+            f"MATCH (n:{label}) RETURN '{label}' AS label, n.id AS id, {'n' if label in full else 'null'} AS node"
+            for label in labels
+        ]
+        query = "CALL { " + " UNION ALL ".join(parts) + " } RETURN label, id, node"
+        return self._execute_query(query)
+
+    ## aristas de `rels` (tipo -> propiedad de peso o None) como ids de sus extremos
+    def snapshot_edges(self, rels):
+        weight = " ".join(f"WHEN '{rel}' THEN r.{prop}" for rel, prop in rels.items() if prop)
+        query = f"""
+            MATCH (a)-[r:{'|'.join(rels)}]->(b)
+            RETURN type(r) AS rel, a.id AS a, b.id AS b, CASE type(r) {weight} END AS w
+        """
+        return self._execute_query(query)
+
+    def get_nodes_by_ids(self, label, ids):
+        query = f"MATCH (n:{label_valida(label)}) WHERE n.id IN $ids RETURN n"
+        return self._execute_query(query, ids=[int(i) for i in ids])
+
+    ## Recomendacion por usuario: une las listas top-K de las peliculas vistas. Una pelicula
+    ## sin lista (base cargada antes del indice, o sin rebuild_similarity) usa sus vecinos en vivo
+    def by_user_similartiy(self, id, limit=10):
+        query = f"""
+            MATCH (a:Usuario {{id: $id}})-[:VIO]->(p:Pelicula)
+            WITH DISTINCT a, p
+            CALL {{
+                WITH p
+                MATCH (p)-[s:SIMILAR_A]->(new:Pelicula)
+                RETURN new, s.score AS score
+                UNION ALL
+                WITH p
+                WITH p WHERE NOT EXISTS {{ (p)-[:SIMILAR_A]->() }}
+                {self._similar_vecinos()}
+                UNWIND vecinos AS v
+                RETURN v.q AS new, v.score AS score
+            }}
+            WITH a, new, score
+            WHERE NOT (a)-[:VIO]->(new)
+            WITH new, sum(score) AS score
+            ORDER BY score DESC, new.id
+            LIMIT $limit
+            RETURN new, score
+        """
+        return self._cached_query([f"Usuario:{int(id)}", "Pelicula"], query, id=int(id), limit=int(limit), k=self.similar_k)
     
     def get_subgeneres(self,id):
         query = """
@@ -510,37 +1441,165 @@ class GraphDB:
         RETURN subgenero, COUNT(subgenero) AS count
         ORDER BY count DESC
         """
-        return self._execute_query(query, id=int(id))
-    def by_subgenre(self, id, sub):
+        return self._cached_query([f"Usuario:{int(id)}", "Pelicula", "Genero"], query, id=int(id))
+    ## Recomendacion por subgenero en una sola consulta: los `subgenres` subgeneros mas vistos
+    ## del usuario, mezclados por frecuencia, y las `limit` mejores peliculas no vistas de ellos
+    def by_subgenre(self, id, limit=5, subgenres=1):
         query = """
-        MATCH (a:Usuario{id:$id})-[:VIO]->(p:Pelicula)
-        MATCH (n:Pelicula)-[:PERTENECE_A]->(g:Genero)
-        WHERE $sub IN g.subgeneros
-        AND n.id<>p.id
-        WITH n
-        ORDER BY n.rating DESC
-        RETURN n LIMIT 5
+        MATCH (a:Usuario {id: $id})-[:VIO]->(:Pelicula)-[:PERTENECE_A]->(g:Genero)
+        UNWIND g.subgeneros AS sub
+        WITH a, sub, count(*) AS freq
+        ORDER BY freq DESC, sub
+        LIMIT $subgenres
+        WITH a, collect({sub: sub, freq: freq}) AS favs, sum(freq) AS total
+        UNWIND favs AS fav
+        MATCH (g:Genero) WHERE fav.sub IN g.subgeneros
+        MATCH (n:Pelicula)-[:PERTENECE_A]->(g)
+        WHERE NOT (a)-[:VIO]->(n)
+        WITH DISTINCT n, fav, total
+        WITH n, sum(toFloat(fav.freq) / total) AS afinidad, collect(fav.sub) AS subgeneros
+        ORDER BY afinidad DESC, n.rating DESC, n.id
+        LIMIT $limit
+        RETURN n, afinidad, subgeneros
         """
-        return self._execute_query(query, id=int(id), sub=sub)
+        return self._cached_query(
+            [f"Usuario:{int(id)}", "Pelicula", "Genero"], query,
+            id=int(id), limit=int(limit), subgenres=int(subgenres)
+        )
     
-    def by_actor(self, id):
+    ## Recomendacion por actor/director admirado: expansion local desde el usuario,
+    ## puntaje = nivel de admiracion/interes acumulado x rating, sin peliculas ya vistas
+    def by_actor(self, id, limit=10, skip=0):
         query = """
-        match (n:Usuario {id: $id})-[:ADMIRA]->(a:Actor)
-        match (n:Usuario {id: $id})-[:VIO]->(p:Pelicula)
-        MATCH (other:Pelicula)
-        WHERE p.id<>other.id
-        AND EXISTS{ (a)-[:PARTICIPO_EN]-(other) }
-        RETURN other
+        MATCH (u:Usuario {id: $id})-[ad:ADMIRA]->(a:Actor)-[:PARTICIPO_EN]->(other:Pelicula)
+        WHERE NOT (u)-[:VIO]->(other)
+        WITH other, sum(coalesce(ad.nivel_admiracion, 1)) AS admiracion, collect(DISTINCT a.id) AS actores
+        WITH other, admiracion, actores, admiracion * coalesce(other.rating, 0) AS score
+        ORDER BY score DESC, other.id
+        SKIP $skip LIMIT $limit
+        RETURN other, score, admiracion, actores
         """
-        return self._execute_query(query, id=int(id))
+        return self._cached_query(
+            [f"Usuario:{int(id)}", "Pelicula", "Actor"], query,
+            id=int(id), limit=int(limit), skip=int(skip)
+        )
     
-    def by_director(self, id):
+    def by_director(self, id, limit=10, skip=0):
         query = """
-        match (n:Usuario {id: $id})-[:SIGUE]->(a:Director)
-        match (n:Usuario {id: $id})-[:VIO]->(p:Pelicula)
-        MATCH (other:Pelicula)
-        WHERE p.id<>other.id
-        AND EXISTS{ (a)-[:DIRIGIDA_POR]-(other) }
-        RETURN other
+        MATCH (u:Usuario {id: $id})-[s:SIGUE]->(d:Director)<-[:DIRIGIDA_POR]-(other:Pelicula)
+        WHERE NOT (u)-[:VIO]->(other)
+        WITH other, sum(coalesce(s.nivel_interes, 1)) AS interes, collect(DISTINCT d.id) AS directores
+        WITH other, interes, directores, interes * coalesce(other.rating, 0) AS score
+        ORDER BY score DESC, other.id
+        SKIP $skip LIMIT $limit
+        RETURN other, score, interes, directores
         """
-        return self._execute_query(query, id=int(id))
\ No newline at end of file
+        return self._cached_query(
+            [f"Usuario:{int(id)}", "Pelicula", "Director"], query,
+            id=int(id), limit=int(limit), skip=int(skip)
+        )
+
+## Version asincrona: mismas consultas que GraphDB, ejecutadas con el driver async.
+## Los metodos heredados devuelven corrutinas que se esperan con await.
+class AsyncGraphDB(GraphDB):
+    _driver = staticmethod(AsyncGraphDatabase.driver)
+
+    async def close(self):
+        await self.driver.close()
+
+    async def _fetch(self, query, params, props, name):
+        with QueryTimer(name, query) as timer:
+            async with self.driver.session() as session:
+                rslt = await session.run(timer.query, params)
+                keys = await rslt.keys()
+                rows = [shape_record(record, props, keys) async for record in rslt]
+                timer.done(len(rows), await rslt.consume())
+        return rows
+
+    async def _fetch_iter(self, query, params, props, name):
+        with QueryTimer(name, query) as timer:
+            async with self.driver.session() as session:
+                rslt = await session.run(timer.query, params)
+                keys = await rslt.keys()
+                count = 0
+                async for record in rslt:
+                    count += 1
+                    yield shape_record(record, props, keys)
+                timer.done(count, await rslt.consume())
+
+    async def _plan(self, query, params, name):
+        with QueryTimer(name, "EXPLAIN " + query) as timer:
+            async with self.driver.session() as session:
+                rslt = await session.run(timer.query, params)
+                summary = await rslt.consume()
+            timer.done(0, summary)
+        return summary.plan
+
+    async def _write(self, query, params, name):
+        with QueryTimer(name, query) as timer:
+            async def work(tx):
+                rslt = await tx.run(timer.query, params)
+                keys = await rslt.keys()
+                return [shape_record(record, None, keys) async for record in rslt], await rslt.consume()
+
+            async with self.driver.session() as session:
+                rows, summary = await session.execute_write(work)
+            timer.done(len(rows), summary)
+        return rows
+
+    async def _many(self, queries, name):
+        async with self.driver.session() as session:
+            for query in queries:
+                with QueryTimer(name, query) as timer:
+                    rslt = await session.run(timer.query)
+                    timer.done(0, await rslt.consume())
+
+    async def _batch(self, query, rows, session, name):
+        async def work(tx, query):
+            rslt = await tx.run(query, rows=rows)
+            return await rslt.consume()
+
+        if session is None:
+            async with self.driver.session() as session:
+                return await self._batch(query, rows, session, name)
+        with QueryTimer(name, query) as timer:
+            summary = await session.execute_write(work, timer.query)
+            timer.done(0, summary)
+        return summary
+
+    async def _chunks(self, query, chunks, name):
+        errors = []
+        async with self.driver.session() as session:
+            for rows in chunks:
+                try:
+                    await self._batch(query, rows, session, name)
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(str(e))
+        return errors
+
+    async def _lanes(self, query, lanes, name):
+        async def work(tx, query, rows):
+            rslt = await tx.run(query, rows=rows)
+            return [r[0] async for r in rslt], await rslt.consume()
+
+        async def run(batches):
+            out = []
+            async with self.driver.session() as session:
+                for rows in batches:
+                    try:
+                        with QueryTimer(name, query) as timer:
+                            values, summary = await session.execute_write(work, timer.query, rows)
+                            timer.done(len(values), summary)
+                        out.append(values)
+                    except Exception as e:
+                        out.append(e)
+            return out
+
+        return await asyncio.gather(*(run(batches) for batches in lanes))
+
+    async def _then(self, result, fn):
+        return fn(await result)
+
+    async def _result(self, value):
+        return value
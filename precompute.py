@@ -0,0 +1,247 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from model import MIN_ID
+from recommender import ENGINES, SparseRecommender
+from snapshot import GraphSnapshot, SNAPSHOT_FULL, SNAPSHOT_LABELS, SNAPSHOT_RELS
+
+## Recomendaciones por usuario precalculadas (proceso nocturno) en un archivo binario de
+## registros de ancho fijo, leido con memmap: abrir el archivo solo lee la cabecera y
+## cada consulta toca un registro (tabla hash de direccionamiento abierto por id de usuario).
+##
+## Formato (little-endian):
+##   cabecera de 64 bytes: b"RREC", version u8, top_n u16, slots u32, usuarios u32,
+##                         motor (16 bytes utf-8), generado (f8, epoch), desde (f8, epoch del snapshot)
+##   slots registros: user i8 (MIN_ID = libre), count u2, flags u1, pad u1,
+##                    movies i8[top_n], scores f4[top_n]
+##
+## Las invalidaciones se anotan ademas en <ruta>.invalidaciones ("epoch id" por linea). Al abrir
+## un archivo se vuelven a marcar los usuarios invalidados desde su snapshot: las interacciones
+## que llegan mientras corre el precalculo (y marcan el archivo viejo) no se pierden al reemplazarlo.
+
+MAGIC = b"RREC"
+VERSION = 2
+HEADER = struct.Struct("<4sBHII16sdd")
+HEADER_SIZE = 64
+FLAG_INVALID = 1  # el usuario cambio despues del precalculo: responder en vivo
+LOG_SUFFIX = ".invalidaciones"
+
+# relaciones de las que depende cada motor (invalidan al usuario origen)
+DEPENDE = {
+    "graph": ("VIO",),
+    "item_knn": ("VIO", "CALIFICO", "RECOMENDO"),
+    "user_knn": ("VIO", "CALIFICO", "RECOMENDO"),
+    "svd": ("VIO", "CALIFICO", "RECOMENDO"),
+}
+
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+
+def record_dtype(top_n):
+    return np.dtype([
+        ("user", "<i8"), ("count", "<u2"), ("flags", "u1"), ("pad", "u1"),
+        ("movies", "<i8", (top_n,)), ("scores", "<f4", (top_n,)),
+    ])
+
+
+## hash multiplicativo de Fibonacci: los `bits` altos de id * 2^64/phi
+def _slot(user_id, bits):
+    return ((user_id & _MASK64) * _GOLDEN & _MASK64) >> (64 - bits)
+
+
+## anota usuarios invalidados (append: varias escrituras concurrentes no se pisan)
+def log_invalidation(path, user_ids):
+    now = time.time()
+    lines = "".join(f"{now!r} {int(user_id)}\n" for user_id in user_ids)
+    if lines:
+        with open(path + LOG_SUFFIX, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+## usuarios invalidados en o despues de `since` (log actual y el rotado por el ultimo precalculo)
+def invalidated_since(path, since):
+    users = set()
+    for log in (path + LOG_SUFFIX + ".anterior", path + LOG_SUFFIX):
+        try:
+            f = open(log, encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    when, user_id = line.split()
+                    if float(when) >= since:
+                        users.add(int(user_id))
+                except ValueError:
+                    pass  # linea a medio escribir
+    return users
+
+
+## Escribe el archivo desde (id de usuario, ids de pelicula, puntajes) en un temporal
+## y lo reemplaza con os.replace: los lectores ven el archivo viejo o el nuevo, nunca uno a medias.
+## `since` es el momento en que se leyo el grafo (por defecto, ahora)
+def write_store(path, results, top_n, engine, since=None):
+    results = list(results)
+    bits = max(4, (2 * len(results) - 1).bit_length())  # carga <= 50%
+    slots = 1 << bits
+    records = np.zeros(slots, dtype=record_dtype(top_n))
+    records["user"] = MIN_ID
+    for user_id, movies, scores in results:
+        slot = _slot(user_id, bits)
+        while records["user"][slot] != MIN_ID:
+            slot = (slot + 1) & (slots - 1)
+        n = min(len(movies), top_n)
+        records["user"][slot] = user_id
+        records["count"][slot] = n
+        records["movies"][slot, :n] = movies[:n]
+        records["scores"][slot, :n] = scores[:n]
+    now = time.time()
+    header = HEADER.pack(MAGIC, VERSION, top_n, slots, len(results), engine.encode()[:16], now,
+                         now if since is None else since)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"users": len(results), "slots": slots, "bytes": HEADER_SIZE + records.nbytes}
+
+
+class PrecomputedStore:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:4] != MAGIC or header[4] != VERSION:
+            raise ValueError(f"{path} no es un archivo de recomendaciones v{VERSION}")
+        _, _, top_n, slots, users, engine, generated, since = HEADER.unpack(header)
+        self.path = path
+        self.top_n = top_n
+        self.bits = slots.bit_length() - 1
+        self.users = users
+        self.engine = engine.rstrip(b"\0").decode()
+        self.generated = generated
+        self.since = since
+        self.rels = DEPENDE.get(self.engine, ())
+        stat = os.stat(path)
+        self.version = (stat.st_ino, stat.st_mtime_ns)
+        # r+: la invalidacion se escribe en el archivo y la ven todos los procesos que lo mapean
+        self.records = np.memmap(path, dtype=record_dtype(top_n), mode="r+", offset=HEADER_SIZE, shape=(slots,))
+        self._flag(invalidated_since(path, since))
+
+    def _find(self, user_id):
+        mask = len(self.records) - 1
+        slot = _slot(user_id, self.bits)
+        while True:
+            stored = int(self.records["user"][slot])
+            if stored == user_id:
+                return slot
+            if stored == MIN_ID:
+                return None
+            slot = (slot + 1) & mask
+
+    ## [(id de pelicula, puntaje)] o None si hay que calcular en vivo
+    ## (usuario nuevo, invalidado o limit mayor al precalculado)
+    def lookup(self, user_id, limit):
+        if limit > self.top_n:
+            return None
+        slot = self._find(int(user_id))
+        if slot is None:
+            return None
+        record = self.records[slot]
+        if record["flags"] & FLAG_INVALID:
+            return None
+        n = min(int(record["count"]), limit)
+        return list(zip(record["movies"][:n].tolist(), record["scores"][:n].tolist()))
+
+    def invalidate(self, user_ids):
+        user_ids = [int(u) for u in user_ids]
+        log_invalidation(self.path, user_ids)
+        self._flag(user_ids)
+        if self.replaced():
+            # este mapeo ya es viejo: abrir el archivo nuevo aplica el log, que incluye estos usuarios
+            try:
+                PrecomputedStore(self.path)
+            except (OSError, ValueError):
+                pass
+
+    def _flag(self, user_ids):
+        for user_id in user_ids:
+            slot = self._find(int(user_id))
+            if slot is not None:
+                self.records["flags"][slot] |= FLAG_INVALID
+
+    ## el archivo fue reemplazado por un precalculo nuevo
+    def replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) != self.version
+
+    def info(self):
+        return {
+            "path": self.path,
+            "engine": self.engine,
+            "top_n": self.top_n,
+            "users": self.users,
+            "slots": len(self.records),
+            "invalidated": int(np.count_nonzero(self.records["flags"] & FLAG_INVALID)),
+            "generated": self.generated,
+            "since": self.since,
+        }
+
+
+## Calcula el top-`top_n` de cada Usuario con el mismo motor que /rec/user/{id}?engine=...
+## graph usa el snapshot en memoria (mismos resultados que GraphDB.by_user_similartiy)
+def precompute(db, path, top_n=50, engine="graph"):
+    start = time.perf_counter()
+    # lo invalidado desde aqui se vuelve a marcar en el archivo nuevo; lo anterior ya no aplica
+    since = time.time()
+    try:
+        os.replace(path + LOG_SUFFIX, path + LOG_SUFFIX + ".anterior")
+    except FileNotFoundError:
+        pass
+    if engine == "graph":
+        snap = GraphSnapshot.from_rows(db.snapshot_nodes(SNAPSHOT_LABELS, SNAPSHOT_FULL), db.snapshot_edges(SNAPSHOT_RELS))
+        results = snap.user_similarity_all(top_n)
+    elif engine in ENGINES:
+        rec = SparseRecommender.from_rows(db.interactions())
+        users = [row["id"] for row in db.snapshot_nodes(["Usuario"])]
+        scored = rec.recommend_batch(users, top_n, engine)
+        results = (
+            (uid, [m["id"] for m in movies], [m["score"] for m in movies])
+            for uid, movies in scored.items()
+        )
+    else:
+        raise ValueError(f"engine debe ser graph o uno de {', '.join(ENGINES)}")
+    stats = write_store(path, results, top_n, engine, since)
+    stats["invalidated"] = PrecomputedStore(path).info()["invalidated"]  # abrirlo aplica el log
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model import GraphDB
+
+    parser = argparse.ArgumentParser(description="Precalculo nocturno de /rec/user/{id}")
+    parser.add_argument("path", nargs="?", default="./recomendaciones.bin")
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--engine", default="graph", help=f"graph o {', '.join(ENGINES)}")
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI"))
+    parser.add_argument("--username", default=os.environ.get("NEO4J_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("NEO4J_PASSWORD"))
+    args = parser.parse_args()
+
+    db = GraphDB(args.uri, args.username, args.password)
+    try:
+        stats = precompute(db, args.path, args.top_n, args.engine)
+    finally:
+        db.close()
+    print(f"{stats['users']} usuarios en {stats['seconds']}s -> {args.path} ({stats['bytes']} bytes)")
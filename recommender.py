@@ -0,0 +1,135 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+
+ENGINES = ("item_knn", "user_knn", "svd")
+
+# Peso de cada senal al construir la matriz Usuario x Pelicula (valores normalizados a 0..1)
+PESOS = {"VIO": 1.0, "CALIFICO": 1.0, "RECOMENDO": 0.5}
+ESCALA = {"VIO": 10.0, "CALIFICO": 10.0, "RECOMENDO": 1.0}
+
+
+## conserva las k entradas mayores de cada fila de una matriz CSR
+def _top_k_rows(m, k):
+    m = m.tocsr()
+    indptr, data = m.indptr, m.data
+    keep = np.zeros(len(data), dtype=bool)
+    for row in range(m.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        if end - start <= k:
+            keep[start:end] = True
+        else:
+            top = np.argpartition(data[start:end], -k)[-k:]
+            keep[start + top] = True
+    m.data = np.where(keep, data, 0.0)
+    m.eliminate_zeros()
+    return m
+
+
+## top-n por fila de una matriz densa de puntajes (vectorizado)
+def _top_n(scores, n):
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+class SparseRecommender:
+    def __init__(self, user_ids, movie_ids, matrix, k=50, factors=32):
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self.user_index = {int(u): i for i, u in enumerate(self.user_ids)}
+        self.R = matrix.tocsr()  # usuarios x peliculas
+        self.k = k
+        self.factors = factors
+        self._item_sim = None
+        self._svd = None
+        self._user_norm = None
+
+    ## construye la matriz a partir de filas {usuario, pelicula, tipo, valor}
+    @classmethod
+    def from_rows(cls, rows, pesos=PESOS, **kwargs):
+        users, movies, values = [], [], []
+        for row in rows:
+            tipo = row["tipo"]
+            if row["valor"] is None or tipo not in pesos:
+                continue
+            users.append(row["usuario"])
+            movies.append(row["pelicula"])
+            values.append(pesos[tipo] * float(row["valor"]) / ESCALA[tipo])
+        user_ids, u_idx = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+        movie_ids, m_idx = np.unique(np.asarray(movies, dtype=np.int64), return_inverse=True)
+        # coo -> csr suma las interacciones repetidas del mismo par
+        matrix = sp.coo_matrix(
+            (np.asarray(values, dtype=np.float64), (u_idx, m_idx)),
+            shape=(len(user_ids), len(movie_ids)),
+        )
+        return cls(user_ids, movie_ids, matrix, **kwargs)
+
+    @staticmethod
+    def _normalize(m, axis):
+        norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=axis)).ravel())
+        norms[norms == 0] = 1.0
+        scale = sp.diags(1.0 / norms)
+        return (m @ scale if axis == 0 else scale @ m).tocsr()
+
+    ## similitud coseno item-item, podada a k vecinos por pelicula
+    def item_similarity(self):
+        if self._item_sim is None:
+            rn = self._normalize(self.R, axis=0)
+            sim = (rn.T @ rn).tocsr()
+            sim.setdiag(0)
+            self._item_sim = _top_k_rows(sim, self.k)
+        return self._item_sim
+
+    def _svd_factors(self):
+        if self._svd is None:
+            k = max(1, min(self.factors, min(self.R.shape) - 1))
+            u, s, vt = svds(self.R, k=k)
+            self._svd = (u * s, vt)
+        return self._svd
+
+    def _scores(self, rows, engine):
+        R = self.R[rows]
+        if engine == "item_knn":
+            scores = R @ self.item_similarity()
+        elif engine == "user_knn":
+            if self._user_norm is None:
+                self._user_norm = self._normalize(self.R, axis=1)
+            sim = (self._user_norm[rows] @ self._user_norm.T).tocoo()
+            other = sim.col != rows[sim.row]  # sin el propio usuario
+            sim = sp.csr_matrix((sim.data[other], (sim.row[other], sim.col[other])), shape=sim.shape)
+            scores = _top_k_rows(sim, self.k) @ self.R
+        elif engine == "svd":
+            us, vt = self._svd_factors()
+            scores = us[rows] @ vt
+        else:
+            raise ValueError(f"Motor desconocido: {engine}. Opciones: {', '.join(ENGINES)}")
+        scores = scores.toarray() if sp.issparse(scores) else np.asarray(scores)
+        # excluir lo ya visto / calificado / recomendado
+        seen = R.nonzero()
+        scores[seen] = -np.inf
+        return scores
+
+    ## puntajes de muchos usuarios con un solo producto de matrices por bloque
+    def recommend_batch(self, user_ids, n=10, engine="item_knn", chunk=1024):
+        if engine not in ENGINES:
+            raise ValueError(f"Motor desconocido: {engine}. Opciones: {', '.join(ENGINES)}")
+        known = [(uid, self.user_index[int(uid)]) for uid in user_ids if int(uid) in self.user_index]
+        result = {int(uid): [] for uid in user_ids}
+        for start in range(0, len(known), chunk):
+            block = known[start:start + chunk]
+            rows = np.fromiter((r for _, r in block), dtype=np.int64, count=len(block))
+            scores = self._scores(rows, engine)
+            top = _top_n(scores, n)
+            for (uid, _), cols, row_scores in zip(block, top, scores):
+                result[int(uid)] = [
+                    {"id": int(self.movie_ids[c]), "score": float(row_scores[c])}
+                    for c in cols if np.isfinite(row_scores[c]) and row_scores[c] > 0
+                ]
+        return result
+
+    def recommend(self, user_id, n=10, engine="item_knn"):
+        return self.recommend_batch([user_id], n, engine)[int(user_id)]
@@ -0,0 +1,231 @@
+import io
+import struct
+import zlib
+
+import networkx as nx
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+## Subsistema de visualizacion: grafo -> layout -> PNG, o exportacion JSON / binaria.
+## Usa Figure/FigureCanvasAgg (sin el estado global de pyplot), asi que es seguro entre hilos.
+
+COLORS = ["lightblue", "lightgreen", "plum", "orange", "pink", "khaki", "lightgray", "salmon"]
+LAYOUT_PROPS = ("x", "y")  # layout precalculado guardado en los nodos
+SMALL_GRAPH = 300  # hasta aqui spring_layout exacto; arriba, layout por celdas
+
+
+## color estable por label (el mismo en cada render, util para cachear imagenes)
+def label_color(label):
+    return COLORS[zlib.crc32(label.encode()) % len(COLORS)]
+
+
+## Aristas de simple_match / filter_match -> pares de nodos (label, id, texto, color, propiedades).
+## Los ids se repiten entre labels, la llave de cada nodo es (label, id)
+def simple_pairs(edges, f_label, t_label, f_val, t_val):
+    for edge in edges:
+        a, b = edge["a"], edge["b"]
+        yield ((f_label, a["id"], a.get(f_val), "lightblue", a),
+               (t_label, b["id"], b.get(t_val), "lightgreen", b))
+
+
+def _node_text(node, show_props):
+    if not show_props:
+        return node.get("nombre") or node.get("titulo")
+    return "".join(f"{k}: {v}\n" for k, v in node.items() if k not in LAYOUT_PROPS and not isinstance(v, dict))
+
+
+def filter_pairs(edges, show_props):
+    for edge in edges:
+        n, m = edge["n"], edge["m"]
+        n_label, m_label = edge["n_labels"][0], edge["m_labels"][0]
+        yield ((n_label, n["id"], _node_text(n, show_props), label_color(n_label), n),
+               (m_label, m["id"], _node_text(m, show_props), label_color(m_label), m))
+
+
+def _xy(node):
+    x, y = (node.get(p) for p in LAYOUT_PROPS)
+    if x is None or y is None:
+        return None
+    return (x, y)
+
+
+def build_graph(pairs):
+    G = nx.DiGraph()
+    for src, dst in pairs:
+        for label, node_id, text, color, node in (src, dst):
+            G.add_node((label, node_id), label=text, color=color, xy=_xy(node))
+        G.add_edge(src[:2], dst[:2])
+    return G
+
+
+## EXPORTACION (sin networkx ni matplotlib)
+## columnas: nodos en orden de aparicion y aristas como indices a esos nodos
+def graph_columns(pairs):
+    index = {}
+    nodes = {"label": [], "id": [], "text": [], "x": [], "y": []}
+    source, target = [], []
+    for src, dst in pairs:
+        ends = []
+        for label, node_id, text, _, node in (src, dst):
+            key = (label, node_id)
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(index)
+                xy = _xy(node) or (None, None)
+                nodes["label"].append(label)
+                nodes["id"].append(node_id)
+                nodes["text"].append(text)
+                nodes["x"].append(xy[0])
+                nodes["y"].append(xy[1])
+            ends.append(i)
+        source.append(ends[0])
+        target.append(ends[1])
+    return {"nodes": nodes, "edges": {"source": source, "target": target}}
+
+
+## Formato binario columnar (little-endian):
+##   b"RGPH", version u8, nodos u32, aristas u32, labels u16
+##   labels: u16 largo + utf-8 cada una
+##   label u8[n], id i64[n], x f32[n], y f32[n] (NaN sin coordenadas)
+##   texto: offsets u32[n+1] + bloque utf-8
+##   source u32[e], target u32[e]
+BINARY_MAGIC = b"RGPH"
+BINARY_VERSION = 1
+
+
+def graph_binary(columns):
+    nodes, edges = columns["nodes"], columns["edges"]
+    labels = list(dict.fromkeys(nodes["label"]))
+    label_index = {label: i for i, label in enumerate(labels)}
+    texts = [("" if t is None else str(t)).encode() for t in nodes["text"]]
+    offsets = np.zeros(len(texts) + 1, dtype="<u4")
+    np.cumsum([len(t) for t in texts], out=offsets[1:])
+    parts = [struct.pack("<4sBIIH", BINARY_MAGIC, BINARY_VERSION, len(nodes["id"]), len(edges["source"]), len(labels))]
+    for label in labels:
+        raw = label.encode()
+        parts.append(struct.pack("<H", len(raw)) + raw)
+    parts += [
+        np.array([label_index[l] for l in nodes["label"]], dtype="u1").tobytes(),
+        np.array(nodes["id"], dtype="<i8").tobytes(),
+        np.array([np.nan if v is None else v for v in nodes["x"]], dtype="<f4").tobytes(),
+        np.array([np.nan if v is None else v for v in nodes["y"]], dtype="<f4").tobytes(),
+        offsets.tobytes(),
+        b"".join(texts),
+        np.array(edges["source"], dtype="<u4").tobytes(),
+        np.array(edges["target"], dtype="<u4").tobytes(),
+    ]
+    return b"".join(parts)
+
+
+## Layout de fuerzas (Fruchterman-Reingold) con repulsion aproximada por celdas:
+## cada nodo es repelido por el centroide (con masa) de cada celda de una grilla g x g,
+## al estilo Barnes-Hut de un nivel. Costo O(n * celdas) por iteracion en vez de O(n^2).
+def force_layout(n, edges, iterations=50, seed=0, max_cells=256, chunk=2048, gravity=1.0):
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    if n <= 1:
+        return pos
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    src, dst = edges[:, 0], edges[:, 1]
+    k = np.sqrt(1.0 / n)
+    g = int(max(1, min(np.sqrt(max_cells), np.sqrt(n) / 2)))
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        lo = pos.min(axis=0)
+        span = np.maximum(pos.max(axis=0) - lo, 1e-9)
+        cell_xy = np.minimum(((pos - lo) / span * g).astype(np.int64), g - 1)
+        cell = cell_xy[:, 0] * g + cell_xy[:, 1]
+        mass = np.bincount(cell, minlength=g * g).astype(np.float64)
+        occupied = np.nonzero(mass)[0]
+        cmass = mass[occupied]
+        centroid = np.stack([
+            np.bincount(cell, weights=pos[:, 0], minlength=g * g)[occupied],
+            np.bincount(cell, weights=pos[:, 1], minlength=g * g)[occupied],
+        ], axis=1) / cmass[:, None]
+        own = np.searchsorted(occupied, cell)
+
+        disp = np.zeros_like(pos)
+        for start in range(0, n, chunk):
+            p = pos[start:start + chunk]
+            rows = np.arange(len(p))
+            o = own[start:start + chunk]
+            delta = p[:, None, :] - centroid[None, :, :]
+            dist2 = np.maximum((delta ** 2).sum(axis=2), 1e-9)
+            weight = k * k * cmass[None, :] / dist2
+            # la celda propia se cuenta sin el nodo mismo
+            weight[rows, o] = 0.0
+            rep = (delta * weight[:, :, None]).sum(axis=1)
+            rest = cmass[o] - 1
+            has_rest = rest > 0
+            c_excl = np.where(
+                has_rest[:, None],
+                (centroid[o] * cmass[o][:, None] - p) / np.maximum(rest, 1)[:, None],
+                p,
+            )
+            d_own = p - c_excl
+            d2_own = np.maximum((d_own ** 2).sum(axis=1), 1e-9)
+            rep += d_own * (k * k * rest / d2_own)[:, None]
+            disp[start:start + chunk] = rep
+
+        if len(edges):
+            delta = pos[src] - pos[dst]
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            att = delta * (dist / k)[:, None]
+            np.subtract.at(disp, src, att)
+            np.add.at(disp, dst, att)
+
+        # gravedad hacia el centro: los nodos aislados no se escapan del dibujo
+        disp -= gravity * (pos - pos.mean(axis=0))
+
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature -= cooling
+    pos -= pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    return pos / scale if scale > 0 else pos
+
+
+## posiciones precalculadas (propiedades x/y) si todos los nodos las tienen;
+## si no, spring_layout para grafos chicos y force_layout para grandes
+def compute_layout(G, iterations=50, seed=0):
+    stored = nx.get_node_attributes(G, "xy")
+    if G.number_of_nodes() and all(stored.get(n) is not None for n in G.nodes):
+        return {n: np.asarray(stored[n], dtype=float) for n in G.nodes}
+    if G.number_of_nodes() <= SMALL_GRAPH:
+        return nx.spring_layout(G, k=2.0, seed=seed)
+    nodes = list(G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = [(index[a], index[b]) for a, b in G.edges]
+    pos = force_layout(len(nodes), edges, iterations, seed)
+    return dict(zip(nodes, pos))
+
+
+## layout global para precalcular: filas {label, id, out: [[label, id], ...]} -> [{label, id, x, y}]
+def layout_rows(rows, iterations=50, seed=0):
+    index = {(r["label"], r["id"]): i for i, r in enumerate(rows)}
+    edges = [
+        (i, index[tuple(o)])
+        for i, r in enumerate(rows) for o in r["out"] if tuple(o) in index
+    ]
+    pos = force_layout(len(rows), edges, iterations, seed)
+    return [
+        {"label": r["label"], "id": r["id"], "x": float(x), "y": float(y)}
+        for r, (x, y) in zip(rows, pos)
+    ]
+
+
+def render_png(G, pos=None, figsize=(8, 6)):
+    if pos is None:
+        pos = compute_layout(G)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_axis_off()
+    colors = nx.get_node_attributes(G, "color")
+    nx.draw(G, pos, ax=ax, labels=nx.get_node_attributes(G, "label"), with_labels=True,
+            node_color=[colors[n] for n in G.nodes()], edge_color="gray", node_size=1500, font_size=5)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
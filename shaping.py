@@ -0,0 +1,73 @@
+from neo4j.graph import Node, Path, Relationship
+from neo4j.time import Date, DateTime, Duration, Time
+
+## Conversion de valores del driver a estructuras serializables en una sola pasada.
+## Nodo -> dict de propiedades; Relacion -> propiedades + _type/_start/_end;
+## Path -> {"nodes": [...], "relationships": [...]}; fechas -> ISO 8601.
+
+_SCALARS = frozenset((int, float, str, bool, type(None)))
+_TEMPORAL = frozenset((Date, DateTime, Time, Duration))
+
+
+def _props(entity, props):
+    if props is None:
+        values = dict(entity.items())
+    else:
+        values = {key: entity[key] for key in props if key in entity}
+    for key, value in values.items():
+        if type(value) in _TEMPORAL:
+            values[key] = value.iso_format()
+    return values
+
+
+def _endpoint(node):
+    if node is None:
+        return None
+    return node.get("id", node.element_id)
+
+
+def _shape_node(value, props):
+    return _props(value, props)
+
+
+def _shape_relationship(value, props):
+    shaped = _props(value, props)
+    shaped["_type"] = value.type
+    shaped["_start"] = _endpoint(value.start_node)
+    shaped["_end"] = _endpoint(value.end_node)
+    return shaped
+
+
+def _shape_path(value, props):
+    return {
+        "nodes": [_shape_node(n, props) for n in value.nodes],
+        "relationships": [_shape_relationship(r, props) for r in value.relationships],
+    }
+
+
+def shape_value(value, props=None):
+    kind = type(value)
+    if kind in _SCALARS:
+        return value
+    if kind is Node:
+        return _shape_node(value, props)
+    if kind is list:
+        return [shape_value(v, props) for v in value]
+    if kind is dict:
+        return {k: shape_value(v, props) for k, v in value.items()}
+    if kind in _TEMPORAL:
+        return value.iso_format()
+    # las relaciones son subclases dinamicas de Relationship (una por tipo)
+    if isinstance(value, Relationship):
+        return _shape_relationship(value, props)
+    if isinstance(value, Path):
+        return _shape_path(value, props)
+    return value
+
+
+## props: lista opcional de propiedades a conservar de nodos y relaciones.
+## keys: claves del resultado (result.keys()), evita Record.items() por registro.
+def shape_record(record, props=None, keys=None):
+    if keys is None:
+        keys = record.keys()
+    return {key: shape_value(value, props) for key, value in zip(keys, record)}
@@ -0,0 +1,276 @@
+import time
+
+import numpy as np
+
+from model import RELACIONES
+
+## Modelo de lectura en memoria para /rec/*: el subgrafo que recorren by_user_similartiy,
+## by_subgenre, by_actor y by_director cargado en arreglos (CSR por tipo de relacion y
+## columnas NumPy por label). Un GraphSnapshot no se modifica despues de construido:
+## cada refresco construye uno nuevo y se reemplaza la referencia (cambio atomico).
+## Devuelve las mismas filas que las consultas Cypher equivalentes de model.GraphDB.
+
+# labels cargados; de los de SNAPSHOT_FULL se guardan todas las propiedades
+SNAPSHOT_LABELS = ("Usuario", "Pelicula", "Genero", "Actor", "Director")
+SNAPSHOT_FULL = ("Pelicula", "Genero")
+
+# relaciones cargadas -> propiedad usada como peso (None: sin peso)
+SNAPSHOT_RELS = {
+    "VIO": None,
+    "SIMILAR_A": "score",
+    "PERTENECE_A": None,
+    "ADMIRA": "nivel_admiracion",
+    "PARTICIPO_EN": None,
+    "SIGUE": "nivel_interes",
+    "DIRIGIDA_POR": None,
+}
+EXTREMOS = {**{rel: RELACIONES[rel][:2] for rel in SNAPSHOT_RELS if rel in RELACIONES},
+            "SIMILAR_A": ("Pelicula", "Pelicula")}
+# relaciones que tambien se recorren hacia atras (destino -> origen)
+REVERSAS = ("PERTENECE_A", "DIRIGIDA_POR")
+
+
+## Adyacencia comprimida: los vecinos de la fila i son indices[indptr[i]:indptr[i + 1]]
+class CSR:
+    __slots__ = ("indptr", "indices", "weight")
+
+    def __init__(self, rows, src, dst, weight=None):
+        order = np.argsort(src, kind="stable")
+        self.indptr = np.zeros(rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=rows), out=self.indptr[1:])
+        self.indices = dst[order].astype(np.int32)
+        self.weight = None if weight is None else weight[order]
+
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    ## vecinos de varias filas a la vez: (posicion de la fila en `rows`, vecino, peso)
+    def gather(self, rows):
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        ends = np.cumsum(counts)
+        offsets = np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+        weight = None if self.weight is None else self.weight[offsets]
+        return np.repeat(np.arange(len(rows)), counts), self.indices[offsets], weight
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + (0 if self.weight is None else self.weight.nbytes)
+
+
+## Nodos de un label ordenados por id; la posicion en `ids` es el indice usado en las CSR
+class NodeTable:
+    __slots__ = ("ids", "nodes")
+
+    def __init__(self, ids, nodes=None):
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.nodes = None if nodes is None else nodes[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    ## posiciones de `ids` (-1 si no estan)
+    def index(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(self.ids[pos] == ids, pos, -1)
+
+    def find(self, node_id):
+        return int(self.index([node_id])[0])
+
+
+def _column(nodes, prop, dtype=np.float64):
+    return np.array([np.nan if n.get(prop) is None else n[prop] for n in nodes], dtype=dtype)
+
+
+class GraphSnapshot:
+    __slots__ = ("tables", "out", "inn", "rating", "sub_names", "genre_subs", "sub_genres",
+                 "built_at", "seconds")
+
+    ## filas de GraphDB.snapshot_nodes ({label, id, node}) y snapshot_edges ({rel, a, b, w})
+    @classmethod
+    def from_rows(cls, node_rows, edge_rows):
+        start = time.perf_counter()
+        snap = cls.__new__(cls)
+        by_label = {label: ([], []) for label in SNAPSHOT_LABELS}
+        for row in node_rows:
+            ids, nodes = by_label[row["label"]]
+            ids.append(row["id"])
+            nodes.append(row["node"])
+        snap.tables = {}
+        for label, (ids, nodes) in by_label.items():
+            full = None
+            if label in SNAPSHOT_FULL:
+                full = np.empty(len(nodes), dtype=object)
+                full[:] = nodes
+            snap.tables[label] = NodeTable(np.array(ids, dtype=np.int64), full)
+
+        by_rel = {rel: ([], [], []) for rel in SNAPSHOT_RELS}
+        for row in edge_rows:
+            a, b, w = by_rel[row["rel"]]
+            a.append(row["a"])
+            b.append(row["b"])
+            w.append(row["w"])
+        snap.out, snap.inn = {}, {}
+        for rel, (a, b, w) in by_rel.items():
+            from_t, to_t = (snap.tables[label] for label in EXTREMOS[rel])
+            src, dst = from_t.index(a), to_t.index(b)
+            # aristas cuyos extremos no estan (creados entre las dos lecturas) se descartan
+            keep = (src >= 0) & (dst >= 0)
+            src, dst = src[keep], dst[keep]
+            weight = None
+            if SNAPSHOT_RELS[rel] is not None:
+                weight = np.array([np.nan if v is None else v for v in w], dtype=np.float64)[keep]
+            snap.out[rel] = CSR(len(from_t), src, dst, weight)
+            if rel in REVERSAS:
+                snap.inn[rel] = CSR(len(to_t), dst, src, weight)
+
+        snap.rating = _column(snap.tables["Pelicula"].nodes, "rating")
+        # subgeneros como CSR Genero -> subgenero sobre un vocabulario ordenado,
+        # asi el orden de los indices coincide con el orden alfabetico
+        generos = snap.tables["Genero"].nodes
+        lists = [n.get("subgeneros") or [] for n in generos]
+        snap.sub_names = np.array(sorted({s for subs in lists for s in subs}), dtype=object)
+        vocab = {s: i for i, s in enumerate(snap.sub_names)}
+        g_idx = np.repeat(np.arange(len(lists)), [len(subs) for subs in lists])
+        s_idx = np.array([vocab[s] for subs in lists for s in subs], dtype=np.int64)
+        snap.genre_subs = CSR(len(lists), g_idx, s_idx)
+        snap.sub_genres = CSR(len(snap.sub_names), s_idx, g_idx)
+        snap.built_at = time.time()
+        snap.seconds = time.perf_counter() - start
+        return snap
+
+    def _user(self, id):
+        return self.tables["Usuario"].find(int(id))
+
+    def has_user(self, id):
+        return self._user(id) >= 0
+
+    def stats(self):
+        csrs = [*self.out.values(), *self.inn.values(), self.genre_subs, self.sub_genres]
+        return {
+            "nodes": {label: len(t) for label, t in self.tables.items()},
+            "edges": {rel: len(csr.indices) for rel, csr in self.out.items()},
+            "bytes": sum(c.nbytes for c in csrs) + sum(t.ids.nbytes for t in self.tables.values()) + self.rating.nbytes,
+            "built_at": self.built_at,
+            "build_seconds": round(self.seconds, 3),
+        }
+
+    ## orden estable por (puntaje DESC, [rating DESC,] id ASC) y ventana skip/limit.
+    ## Como en Cypher, un rating nulo va primero en orden descendente.
+    def _rank(self, movies, score, skip, limit, by_rating=False):
+        ids = self.tables["Pelicula"].ids[movies]
+        keys = (ids, -np.nan_to_num(self.rating[movies], nan=np.inf), -score) if by_rating else (ids, -score)
+        return np.lexsort(keys)[int(skip):int(skip) + int(limit)]
+
+    def _movie(self, i):
+        return self.tables["Pelicula"].nodes[i]
+
+    ## nodos Pelicula por id, o None si falta alguno (creado despues de la carga)
+    def movie_nodes(self, ids):
+        table = self.tables["Pelicula"]
+        pos = table.index(ids)
+        if (pos < 0).any():
+            return None
+        return {int(i): table.nodes[p] for i, p in zip(ids, pos)}
+
+    def _seen(self, u):
+        return np.unique(self.out["VIO"].row(u))
+
+    ## indices de pelicula y puntajes de by_user_similartiy para el usuario en la posicion u
+    def _similar_scores(self, u, limit):
+        seen = self._seen(u)
+        _, new, score = self.out["SIMILAR_A"].gather(seen)
+        keep = ~np.isin(new, seen)
+        movies, inverse = np.unique(new[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=score[keep], minlength=len(movies))
+        order = self._rank(movies, totals, 0, limit)
+        return movies[order], totals[order]
+
+    ## ver GraphDB.by_user_similartiy
+    def by_user_similartiy(self, id, limit=10):
+        u = self._user(id)
+        if u < 0:
+            return []
+        movies, scores = self._similar_scores(u, limit)
+        return [{"new": self._movie(m), "score": float(s)} for m, s in zip(movies, scores)]
+
+    ## by_user_similartiy de todos los usuarios: (id de usuario, ids de pelicula, puntajes)
+    def user_similarity_all(self, limit=10):
+        movie_ids = self.tables["Pelicula"].ids
+        for u, user_id in enumerate(self.tables["Usuario"].ids):
+            movies, scores = self._similar_scores(u, limit)
+            yield int(user_id), movie_ids[movies], scores
+
+    ## ver GraphDB.by_subgenre
+    def by_subgenre(self, id, limit=5, subgenres=1):
+        u = self._user(id)
+        if u < 0:
+            return []
+        vistos = self.out["VIO"].row(u)
+        # cada camino usuario-pelicula-genero-subgenero cuenta una vez (como el MATCH + UNWIND)
+        _, generos, _ = self.out["PERTENECE_A"].gather(vistos)
+        _, subs, _ = self.genre_subs.gather(generos)
+        freq = np.bincount(subs, minlength=len(self.sub_names))
+        candidatos = np.nonzero(freq)[0]
+        favs = candidatos[np.lexsort((candidatos, -freq[candidatos]))][:int(subgenres)]
+        if not len(favs):
+            return []
+        total = freq[favs].sum()
+        fav_pos, generos, _ = self.sub_genres.gather(favs)
+        pos, movies, _ = self.inn["PERTENECE_A"].gather(generos)
+        fav_pos = fav_pos[pos]
+        keep = ~np.isin(movies, vistos)
+        # DISTINCT (pelicula, subgenero)
+        pairs = np.unique(movies[keep].astype(np.int64) * len(favs) + fav_pos[keep])
+        pair_movie, pair_fav = pairs // len(favs), pairs % len(favs)
+        movies, inverse = np.unique(pair_movie, return_inverse=True)
+        afinidad = np.bincount(inverse, weights=freq[favs][pair_fav] / total, minlength=len(movies))
+        rows = []
+        for i in self._rank(movies, afinidad, 0, limit, by_rating=True):
+            rows.append({
+                "n": self._movie(movies[i]),
+                "afinidad": float(afinidad[i]),
+                "subgeneros": self.sub_names[favs[pair_fav[inverse == i]]].tolist(),
+            })
+        return rows
+
+    ## Usuario -[rel {peso}]-> X, X -> Pelicula por `paso`: nivel acumulado x rating, sin vistas
+    def _by_followed(self, id, rel, paso, via_label, limit, skip):
+        u = self._user(id)
+        if u < 0:
+            return []
+        follows = self.out[rel]
+        start, end = follows.indptr[u], follows.indptr[u + 1]
+        targets = follows.indices[start:end]
+        nivel = np.nan_to_num(follows.weight[start:end], nan=1.0)
+        pos, movies, _ = paso.gather(targets)
+        keep = ~np.isin(movies, self._seen(u))
+        pos, movies = pos[keep], movies[keep]
+        uniq, inverse = np.unique(movies, return_inverse=True)
+        level = np.bincount(inverse, weights=nivel[pos], minlength=len(uniq))
+        score = level * np.nan_to_num(self.rating[uniq], nan=0.0)
+        via_ids = self.tables[via_label].ids[targets]
+        rows = []
+        for i in self._rank(uniq, score, skip, limit):
+            level_i = float(level[i])
+            rows.append((
+                self._movie(uniq[i]),
+                float(score[i]),
+                int(level_i) if level_i.is_integer() else level_i,
+                np.unique(via_ids[pos[inverse == i]]).tolist(),
+            ))
+        return rows
+
+    ## ver GraphDB.by_actor
+    def by_actor(self, id, limit=10, skip=0):
+        rows = self._by_followed(id, "ADMIRA", self.out["PARTICIPO_EN"], "Actor", limit, skip)
+        return [{"other": m, "score": s, "admiracion": v, "actores": via} for m, s, v, via in rows]
+
+    ## ver GraphDB.by_director
+    def by_director(self, id, limit=10, skip=0):
+        rows = self._by_followed(id, "SIGUE", self.inn["DIRIGIDA_POR"], "Director", limit, skip)
+        return [{"other": m, "score": s, "interes": v, "directores": via} for m, s, v, via in rows]